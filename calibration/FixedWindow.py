@@ -5,7 +5,6 @@ import sys
 import glob
 import json
 import logging
-import time
 import math
 import argparse
 import signal #for graceful exit
@@ -22,6 +21,7 @@ import matplotlib.animation as animation
 from matplotlib.font_manager import FontProperties
 
 import selutil
+from JsonWatcher import JsonWatcher
 
 from IPython import embed
 
@@ -65,6 +65,14 @@ class FixedWindow(object):
 
     self.traces = traceslist
     self.setup_traces()
+
+    # Number of timesteps currently drawn, see update(..)
+    self.shown = 0
+
+    # New json files are picked up from the watcher's queue on each frame,
+    # instead of polling the directory; load whatever is already there first.
+    self.watcher = JsonWatcher(TMPDIR)
+    self.load_all()
     #plt.setp([a.set_xlabel('') for a in self.axes[1:-self.spcols]], visible=False)
 
 
@@ -72,96 +80,50 @@ class FixedWindow(object):
                                        init_func=self.setup_plot, blit=True)
 
 
+  def load_file(self, path):
+    '''Puts the data from one json file in the traces. Returns False if it can't be read.'''
+    try:
+      i = selutil.jfname2idx(os.path.splitext(os.path.basename(path))[0]) - self.startidx
+    except (AssertionError, ValueError):
+      return False # Not one of ours.
+    if i < 0 or i >= self.timerange:
+      return False
+    try:
+      with open(path) as f:
+        new_data = json.load(f)
+    except (IOError, ValueError) as e:
+      logging.debug("Unable to read %s (%s)" % (path, e))
+      return False
+    for trace in self.traces:
+      trace['data'][i] = new_data[trace['jsontag']]
+    return True
+
+  def load_all(self):
+    '''Loads every json file in TMPDIR that falls in the time range.'''
+    for path in sorted(glob.glob(TMPDIR + "/*.json")):
+      self.load_file(path)
+
   def update(self, frame):
     '''Update plots from json files in /tmp/cal-dvmdostem/'''
     logging.info("Frame %7i" %frame)
 
-    #wait until there are files
-    while True:
-      jsonfiles = glob.glob(TMPDIR + "/*.json")
-      if len(jsonfiles) > 0:
-        break
-      time.sleep(.1)#seconds
+    for kind, path in self.watcher.events():
+      if kind == 'written':
+        self.load_file(path)
+      elif kind == 'reset':
+        self.load_all()
+
+    # Draw up to the first timestep that isn't there yet, at most 15 more
+    # timesteps per frame to create a 'scrolling' effect.
+    filled = ~np.isnan([trace['data'] for trace in self.traces]).any(axis=0)
+    available = self.timerange if filled.all() else int(np.argmin(filled))
+    if available == self.shown:
+      return [] # Nothing new, nothing to draw.
+    i = min(available, self.shown + 15)
+    self.shown = i
 
-    idx = 0
-    newvalues = 0
     redraw_needed = False;#Used to determine if y-axis limits have changed.
 
-    for i in np.arange(0,self.timerange):
-      file = TMPDIR + '/' + selutil.idx2jfname(self.startidx+i)
-      #print file
-      for trace in self.traces:
-        try:
-          if(np.isnan(trace['data'][i])):
-            try:
-              while not os.path.isfile(file):
-                time.sleep(.1)
-              #print file
-              with open(file) as f:
-                try:
-                  new_data = json.load(f)
-                except ValueError as ex:
-                  pass
-              trace['data'][i] = new_data[trace['jsontag']]
-              newvalues += 1
-            except IOError as e:
-              print("file doesn't exist")
-
-            #extract PAR per PFT data. This may not be necessary for now.
-            ################################
-            # if new_data['Month'] == 7: #July
-            #   PARA_perPFT = []
-            #   PARD_perPFT = []
-            #   for i in np.arange(0,9+1):
-            #     PARA_perPFT.append(new_data['PFT' + str(i)]['PARAbsorb'])
-            #     PARD_perPFT.append(new_data['PFT' + str(i)]['PARDown'])
-            #   PARA_month_total = math.fsum(PARA_perPFT)
-            #   PARD_month_total = math.fsum(PARD_perPFT)
-            #   PARA_month_percent = [(val / PARA_month_total)*100 for val in PARA_perPFT]
-            #   PARD_month_percent = [(val / PARD_month_total)*100 for val in PARD_perPFT]
-            ################################
-        except IndexError as e:
-          logging.error("Index out of bounds")
-          logging.error("Length of data container: %i"%len(trace['data']))
-          logging.error("Index: %i"%idx)
-          embed()
-      #To create a 'scrolling' effect
-      if (newvalues/len(self.traces)) >= 15:
-        newvalues = 0
-        break
-
-    # for file in jsonfiles:
-    #   idx = selutil.jfname2idx(os.path.splitext(os.path.basename(file))[0])
-    #   modidx = idx-self.startidx
-    #   if idx >= self.startidx and idx < self.startidx+self.timerange:
-    #     for trace in self.traces:
-    #       try:
-    #         if(np.isnan(trace['data'][modidx])):
-    #           with open(file) as f:
-    #             try:
-    #               new_data = json.load(f)
-    #             except ValueError as ex:
-    #               pass
-    #           trace['data'][modidx] = new_data[trace['jsontag']]
-    #           #extract PAR per PFT data. This may not be necessary for now.
-    #           ################################
-    #           # if new_data['Month'] == 7: #July
-    #           #   PARA_perPFT = []
-    #           #   PARD_perPFT = []
-    #           #   for i in np.arange(0,9+1):
-    #           #     PARA_perPFT.append(new_data['PFT' + str(i)]['PARAbsorb'])
-    #           #     PARD_perPFT.append(new_data['PFT' + str(i)]['PARDown'])
-    #           #   PARA_month_total = math.fsum(PARA_perPFT)
-    #           #   PARD_month_total = math.fsum(PARD_perPFT)
-    #           #   PARA_month_percent = [(val / PARA_month_total)*100 for val in PARA_perPFT]
-    #           #   PARD_month_percent = [(val / PARD_month_total)*100 for val in PARD_perPFT]
-    #           ################################
-    #       except IndexError as e:
-    #         logging.error("Index out of bounds")
-    #         logging.error("Length of data container: %i"%len(trace['data']))
-    #         logging.error("Index: %i"%idx)
-    #         embed()
-   
     for trace in self.traces:
       a = trace['artist'][0]
       artistlength = min(i, self.viewport)
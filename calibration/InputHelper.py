@@ -1,11 +1,10 @@
 import os
 import sys
 import glob
-import json
+import operator
+import functools
 import logging
 import textwrap
-import tarfile        # for reading from tar.gz files
-import shutil         # for cleaning up a /tmp directory
 import numpy as np
 
 # Find the path to the this file so that we can look, relative to this file
@@ -13,30 +12,158 @@ import numpy as np
 sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
 
 import scripts.param_util as pu
+import scripts.archive_util as au
+import scripts.calstore as cs
 
 
-def yearly_files(tarfileobj):
-  '''Get the */yearly/*.json files...'''
-  for tarinfo in tarfileobj:
-    if 'yearly' in tarinfo.name:
-      yield tarinfo
+# Name of the file (stored next to the .json files) that holds the columnar
+# cache of the flattened json data. See InputHelper.columns(..)
+COLUMN_CACHE_FILE = '.json-columns.npz'
+
+def flatten_json(data, prefix=''):
+  '''
+  Flattens the nested dicts of a calibration json file into a single dict
+  with dotted keys, e.g. data['PFT3']['VegCarbon']['Leaf'] becomes
+  'PFT3.VegCarbon.Leaf'.
+  '''
+  flat = {}
+  for k, v in data.items():
+    key = prefix + k
+    if isinstance(v, dict):
+      flat.update(flatten_json(v, key + '.'))
+    else:
+      flat[key] = v
+  return flat
+
+# Length of the text fields (e.g. 'CMT', 'Runstage') in a JsonSchema dtype.
+SCHEMA_TEXT_LENGTH = 32
+
+class JsonSchema(object):
+  '''
+  The layout of a series of calibration json records (all the files from a
+  run have the same fields), discovered from one record. Turns each record
+  into one row of a numpy structured array with a field for each flattened
+  name (see flatten_json(..)): floats for numbers and booleans, text
+  otherwise. Per-PFT and per-compartment values can then be reduced along
+  an array axis, see pft_stack(..):
+
+    >>> schema = JsonSchema.from_file(files[0])
+    >>> records, ok = schema.load(files)
+    >>> pft_stack(records, 'VegCarbon').sum(axis=(1, 2)) # ecosystem totals
+
+  The rows are made by looking up the key path of each field directly, so
+  the nested dicts are not flattened for every record. Records that don't
+  fit the layout fall back to flatten_json(..), with nan (or '') for
+  missing fields.
+  '''
+  def __init__(self, record):
+    flat = flatten_json(record)
+    self.names = list(flat.keys())
+    self.dtype = np.dtype([(n, 'U%d' % SCHEMA_TEXT_LENGTH if isinstance(v, str) else 'f8') for n, v in flat.items()])
+    self._text = set(n for n, v in flat.items() if isinstance(v, str))
+    self._flatten = self._compile(self.names)
+
+  @classmethod
+  def from_file(cls, path):
+    return cls(au.load_json(path))
+
+  @staticmethod
+  def _compile(names):
+    '''
+    Returns a function that picks the values for `names` out of a nested
+    record, e.g. d['PFT0']['VegCarbon']['Leaf'] for 'PFT0.VegCarbon.Leaf'.
+    '''
+    paths = [n.split('.') for n in names]
+    return lambda d: tuple(functools.reduce(operator.getitem, p, d) for p in paths)
+
+  def _slow_row(self, record):
+    flat = flatten_json(record)
+    row = []
+    for n in self.names:
+      v = flat.get(n)
+      if n in self._text:
+        row.append('' if v is None else str(v))
+      else:
+        row.append(np.nan if v is None or isinstance(v, str) else v)
+    return tuple(row)
+
+  def row(self, record):
+    '''Returns `record` (nested json data) as a tuple in the schema order.'''
+    try:
+      return self._flatten(record)
+    except (KeyError, TypeError, IndexError):
+      return self._slow_row(record)
+
+  def array(self, records):
+    '''Returns a structured array with one row per record.'''
+    rows = [self.row(r) for r in records]
+    try:
+      return np.array(rows, dtype=self.dtype)
+    except (TypeError, ValueError):
+      # Something the fast path let through (e.g. a null) doesn't fit.
+      return np.array([self._slow_row(r) for r in records], dtype=self.dtype)
+
+  def load(self, files):
+    '''
+    Reads `files` (paths or virtual paths, see scripts/archive_util.py) into
+    a structured array. Returns (records, ok); files that can't be read get
+    nan (and '') and False in the boolean array `ok`.
+    '''
+    records, ok = [], np.ones(len(files), dtype=bool)
+    for i, f in enumerate(files):
+      try:
+        records.append(au.load_json(f))
+      except (IOError, OSError, ValueError) as e:
+        logging.error("Problem: '%s' reading file '%s'" % (e, f))
+        records.append({})
+        ok[i] = False
+    return self.array(records), ok
+
+def pft_stack(records, key, pfts=range(0, 10), compartments=None):
+  '''
+  Returns the values of a per-PFT field from `records` (a structured array,
+  or row, see JsonSchema) as a float array with a PFT axis appended to the
+  record shape, e.g. (N, 10) for 'GPPAllIgnoringNitrogen'. Compartment
+  fields (e.g. 'VegCarbon') get a compartment axis too: (N, 10, 3) for
+  ('Leaf', 'Stem', 'Root'), or just `compartments` if given.
+  '''
+  names = records.dtype.names
+  pfts = list(pfts)
+  probe = pfts[0] if len(pfts) > 0 else 0
+  if compartments is None and ('PFT%d.%s' % (probe, key)) not in names:
+    compartments = [c for c in ['Leaf', 'Stem', 'Root'] if 'PFT%d.%s.%s' % (probe, key, c) in names]
+    if len(compartments) == 0:
+      raise KeyError("Can't find per-PFT field '%s' in the records." % key)
+  if len(pfts) == 0:
+    return np.zeros(np.shape(records) + (0,) + ((len(compartments),) if compartments else ()))
+  if compartments:
+    values = [[records['PFT%d.%s.%s' % (p, key, c)] for c in compartments] for p in pfts]
+    return np.moveaxis(np.asarray(values, dtype=np.float64), (0, 1), (-2, -1))
+  values = [records['PFT%d.%s' % (p, key)] for p in pfts]
+  return np.moveaxis(np.asarray(values, dtype=np.float64), 0, -1)
 
-def monthly_files(tarfileobj):
-  '''Get the */monthly/*.json files...'''
-  for tarinfo in tarfileobj:
-    if 'monthly' in tarinfo.name:
-      yield tarinfo
 
 
 class InputHelper(object):
   '''A class to help abstract some of the details of opening .json files
   '''
-  def __init__(self, path, monthly=False):
+  def __init__(self, path, monthly=False, stage=None):
     logging.debug("Making an InputHelper object...")
     logging.debug("Looking for input files here: %s" % path )
 
     self._monthly = monthly
 
+    # In memory copy of the columnar cache, see columns(..)
+    self._cache = None
+
+    # Set if the json files are read from an archive
+    self._archive = None
+
+    # Set if the data is read from a calibration store; `stage` picks the
+    # run stage(s) to read from it (default: all of them, in run order).
+    self._store = None
+    self._stage = stage
+
     # Assume path is a directory full of .json files
     if os.path.isdir(path):
       if self._monthly:
@@ -46,55 +173,45 @@ class InputHelper(object):
 
       logging.debug("Set input data path to: %s" % self._path)
 
-    elif os.path.isfile(path):
-      # Assume path is a .tar.gz (or other compression) with .json files in it
+    elif cs.is_store(path):
+      # A calibration store (see scripts/calstore.py). The data is queried
+      # from the store directly, so there is no column cache, and files()
+      # returns virtual paths like STORE/yearly/eq/00000.json
+      logging.info("Reading input data from calibration store: %s" % path)
+      self._store = cs.get_store(path)
+      self._store_path = path
+      self._path = cs.member_path(path, self._which(), stage or '*', '')[:-1]
 
+    elif os.path.isfile(path):
+      # Assume path is a .tar.gz (or other compression) with .json files in it.
+      # Nothing is extracted; the files are read straight out of the archive
+      # (see scripts/archive_util.py) and files() returns "virtual" paths
+      # like ARCHIVE/tmp/dvmdostem/calibration/yearly/00000.json. The
+      # directory holding the yearly (or monthly) files is found by looking
+      # at the archive members, so self._path adapts to whatever the user may
+      # have set for 'caldata_tree_loc' in the config file.
       logging.info("Looking for input data files here: %s" % path)
 
-      DEFAULT_EXTRACTED_ARCHIVE_LOCATION = os.path.join('/tmp', 'dvmdostem-user-{}'.format(str(os.getuid())), 'extracted-calibration-archive', os.path.basename(path))
-
-      logging.info("Extracting archive to '%s'..." %
-          DEFAULT_EXTRACTED_ARCHIVE_LOCATION)
-
-      if ( os.path.isdir(DEFAULT_EXTRACTED_ARCHIVE_LOCATION) or
-          os.path.isfile(DEFAULT_EXTRACTED_ARCHIVE_LOCATION) ):
-
-        logging.info("Cleaning up the temporary archive location ('%s')..." %
-            DEFAULT_EXTRACTED_ARCHIVE_LOCATION)
-        shutil.rmtree(DEFAULT_EXTRACTED_ARCHIVE_LOCATION)
-
-      tf = tarfile.open(path)
-
-      # This is annoying, but when extracting the files, they end up in a
-      # directory tree like this (depending on the directory structure of
-      # the archive):
-      #
-      #   {DEFAULT_EXTRACTED_ARCHIVE_LOCATION}/tmp/TESTME/dvmdostem/calibration/yearly/00000.json
-      #   {DEFAULT_EXTRACTED_ARCHIVE_LOCATION}/tmp/TESTME/dvmdostem/calibration/yearly/00001.json
-      #   ...
-      #
-      # So the following cryptic lines attempt to figure out the common prefix
-      # of all the members of the TarFile and then use that to setup self._path
-      # Basically allows self._path to adapt and match whatever the user may have
-      # set for 'caldata_tree_loc' in the config file.
-      p1 = [i for i in tf.getmembers() if i.isdir()]
-      p2 = [i.name for i in p1]
-      p3 = os.path.commonprefix(p2)
-
-      if self._monthly:
-        self._path = os.path.join(DEFAULT_EXTRACTED_ARCHIVE_LOCATION, p3, 'monthly')
-        tf.extractall(DEFAULT_EXTRACTED_ARCHIVE_LOCATION, members=monthly_files(tf))
+      self._archive = au.get_archive(path)
+      self._archive_path = path
+      members = self._archive.json_members(self._which())
+      if len(members) > 0:
+        self._path = au.member_path(path, os.path.dirname(members[0]))
       else:
-        self._path = os.path.join(DEFAULT_EXTRACTED_ARCHIVE_LOCATION, p3, 'yearly')
-        tf.extractall(DEFAULT_EXTRACTED_ARCHIVE_LOCATION, members=yearly_files(tf))
+        self._path = au.member_path(path, self._which())
+
+      logging.debug("Set input data path to: %s" % self._path)
 
-      tf.close()
     else:
       logging.error("Unable to find input data files at %s" % path)
       sys.exit(-1)
 
   def files(self):
     '''Returns a list of files, either in a directory or .tar.gz archive'''
+    if self._archive is not None:
+      return [au.member_path(self._archive_path, m) for m in self._archive.json_members(self._which())]
+    if self._store is not None:
+      return self._store.files(self._which(), self._stage)
     return sorted( glob.glob('%s/*.json' % self._path) )
 
   def path(self):
@@ -104,6 +221,188 @@ class InputHelper(object):
   def monthly(self):
     return self._monthly
 
+  def _which(self):
+    return 'monthly' if self._monthly else 'yearly'
+
+  def is_archive(self):
+    '''True if the files are being read from an archive.'''
+    return self._archive is not None
+
+  def is_static(self):
+    '''True if the files can't change (read from an archive or store).'''
+    return self._archive is not None or self._store is not None
+
+  def load_json(self, f):
+    '''Loads one of the json files (works for files in an archive too).'''
+    return au.load_json(f)
+
+  def mtime(self, f):
+    '''Modification time of one of the json files.'''
+    return au.getmtime(f)
+
+  def cache_path(self):
+    '''Path to the file holding the columnar cache of the json data.'''
+    if self._archive is not None:
+      return self._archive.index_path('-' + self._which() + COLUMN_CACHE_FILE)
+    return os.path.join(self._path, COLUMN_CACHE_FILE)
+
+  def _load_cache(self):
+    '''Reads the cache file, returns None if it is missing or unreadable.'''
+    try:
+      with np.load(self.cache_path()) as npz:
+        cache = {k: npz[k] for k in npz.files}
+    except (IOError, OSError, ValueError) as e:
+      logging.debug("No usable column cache at %s (%s)" % (self.cache_path(), e))
+      return None
+    cache['__files__'] = list(cache['__files__'])
+    return cache
+
+  def _save_cache(self, cache):
+    tmp = self.cache_path() + '.tmp.npz'
+    try:
+      np.savez(tmp, **cache)
+      os.rename(tmp, self.cache_path())
+    except (IOError, OSError) as e:
+      logging.warning("Unable to save column cache to %s (%s)" % (self.cache_path(), e))
+
+  def refresh_columns(self):
+    '''
+    Brings the columnar cache up to date with the json files and returns the
+    number of files that had to be parsed.
+
+    A file is re-parsed only if it is new or its modification time changed
+    since it was cached; everything else is copied from the cache. Files that
+    can't be read (e.g. are still being written) get nan and are re-parsed
+    next time.
+    '''
+    if self._store is not None:
+      return 0 # The store is a column store already.
+
+    files = self.files()
+    names = [os.path.basename(f) for f in files]
+    mtimes = np.array([self.mtime(f) for f in files], dtype=np.float64)
+
+    old = self._cache if self._cache is not None else self._load_cache()
+    if old is None:
+      old = {'__files__': [], '__mtimes__': np.zeros(0)}
+
+    if old['__files__'] == names and np.array_equal(old['__mtimes__'], mtimes):
+      self._cache = old
+      return 0
+
+    old_rows = dict((n, i) for i, n in enumerate(old['__files__']))
+    keep_new, keep_old, parse = [], [], []
+    for i, (n, m) in enumerate(zip(names, mtimes)):
+      j = old_rows.get(n)
+      if j is not None and old['__mtimes__'][j] == m:
+        keep_new.append(i)
+        keep_old.append(j)
+      else:
+        parse.append(i)
+
+    parsed = []
+    for i in parse:
+      try:
+        parsed.append(flatten_json(self.load_json(files[i])))
+      except (IOError, ValueError) as e:
+        logging.error("Problem: '%s' reading file '%s'" % (e, files[i]))
+        parsed.append({})
+        mtimes[i] = -1 # Forces a re-read next time.
+
+    fields = [k for k in old if not k.startswith('__')]
+    known = set(fields)
+    for row in parsed:
+      for k in row:
+        if k not in known:
+          known.add(k)
+          fields.append(k)
+
+    cache = {'__files__': names, '__mtimes__': mtimes}
+    for k in fields:
+      values = [row.get(k) for row in parsed]
+      is_str = k in old and old[k].dtype.kind == 'U'
+      is_str = is_str or any(isinstance(v, str) for v in values)
+      if is_str:
+        col = np.full(len(files), '', dtype=object)
+        col[parse] = [('' if v is None else str(v)) for v in values]
+      else:
+        col = np.full(len(files), np.nan)
+        col[parse] = [(np.nan if v is None else float(v)) for v in values]
+      if k in old:
+        col[keep_new] = old[k][keep_old]
+      cache[k] = col.astype(str) if is_str else col
+
+    logging.info("Parsed %i of %i json files for the column cache." % (len(parse), len(files)))
+    self._cache = cache
+    self._save_cache(dict(cache, __files__=np.array(names, dtype=str)))
+    return len(parse)
+
+  def fields(self):
+    '''Returns a list of the flattened field names that are available.'''
+    if self._store is not None:
+      return self._store.fields(self._which())
+    self.refresh_columns()
+    return [k for k in self._cache if not k.startswith('__')]
+
+  def columns(self, names):
+    '''
+    Returns a dict mapping each of the flattened field `names` (e.g.
+    'PFT3.VegCarbon.Leaf' or 'CMT') to a numpy array with one value per file
+    in `self.files()` (same order). Numeric and boolean fields are float
+    arrays with nan for files that are missing the field; text fields are
+    string arrays.
+
+    The values come from a columnar cache stored next to the json files
+    (see `refresh_columns()`), so json files are only parsed once.
+
+    Raises KeyError for a field that is not in any file.
+    '''
+    if self._store is not None:
+      if len(self.files()) == 0:
+        return dict((n, np.zeros(0)) for n in names)
+      known = set(self.fields())
+      for n in names:
+        if n not in known:
+          raise KeyError("Can't find field '%s' in the json files in %s" % (n, self._path))
+      found = self._store.query(self._which(), names, stage=self._stage)
+      return dict((n, found[n]) for n in names)
+    self.refresh_columns()
+    result = {}
+    for n in names:
+      if len(self._cache['__files__']) == 0:
+        result[n] = np.zeros(0)
+      elif n not in self._cache or n.startswith('__'):
+        raise KeyError("Can't find field '%s' in the json files in %s" % (n, self._path))
+      else:
+        result[n] = self._cache[n]
+    return result
+
+  def cached_files(self):
+    '''
+    Returns the list of files that the arrays from `columns(..)` line up
+    with. Same as `files()` unless files were added since the last refresh.
+    '''
+    if self._store is not None:
+      return self.files()
+    if self._cache is None:
+      self.refresh_columns()
+    return [os.path.join(self._path, n) for n in self._cache['__files__']]
+
+  def cached_mtimes(self):
+    '''
+    Returns the modification times recorded for `cached_files()`, -1 for
+    files that could not be read.
+    '''
+    if self._store is not None:
+      return np.array([m for s, n, m in self._store.records(self._which(), self._stage)], dtype=np.float64)
+    if self._cache is None:
+      self.refresh_columns()
+    return self._cache['__mtimes__']
+
+  def column(self, name):
+    '''Returns the array for a single field, see `columns(..)`.'''
+    return self.columns([name])[name]
+
 
   def coverage_report(self, file_list):
     '''Convenience function to write some info about files to the logs'''
@@ -170,13 +469,201 @@ class InputHelper(object):
     log = logging.getLogger('inputhelper::reportB')
     log.info( "::=> FILE %s" % (f0) )
     try:
-      with open(f0) as f:
-        fdata = json.load(f)
+      fdata = self.load_json(f0)
 
       "".format(fdata["Runstage"], fdata["CMT"], fdata["Lat"], fdata["Lon"])
       details = "Runstage:%s CMT:%s Coords:(%.2f,%.2f)" % (fdata["Runstage"], fdata["CMT"], fdata["Lat"], fdata["Lon"])
       log.info( "::==> %s" % (details) )
     except (IOError, ValueError) as e:
-      log.error("Problem: '%s' reading file '%s'" % (e, f))
+      log.error("Problem: '%s' reading file '%s'" % (e, f0))
 
 
+
+
+def find_changes(columns, watch):
+  '''
+  Returns a dict mapping each index where the value of one of the `watch`
+  columns changes (ignoring nan) to a tuple (field, new value).
+  '''
+  changes = {}
+  for k in watch:
+    c = columns[k]
+    known = ~np.isnan(c)
+    for idx in np.nonzero((c[1:] != c[:-1]) & known[1:] & known[:-1])[0] + 1:
+      changes[int(idx)] = (k, c[idx])
+  return changes
+
+
+class GrowableArray(object):
+  '''
+  A 1D float array that can be appended to. Storage is preallocated and
+  doubled whenever it fills up, so appending is cheap on average and
+  `view()` never copies.
+  '''
+  def __init__(self, capacity=1024):
+    self._data = np.full(max(1, capacity), np.nan)
+    self._n = 0
+
+  def __len__(self):
+    return self._n
+
+  def extend(self, values):
+    values = np.asarray(values, dtype=np.float64)
+    need = self._n + len(values)
+    if need > len(self._data):
+      bigger = np.full(max(need, 2 * len(self._data)), np.nan)
+      bigger[:self._n] = self._data[:self._n]
+      self._data = bigger
+    self._data[self._n:need] = values
+    self._n = need
+
+  def append(self, value):
+    self.extend([value])
+
+  def view(self):
+    '''The filled part of the array (not a copy).'''
+    return self._data[:self._n]
+
+
+class JsonTailReader(object):
+  '''
+  Follows the json files for an InputHelper while the model is writing them.
+
+  On creation (and whenever the files are reset) everything is loaded from
+  the InputHelper's column cache. After that, `update()` only looks for the
+  file that should come next (00042.json after 00041.json, etc), so the
+  cost of an update depends on the number of new files, not on the length
+  of the run. The data for `fields` is kept in `GrowableArray` buffers.
+
+  For the `watch` fields (e.g. module on/off flags) the previous record is
+  kept in memory and `changes` maps the index of each record where a value
+  changed to a tuple (field, new value).
+
+  If the last file read is deleted or rewritten (the model clears the json
+  directory between stages) the reader starts over.
+
+  With a `watcher` (a JsonWatcher on the input helper's directory) `update()`
+  does not touch the file system at all until the watcher has seen a file
+  being written or deleted.
+  '''
+  def __init__(self, input_helper, fields, watch=(), watcher=None):
+    self.input_helper = input_helper
+    self.fields = list(fields)
+    self.watch = list(watch)
+    self.watcher = watcher
+    self.reset()
+
+  def reset(self):
+    '''Reloads all the data from the column cache.'''
+    keys = self.fields + [k for k in self.watch if k not in self.fields]
+    cols = self.input_helper.columns(keys)
+    files = self.input_helper.cached_files()
+    mtimes = self.input_helper.cached_mtimes()
+
+    # Unreadable files at the end are probably still being written, leave
+    # them to be picked up by update().
+    n = len(files)
+    while n > 0 and mtimes[n - 1] < 0:
+      n -= 1
+
+    self.files = files[:n]
+    self._last_mtime = mtimes[n - 1] if n > 0 else None
+
+    self.buffers = {}
+    for k in keys:
+      self.buffers[k] = GrowableArray(2 * n)
+      self.buffers[k].extend(cols[k][:n])
+
+    self.changes = find_changes(dict((k, self.buffers[k].view()) for k in self.watch), self.watch)
+    self.prev = None
+    if n > 0:
+      self.prev = dict((k, self.buffers[k].view()[-1]) for k in self.watch)
+
+  def _next_file(self):
+    stem = os.path.splitext(os.path.basename(self.files[-1]))[0]
+    name = '%0*d.json' % (len(stem), int(stem) + 1)
+    return os.path.join(os.path.dirname(self.files[-1]), name)
+
+  def update(self):
+    '''
+    Reads any new files and returns the number of records added (all of
+    them, if the reader had to start over).
+    '''
+    if self.input_helper.is_static():
+      return 0 # Archives (and stores) don't change.
+
+    if self.watcher is not None:
+      events = self.watcher.events()
+      if len(events) == 0:
+        return 0
+      if any(kind != 'written' for kind, path in events):
+        self.reset()
+        return len(self.files)
+
+    if len(self.files) == 0:
+      self.reset()
+      return len(self.files)
+
+    try:
+      unchanged = self.input_helper.mtime(self.files[-1]) == self._last_mtime
+    except OSError:
+      unchanged = False
+    if not unchanged:
+      logging.info("json files in %s have been reset, reloading." % self.input_helper.path())
+      self.reset()
+      return len(self.files)
+
+    count = 0
+    while True:
+      nxt = self._next_file()
+      try:
+        mtime = self.input_helper.mtime(nxt)
+        record = flatten_json(self.input_helper.load_json(nxt))
+      except (IOError, OSError, ValueError):
+        break # Not there yet, or not completely written.
+
+      idx = len(self.files)
+      for k, buf in self.buffers.items():
+        v = record.get(k)
+        buf.append(np.nan if v is None else float(v))
+
+      current = dict((k, record.get(k)) for k in self.watch)
+      if self.prev is not None:
+        for k in self.watch:
+          p, c = self.prev[k], current[k]
+          if c is not None and p is not None and not (isinstance(p, float) and np.isnan(p)) and c != p:
+            self.changes[idx] = (k, c)
+      self.prev = current
+
+      self.files.append(nxt)
+      self._last_mtime = mtime
+      count += 1
+
+    return count
+
+  def column(self, name):
+    '''Returns the data for `name` (one of the fields) as an array view.'''
+    return self.buffers[name].view()
+
+
+
+class ColumnSeries(object):
+  '''
+  A read-only stand-in for a JsonTailReader over columns that are already
+  in memory (e.g. shared between the processes that render plots in bulk).
+  Has the same `files`, `fields`, `changes` and `column(..)` members, but
+  `update()` never finds anything new.
+  '''
+  def __init__(self, input_helper, files, columns, watch=()):
+    self.input_helper = input_helper
+    self.files = list(files)
+    self.fields = list(columns.keys())
+    self.watch = list(watch)
+    self._columns = columns
+    self.changes = find_changes(columns, self.watch)
+
+  def update(self):
+    return 0
+
+  def column(self, name):
+    return self._columns[name]
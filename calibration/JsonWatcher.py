@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+# Watches a directory for the json files that dvmdostem writes during a
+# calibration run, so that the live plots can wait for new data without
+# polling the file system on every animation frame.
+#
+# On Linux the kernel's inotify interface is used (through ctypes, no extra
+# packages needed) and a file is reported as soon as the model closes it.
+# Elsewhere (or if inotify is not available) the directory is checked with
+# os.stat(..) every `poll_interval` seconds and only listed when something
+# changed; a file is reported once its size and modification time have
+# stopped changing between two checks.
+#
+# Either way the events are put on a queue by a background thread and the
+# viewers take them off with `events()` whenever it suits them (e.g. once
+# per animation frame).
+
+import os
+import sys
+import glob
+import time
+import errno
+import fnmatch
+import logging
+import threading
+
+try:
+  import queue
+except ImportError:
+  import Queue as queue # python 2
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+
+# Event kinds put on the queue, each as a tuple (kind, path)
+WRITTEN = 'written' # a file was completely written (or moved into place)
+DELETED = 'deleted' # a file (or the directory itself) was removed
+RESET = 'reset'     # events were lost, clients should reload everything
+
+
+def _load_inotify():
+  '''Returns the C library if it has inotify, otherwise None.'''
+  if not sys.platform.startswith('linux'):
+    return None
+  try:
+    import ctypes
+    import ctypes.util
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+  except (OSError, AttributeError, ImportError):
+    return None
+  return libc
+
+
+class JsonWatcher(object):
+  '''
+  Watches `path` (a directory, that may not exist yet) for files matching
+  `pattern` and puts (kind, path) tuples on a queue, see WRITTEN, DELETED
+  and RESET. Files that are already there when the watcher starts are not
+  reported. If the directory is created later, the files in it at that
+  point are reported as WRITTEN.
+
+  `backend` is one of 'inotify', 'stat' or None to pick inotify if it is
+  available. The backend that is used is in `self.backend`.
+
+  Example:
+
+    >>> w = JsonWatcher('/tmp/dvmdostem/calibration/yearly')
+    >>> w.events(timeout=5) # wait up to 5 seconds for something to happen
+    [('written', '/tmp/dvmdostem/calibration/yearly/00042.json')]
+    >>> w.stop()
+  '''
+  def __init__(self, path, pattern='*.json', poll_interval=0.05, backend=None):
+    self.path = os.path.abspath(path)
+    self.pattern = pattern
+    self.poll_interval = poll_interval
+    self.queue = queue.Queue()
+
+    self._libc = None
+    if backend in (None, 'inotify'):
+      self._libc = _load_inotify()
+      if self._libc is None and backend == 'inotify':
+        raise RuntimeError("inotify is not available on this system!")
+    self.backend = 'inotify' if self._libc is not None else 'stat'
+
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run, name='JsonWatcher')
+    self._thread.daemon = True
+    self._fd = None
+    if self.backend == 'inotify':
+      self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+      if self._fd < 0:
+        logging.warning("Unable to start inotify (%s), checking %s with stat instead." % (
+            os.strerror(self._get_errno()), self.path))
+        self.backend = 'stat'
+        self._fd = None
+
+    logging.info("Watching %s for %s files (%s)" % (self.path, pattern, self.backend))
+    self._thread.start()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.stop()
+
+  def _get_errno(self):
+    import ctypes
+    return ctypes.get_errno()
+
+  def stop(self):
+    '''Stops the background thread.'''
+    self._stop.set()
+    self._thread.join()
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
+
+  def events(self, timeout=0):
+    '''
+    Returns a list of all the (kind, path) events so far. If there are none,
+    waits up to `timeout` seconds for the first one.
+    '''
+    found = []
+    try:
+      found.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+      while True:
+        found.append(self.queue.get_nowait())
+    except queue.Empty:
+      pass
+    return found
+
+  def _matches(self, name):
+    return fnmatch.fnmatch(name, self.pattern)
+
+  def _existing(self):
+    return sorted(glob.glob(os.path.join(self.path, self.pattern)))
+
+  def _run(self):
+    try:
+      if self.backend == 'inotify':
+        self._run_inotify()
+      else:
+        self._run_stat()
+    except Exception as e:
+      logging.error("File watcher for %s stopped: %s" % (self.path, e))
+      self.queue.put((RESET, self.path))
+
+  def _wait_for_directory(self):
+    '''
+    Waits (checking every `poll_interval`) for the directory to exist.
+    Returns None if the watcher was stopped first, otherwise True if it had
+    to wait (so the files in the directory are new) or False if not.
+    '''
+    waited = False
+    while not os.path.isdir(self.path):
+      waited = True
+      if self._stop.wait(self.poll_interval):
+        return None
+    return waited
+
+  def _announce(self):
+    '''Reports all the files in the directory as new.'''
+    for f in self._existing():
+      self.queue.put((WRITTEN, f))
+
+  def _run_inotify(self):
+    import select
+    import struct
+
+    event = struct.Struct('iIII') # wd, mask, cookie, len
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    wd = None
+    first = True
+    while not self._stop.is_set():
+      if wd is None:
+        waited = self._wait_for_directory()
+        if waited is None:
+          return
+        wd = self._libc.inotify_add_watch(self._fd, self.path.encode(), mask)
+        if wd < 0:
+          err = self._get_errno()
+          if err == errno.ENOENT:
+            wd = None # Removed again already.
+            continue
+          raise OSError(err, os.strerror(err), self.path)
+        # If the directory was (re)created after we started the files in it
+        # are new. Listed after adding the watch so nothing is missed, but a
+        # file may then be reported twice.
+        if waited or not first:
+          self._announce()
+        first = False
+
+      # Wake up now and then to see if we have been stopped.
+      readable, w, x = select.select([self._fd], [], [], 0.25)
+      if not readable:
+        continue
+      try:
+        buf = os.read(self._fd, 65536)
+      except OSError as e:
+        if e.errno == errno.EAGAIN:
+          continue
+        raise
+
+      pos = 0
+      while pos < len(buf):
+        ewd, emask, cookie, length = event.unpack_from(buf, pos)
+        name = buf[pos + event.size:pos + event.size + length].rstrip(b'\0').decode()
+        pos += event.size + length
+
+        if emask & IN_Q_OVERFLOW:
+          self.queue.put((RESET, self.path))
+        elif emask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+          if emask & IN_IGNORED:
+            wd = None
+          self.queue.put((DELETED, self.path))
+        elif name and self._matches(name):
+          if emask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self.queue.put((WRITTEN, os.path.join(self.path, name)))
+          elif emask & (IN_DELETE | IN_MOVED_FROM):
+            self.queue.put((DELETED, os.path.join(self.path, name)))
+
+  def _run_stat(self):
+    waited = self._wait_for_directory()
+    if waited is None:
+      return
+    if waited:
+      self._announce()
+    seen = dict((f, self._stat(f)) for f in self._existing())
+    pending = {}
+    dir_stamp = None
+    next_full_check = 0
+    while not self._stop.wait(self.poll_interval):
+      try:
+        stamp = os.stat(self.path).st_mtime
+      except OSError:
+        if len(seen) > 0 or len(pending) > 0:
+          self.queue.put((DELETED, self.path))
+        seen, pending = {}, {}
+        if self._wait_for_directory() is None:
+          return
+        self._announce()
+        seen = dict((f, self._stat(f)) for f in self._existing())
+        continue
+
+      # Only list the directory if it changed, if files are still being
+      # written or, in case the directory time stamps are coarse, once a second.
+      now = time.time()
+      if stamp == dir_stamp and len(pending) == 0 and now < next_full_check:
+        continue
+      dir_stamp = stamp
+      next_full_check = now + 1.0
+
+      current = dict((f, self._stat(f)) for f in self._existing())
+      for f in sorted(set(seen) - set(current)):
+        self.queue.put((DELETED, f))
+      for f in sorted(current):
+        if current[f] is None or current[f] == seen.get(f):
+          continue
+        if pending.get(f) == current[f]:
+          # Unchanged since the last check, the model is done with it.
+          self.queue.put((WRITTEN, f))
+          seen[f] = current[f]
+          del pending[f]
+        else:
+          pending[f] = current[f]
+      seen = dict((f, v) for f, v in seen.items() if f in current)
+      pending = dict((f, v) for f, v in pending.items() if f in current)
+
+  @staticmethod
+  def _stat(f):
+    try:
+      st = os.stat(f)
+    except OSError:
+      return None
+    return (st.st_size, st.st_mtime)
+
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+# Level of detail (decimated) data for the calibration plots.
+#
+# A monthly run of a few thousand years has tens of thousands of points per
+# trace, far more than an axes has pixels, and drawing all of them makes the
+# viewer sluggish. An LodPyramid keeps a min/max envelope of the data at
+# bin sizes of 1, 2, 4, 8... points. For a given view (x range) and width in
+# pixels, `view(..)` picks the coarsest level with no more than about one bin
+# per pixel and returns the (in order) minimum and maximum points of each
+# bin, so the line looks the same as the full data (spikes are kept) but
+# never has more than about 2 points per pixel. Zooming in picks finer
+# levels, down to the raw data.
+#
+# Building the pyramid is O(N) and each view is O(pixels).
+
+import numpy as np
+
+
+class LodPyramid(object):
+  '''
+  Min/max envelope pyramid for the line (x, y); x must be increasing. nan
+  values in y are treated as gaps, as matplotlib does.
+
+  Example:
+
+    >>> lod = LodPyramid(np.arange(100000), y)
+    >>> x, y = lod.view(0, 100000, 800)   # at most ~1600 points
+  '''
+  def __init__(self, x, y):
+    self.x = np.asarray(x)
+    self.y = np.asarray(y, dtype=np.float64)
+
+    # Level k has (index of min, index of max) for bins of 2**k points.
+    # Level 0 is the data itself, so it isn't stored.
+    self.levels = []
+    vmin = np.where(np.isnan(self.y), np.inf, self.y)
+    vmax = np.where(np.isnan(self.y), -np.inf, self.y)
+    imin = imax = np.arange(len(self.y))
+    while len(imin) > 1:
+      if len(imin) % 2:
+        # Pad with a copy of the last bin, it can't change the result.
+        imin, imax = np.append(imin, imin[-1]), np.append(imax, imax[-1])
+        vmin, vmax = np.append(vmin, vmin[-1]), np.append(vmax, vmax[-1])
+      take = vmin[1::2] < vmin[0::2]
+      imin = np.where(take, imin[1::2], imin[0::2])
+      vmin = np.where(take, vmin[1::2], vmin[0::2])
+      take = vmax[1::2] > vmax[0::2]
+      imax = np.where(take, imax[1::2], imax[0::2])
+      vmax = np.where(take, vmax[1::2], vmax[0::2])
+      self.levels.append((imin, imax))
+
+  def __len__(self):
+    return len(self.y)
+
+  def extent(self):
+    '''Returns ((xmin, ymin), (xmax, ymax)) for all the data, or None if there is none.'''
+    if len(self.y) == 0 or np.all(np.isnan(self.y)):
+      return None
+    return (self.x[0], np.nanmin(self.y)), (self.x[-1], np.nanmax(self.y))
+
+  def view(self, x0, x1, pixels):
+    '''
+    Returns (x, y) for drawing the part of the line between x0 and x1 (plus
+    one point either side, so the line runs off the edges) at a width of
+    `pixels`.
+    '''
+    start = max(0, np.searchsorted(self.x, x0, side='left') - 1)
+    stop = min(len(self.x), np.searchsorted(self.x, x1, side='right') + 1)
+    pixels = max(1, int(pixels))
+
+    # The finest level with no more than `pixels` bins in view.
+    level = 0
+    while level < len(self.levels) and (stop - start) > (pixels << level):
+      level += 1
+    if level == 0:
+      return self.x[start:stop], self.y[start:stop]
+
+    imin, imax = self.levels[level - 1]
+    b0, b1 = start >> level, ((stop - 1) >> level) + 1
+    lo, hi = imin[b0:b1], imax[b0:b1]
+    idx = np.empty(2 * len(lo), dtype=int)
+    idx[0::2] = np.minimum(lo, hi)
+    idx[1::2] = np.maximum(lo, hi)
+    return self.x[idx], self.y[idx]
@@ -2,7 +2,6 @@
 
 import os
 import sys
-import json
 import logging
 import argparse
 import textwrap
@@ -10,6 +9,8 @@ import tarfile        # for reading from tar.gz files
 import shutil         # for cleaning up a /tmp directory
 import signal         # for a graceful exit
 
+import copy
+import time
 import multiprocessing
 
 #if (sys.platform == 'darwin') and (os.name == 'posix'):
@@ -26,13 +27,20 @@ import matplotlib.gridspec as gridspec
 import matplotlib.widgets
 
 # our own custom classes
-from InputHelper import InputHelper
+from InputHelper import InputHelper, JsonTailReader, ColumnSeries
+from JsonWatcher import JsonWatcher
+from LevelOfDetail import LodPyramid
 
 # Find the path to the this file so that we can look, relative to this file
 # up one directory and into the scripts/ directory
 sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
 import scripts.param_util as pu
 
+# Flags in the json files that are watched for changes; a marker line is
+# drawn on the plots where any of them change.
+MODULE_KEYS = ["Nfeed", "AvlNFlag", "Baseline", "EnvModule", "BgcModule",
+               "DynLaiModule", "DslModule", "DsbModule"]
+
 # Keep the detailed documentation here. Can be accessed via command
 # line --extended-help flag.
 def generate_extened_help():
@@ -60,19 +68,20 @@ def generate_extened_help():
 
   I expereienced some problems with the interactive window
   provided by matplotloib. Especially with the Home, Back,
-  and Forward buttons. They have been disabled in the code.
-  If you run the program with a high enough log level you 
-  should be able to find messages to this extent whenever
-  the buttons are clicked. Unfortunately the work around at
-  this time is to kill the plotting program (Ctrl-C in the 
-  controlling terminal window that started it) and start the
-  program over. It can be helpful to pause DVMDOSTEM while
-  you are doing this.
+  and Forward buttons. Back and Forward have been disabled in
+  the code and Home zooms out to show all the data. If you run
+  the program with a high enough log level you should be able
+  to find messages to this extent whenever the buttons are
+  clicked.
 
   When using the program, if you change the zoom, or pan, 
   the plot will stop updating, even as more json data becomes
-  available. To resume the updating, use "Ctrl-r" (on the 
-  plot window, not the controlling terminal).
+  available. To resume the updating, use "Ctrl-r" or the Home
+  button (on the plot window, not the controlling terminal).
+
+  Long series (e.g. --monthly) are drawn with about as many
+  points as the plot is wide in pixels; zooming in shows more
+  detail, down to every point.
 
       Keyboard Shortcuts
       ------------------
@@ -126,7 +135,14 @@ def stylize_buttons(r, sizefrac=1.0):
     [c.set_linewidth(0.5) for c in r.circles] # not sure if this has any affect
 
 def home_overload(self, *args, **kwargs):
-  logging.info("HOME button pressed. DISABLED; doing nothing.")
+  # Rather than the toolbar's view stack (which freezes the animation) the
+  # home button zooms out to show all the data, see ExpandingWindow.reset_view()
+  ewp = getattr(self.canvas.figure, 'expanding_window', None)
+  if ewp is not None:
+    logging.info("HOME button pressed. Zoom out to show all the data.")
+    ewp.reset_view()
+  else:
+    logging.info("HOME button pressed. DISABLED; doing nothing.")
   return 'break'
 
 def back_overload(self, *args, **kwargs):
@@ -141,6 +157,14 @@ NavigationToolbar2.home = home_overload
 NavigationToolbar2.back = back_overload
 NavigationToolbar2.forward = forward_overload
 
+class YearTickLocator(mplticker.MaxNLocator):
+  '''
+  Ticks on whole years for a monthly x axis, but only a few of them however
+  long the series is (a tick every 12 months would be thousands of ticks).
+  '''
+  def tick_values(self, vmin, vmax):
+    return 12 * super(YearTickLocator, self).tick_values(vmin / 12.0, vmax / 12.0)
+
 def exit_gracefully(signum, frame):
   '''A function for quitting w/o leaving a stacktrace on the users console.'''
   logging.info("Caught signal='%s', frame='%s'. Quitting - gracefully." % (signum, frame))
@@ -150,30 +174,146 @@ def do_nothing(signal_number, frame):
   print("Doing nothing with signal number: ", signal_number)
 
 
-def worker(in_helper, the_suite, calib_targets, title, add_in_helpers, save_fname, save_fmt):
+def json_field(trace):
+  '''
+  Returns the flattened json field name for a trace, e.g.
+  'PFT3.VegCarbon.Leaf', see InputHelper.columns(..)
+  '''
+  if 'pft' in list(trace.keys()):
+    if 'pftpart' in list(trace.keys()):
+      return '%s.%s.%s' % (trace['pft'], trace['jsontag'], trace['pftpart'])
+    return '%s.%s' % (trace['pft'], trace['jsontag'])
+  return trace['jsontag']
+
+def traces_for_pft(traces, pft):
+  '''Returns a copy of `traces` with the pft set for any PFT specific trace.'''
+  traces = copy.deepcopy(traces)
+  for trace in traces:
+    if 'pft' in list(trace.keys()):
+      trace['pft'] = 'PFT%i' % pft
+  return traces
+
+def share_columns(helpers, fields):
+  '''
+  Reads `fields` for each of the input `helpers` once (from the column
+  cache) and copies them into a single block of shared memory so that the
+  bulk plotting processes can use the data without reading any files.
+  Fields that are missing, or are not numeric, are all nan.
+
+  Returns a tuple (shm, layout); `layout` has a tuple (files, offset,
+  shape) for each helper, locating its (field, file) array in the block.
+  '''
+  from multiprocessing import shared_memory
+
+  blocks = []
+  for ih in helpers:
+    available = set(ih.fields())
+    cols = ih.columns([f for f in fields if f in available])
+    files = ih.cached_files()
+    data = np.full((len(fields), len(files)), np.nan)
+    for i, f in enumerate(fields):
+      if f in cols and cols[f].dtype.kind != 'U':
+        data[i] = cols[f]
+    blocks.append((files, data))
+
+  total = sum(d.size for f, d in blocks)
+  shm = shared_memory.SharedMemory(create=True, size=max(1, total) * 8)
+  buf = np.ndarray((total,), dtype=np.float64, buffer=shm.buf)
+  layout = []
+  offset = 0
+  for files, data in blocks:
+    buf[offset:offset + data.size] = data.ravel()
+    layout.append((files, offset, data.shape))
+    offset += data.size
+  return shm, layout
+
+# Per process state for the bulk plotting workers, see bulk_init(..)
+_bulk = {}
+
+def bulk_init(shm_name, layout, fields, helpers, suites, targets, title_tag, save_name, save_fmt):
+  '''Initializer for the bulk plotting worker processes.'''
+  from multiprocessing import shared_memory
+
+  signal.signal(signal.SIGINT, signal.SIG_IGN) # Let the parent handle Ctrl-C
+  plt.switch_backend("Agg")
+
+  shm = shared_memory.SharedMemory(name=shm_name)
+  buf = np.ndarray((shm.size // 8,), dtype=np.float64, buffer=shm.buf)
+  series = []
+  for ih, (files, offset, shape) in zip(helpers, layout):
+    data = buf[offset:offset + shape[0] * shape[1]].reshape(shape)
+    series.append(ColumnSeries(ih, files, dict(zip(fields, data)), watch=MODULE_KEYS))
+
+  _bulk.update(shm=shm, series=series, helpers=helpers, suites=suites, targets=targets,
+      title_tag=title_tag, save_name=save_name, save_fmt=save_fmt)
+
+def worker(task):
+  '''Renders and saves the plot for one (suite, pft) pair; run in a pool.'''
+  suite_name, pft = task
+  start = time.time()
+  S = _bulk['suites'][suite_name]
 
   logging.info("Build the plot object...")
   ewp = ExpandingWindow(
-                        in_helper,
-                        S['traces'],
+                        _bulk['helpers'][0],
+                        traces_for_pft(S['traces'], pft),
                         rows=S['rows'],
                         cols=S['cols'],
-                        targets=calib_targets,
-                        figtitle=title,
+                        targets=_bulk['targets'],
+                        figtitle="%s\nTargets Values for: %s" % (suite_name, _bulk['title_tag']),
                         no_show=True,
-                        extrainput=add_in_helpers
+                        extrainput=_bulk['helpers'][1:],
+                        series=_bulk['series']
                        )
 
   logging.info("Show the plot object...")
-  ewp.show(dynamic=False, save_name=save_fname, format=save_fmt)
-  return
+  save_fname = "%s_%s_pft%s" % (_bulk['save_name'], suite_name, pft)
+  ewp.show(dynamic=False, save_name=save_fname, format=_bulk['save_fmt'])
+  plt.close(ewp.fig)
+  return "%s.%s" % (save_fname, _bulk['save_fmt']), time.time() - start
+
+def bulk_render(helpers, suites, targets, title_tag, save_name, save_fmt, workers=None):
+  '''
+  Renders every suite for every PFT to files. The json data is read once,
+  into shared memory, and the figures are drawn (with the Agg backend) by a
+  pool of `workers` processes (default: one per core).
+  '''
+  tasks = [(k, pft) for pft in range(0, 10) for k in suites]
+
+  fields = []
+  for k, pft in tasks:
+    fields += [json_field(t) for t in traces_for_pft(suites[k]['traces'], pft)]
+  fields = sorted(set(fields + MODULE_KEYS))
+
+  start = time.time()
+  shm, layout = share_columns(helpers, fields)
+  logging.warning("Loaded %i fields from %i input(s) in %.2fs" % (len(fields), len(helpers), time.time() - start))
+
+  # Workers are forked so they share the suites, helpers and module state.
+  ctx = multiprocessing.get_context('fork')
+  pool = ctx.Pool(workers, initializer=bulk_init,
+      initargs=(shm.name, layout, fields, helpers, suites, targets, title_tag, save_name, save_fmt))
+  try:
+    for i, (fname, secs) in enumerate(pool.imap_unordered(worker, tasks), 1):
+      logging.warning("[%3i/%i] %.2fs %s" % (i, len(tasks), secs, fname))
+    pool.close()
+  except BaseException:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+    shm.close()
+    shm.unlink()
+
+  logging.warning("Rendered %i plots in %.2fs" % (len(tasks), time.time() - start))
 
 
 class ExpandingWindow(object):
   '''A set of expanding window plots that all share the x axis.'''
 
   def __init__(self, input_helper, traceslist, figtitle="Expanding Window Plot",
-      rows=2, cols=1, targets={}, no_show=False, extrainput=[], no_blit=False):
+      rows=2, cols=1, targets={}, no_show=False, extrainput=[], no_blit=False,
+      series=None):
 
     logging.debug("Ctor for Expanding Window plot...")
 
@@ -181,6 +321,25 @@ class ExpandingWindow(object):
 
     self.extra_input_helpers = extrainput
 
+    # One JsonTailReader per input helper, see update_readers(..)
+    self.readers = None
+
+    # When animating, one JsonWatcher per input helper (None for archives)
+    # so the readers only look for files when something was written, see
+    # start_watching(..)
+    self.watchers = None
+
+    # Set when the view needs updating even if there is no new data.
+    self.stale = False
+
+    # An LodPyramid for each line, so that only as many points as the axes
+    # have pixels are drawn, see set_line_data(..) and refine_lines(..)
+    self.lod = {}
+
+    # Optional ColumnSeries (one per input helper) holding data that is
+    # already loaded, used instead of reading any files (see bulk_render(..))
+    self.series = series
+
     self.window_size_yrs = None
 
     self.traces = traceslist
@@ -201,6 +360,8 @@ class ExpandingWindow(object):
 
     self.fig = plt.figure(figsize=(6*1.3, 8*1.3))
     self.fig.set_label("CAL FIGURE")
+    self.fig.expanding_window = self # For the toolbar, see home_overload(..)
+    self.fig.canvas.mpl_connect('resize_event', lambda event: self.refine_lines())
     self.ewp_title = self.fig.suptitle(figtitle)
 
     # Not sure exactly where it comes from, but somehow 2 figure windows end up 
@@ -279,16 +440,33 @@ class ExpandingWindow(object):
     # storage for tracking module state changes...
     module_state_dict = {}
 
-    # gets a sorted list of json files...
-    files = self.input_helper.files()
-
-    for inhelper in self.extra_input_helpers:
-      log.info("Loading data from extra input helpers...")
-      files += inhelper.files()
-
-    self.input_helper.report()
-    for inhelper in self.extra_input_helpers:
-      inhelper.report()
+    fields = [self.trace_field(trace) for trace in self.traces]
+    self.update_readers(fields)
+
+    # Collect the data from each reader, the files list is the list of files
+    # that the data lines up with.
+    files = []
+    columns = dict((k, []) for k in fields)
+    changes = {}
+    prev = None
+    for reader in self.readers:
+      if len(reader.files) == 0:
+        continue
+      offset = len(files)
+      for idx, change in reader.changes.items():
+        changes[offset + idx] = change
+      # Check for module changes from the end of one helper's files to the
+      # start of the next.
+      if prev is not None:
+        for k in MODULE_KEYS:
+          p, c = prev.column(k)[-1], reader.column(k)[0]
+          if not (np.isnan(p) or np.isnan(c)) and c != p:
+            changes[offset] = (k, c)
+      files += reader.files
+      for k in fields:
+        columns[k].append(reader.column(k))
+      prev = reader
+    columns = dict((k, v[0] if len(v) == 1 else np.concatenate(v or [np.zeros(0)])) for k, v in columns.items())
 
     if self.window_size_yrs:  # seems broken TKinter Exception about 'can't enter readline'
       log.info("Reducing files list to cover only the last %i years..." % self.window_size_yrs)
@@ -317,54 +495,23 @@ class ExpandingWindow(object):
       x = np.arange(0, len(files))
     
 
+    # The window (if any) is taken from the back of the list
+    offset = len(columns[fields[0]]) - len(files) if fields else 0
+    columns = dict((k, v[offset:]) for k, v in columns.items())
+
     # ----- READ FIRST FILE FOR TITLE ------
     self.set_title_from_first_file(files)
-    # for each trace, create a tmp y container the same size as x
-    for trace in self.traces:
-      trace['tmpy'] = x.copy() * np.nan
-    
-    # ----- READ EVERY FILE --------
-    log.info("Read every file...")
-    log.info("Load data to trace['tmpy'] container; find module state-changes.")
-
-    for fnum, file in enumerate(files):
-      # try reading the file
-      try:
-        with open(file) as f:
-          fdata = json.load(f)
-
-        #idx = int(os.path.splitext( os.path.basename(file) )[0])
-        idx = fnum
-
-        for trace in self.traces:
-          # set the trace's tmpy[idx] to file's data
-          if 'pft' in list(trace.keys()):
-            pftdata = fdata[trace['pft']]
-            if 'pftpart' in list(trace.keys()):
-              trace['tmpy'][idx] = pftdata[trace['jsontag']][trace['pftpart']]
-            else:
-              trace['tmpy'][idx] = pftdata[trace['jsontag']]
-          else:
-            trace['tmpy'][idx] = fdata[trace['jsontag']]
-
-        # Look at the previous file and see if the state of any
-        # modules or flags has changed...
-        if (fnum > 0):
-          with open(files[fnum-1]) as pfile:
-            pfdata = json.load(pfile)
 
-          for k in ["Nfeed", "AvlNFlag", "Baseline", "EnvModule", "BgcModule",
-                    "DynLaiModule", "DslModule", "DsbModule"]:
-
-            cstate = fdata[k]
-            pstate = pfdata[k]
-            if cstate != pstate:
-              module_state_dict[idx] = (k, cstate)
+    # ----- LOAD EVERY COLUMN --------
+    log.info("Load data to trace['tmpy'] container; find module state-changes.")
+    for trace, field in zip(self.traces, fields):
+      trace['tmpy'] = columns[field]
 
-      except (IOError, ValueError) as e:
-        logging.error("Problem: '%s' reading file '%s'" % (e, file))
+    # Module state changes, relative to the start of the (windowed) files
+    for idx, change in changes.items():
+      if idx - offset > 0:
+        module_state_dict[idx - offset] = change
 
-      
     # ----- UPDATE EVERY TRACE --------
     log.info("Load tmp data for every trace to trace's line")
     for trace in self.traces:
@@ -372,10 +519,10 @@ class ExpandingWindow(object):
       for line in self.axes[trace['axesnum']].lines:
         # set the line's data to x, and the trace's tmp data
         if line.get_label() == trace['jsontag']:
-          line.set_data(x, trace['tmpy'])
+          self.set_line_data(line, x, trace['tmpy'])
         elif 'pftpart' in list(trace.keys()):
           if line.get_label() == ('%s %s' % (trace['jsontag'], trace['pftpart'])):
-            line.set_data(x, trace['tmpy'])
+            self.set_line_data(line, x, trace['tmpy'])
         else:
           pass # wrong line...
   
@@ -392,8 +539,7 @@ class ExpandingWindow(object):
           ax.lines.remove(line)
 
     # ----- STAGE CHANGE MARKERS -------
-    stage_changes = [len(inhelper.files()) for inhelper in self.extra_input_helpers]
-    stage_changes.insert(0, len(self.input_helper.files()))
+    stage_changes = [len(reader.files) for reader in self.readers]
 
     for ax in self.axes:
       # clean up anything existing...
@@ -424,10 +570,12 @@ class ExpandingWindow(object):
     if relim:
       log.info("Recomputing data limits based on artist data")
       for ax in self.axes:
-        ax.relim()
+        self.relim(ax)
     if autoscale:
       for ax in self.axes:
         ax.autoscale(enable=True, axis='both', tight=False)
+    self.refine_lines()
+    if autoscale:
       log.info("Force draw after autoscale")
       plt.draw()
 
@@ -445,9 +593,16 @@ class ExpandingWindow(object):
     Returns a list of artists to re-draw.
     '''
     logging.info("Animation Frame %7i" % frame)
-    
-    # gets a sorted list of json files...
-    files = self.input_helper.files()
+
+    # Nothing to do (and nothing to re-draw) until the model writes something
+    # or the user changes the plot.
+    if self.readers is not None and self.series is None and not self.stale:
+      if sum(reader.update() for reader in self.readers) == 0:
+        return []
+    self.stale = False
+
+    # The files read so far (load_data2plot(..) reads any new ones)
+    files = self.readers[0].files if self.readers else self.input_helper.files()
 
     self.input_helper.coverage_report(files)
 
@@ -469,6 +624,52 @@ class ExpandingWindow(object):
       self.load_data2plot(relim=True, autoscale=True)
       return [trace['artists'][0] for trace in self.traces]
 
+  def set_line_data(self, line, x, y):
+    '''
+    Sets the (full) data for a line. What is drawn is decimated to the
+    current view, see refine_lines(..)
+    '''
+    self.lod[line] = LodPyramid(x, y)
+    line.set_data(x, y)
+
+  def refine_lines(self, axes=None):
+    '''
+    Sets the data of each line to a level of detail (see LevelOfDetail.py)
+    matching the x range in view and the width of the axes in pixels. Called
+    whenever the view changes (zoom, pan, resize) or data is loaded.
+    '''
+    for line, lod in list(self.lod.items()):
+      if line.axes is None:
+        del self.lod[line] # Removed, e.g. the suite changed.
+        continue
+      if axes is not None and line.axes not in axes:
+        continue
+      x0, x1 = sorted(line.axes.get_xlim())
+      width = line.axes.get_window_extent().width
+      line.set_data(*lod.view(x0, x1, width))
+
+  def on_xlim_changed(self, ax):
+    '''Zoom and pan: the axes share x, so all the lines need refining.'''
+    self.refine_lines()
+
+  def relim(self, ax):
+    '''
+    Like ax.relim(), but the data limits cover the full data of each line,
+    not just the (decimated) part that is drawn.
+    '''
+    ax.relim()
+    for line, lod in self.lod.items():
+      if line.axes is ax and lod.extent() is not None:
+        ax.update_datalim(lod.extent())
+
+  def reset_view(self):
+    '''Zoom out to show all the data.'''
+    for ax in self.axes:
+      self.relim(ax)
+      ax.autoscale(enable=True, axis='both', tight=False)
+    self.refine_lines()
+    self.fig.canvas.draw_idle()
+
   def setup_axes_ticks_events_and_load_data(self):
     '''A catch-all setup function'''
 
@@ -476,6 +677,7 @@ class ExpandingWindow(object):
     self.axes = [ plt.subplot(self.gs[0,0]) ]
     for r in range(1, self.gs.get_geometry()[0]):
       self.axes.append(plt.subplot(self.gs[r, 0], sharex=self.axes[0]))
+    self.axes[0].callbacks.connect('xlim_changed', self.on_xlim_changed)
 
     # Turn off all tick labels on x axis
     # In older matplotlib, (<3.x?) we first turned off all axes
@@ -643,6 +845,7 @@ class ExpandingWindow(object):
       try:
         ws = int(input("Window Size (years)?: "))
         self.window_size_yrs = ws
+        self.stale = True
         logging.info("Changed to 'fixed window' (window size: %s)" % ws)
       except ValueError as e:
         logging.warning("Invalid Entry! (%s)" % e)
@@ -650,6 +853,7 @@ class ExpandingWindow(object):
     if event.key == 'ctrl+J':
       logging.info("Changed to 'expanding window' mode.")
       self.window_size_yrs = None
+      self.stale = True
 
     if event.key == 'alt+p':
       try:
@@ -657,6 +861,7 @@ class ExpandingWindow(object):
         self.set_pft_number(n)
         self.clear_bg_pft_txt()
         self.set_bg_pft_txt()
+        self.stale = True
         logging.info("Updated the pft number to %i" % n)
       except ValueError as e:
         logging.warning("Invalid Entry! (%s)" % e)
@@ -666,11 +871,56 @@ class ExpandingWindow(object):
       exit_gracefully(event.key, None) # <-- need to pass something for frame ??
 
 
+  def update_readers(self, fields):
+    '''
+    Makes sure there is a JsonTailReader for each input helper that is
+    following `fields` and reads any new files. The readers are re-made (and
+    the helpers' reports logged) when the fields change, e.g. a different
+    suite or pft is picked.
+    '''
+    if self.series is not None:
+      self.readers = self.series
+      return
+
+    if self.readers is None or self.readers[0].fields != fields:
+      helpers = [self.input_helper] + self.extra_input_helpers
+      for inhelper in helpers:
+        inhelper.report()
+      watchers = self.watchers or [None] * len(helpers)
+      for w in watchers:
+        if w is not None:
+          w.events() # The new readers start from scratch anyway.
+      self.readers = [JsonTailReader(ih, fields, watch=MODULE_KEYS, watcher=w) for ih, w in zip(helpers, watchers)]
+    else:
+      for reader in self.readers:
+        n = reader.update()
+        if n > 0:
+          logging.debug("Read %i new files from %s" % (n, reader.input_helper.path()))
+
+  def start_watching(self):
+    '''
+    Starts a JsonWatcher for each input helper that reads from a directory
+    and hands them to the readers; from then on the readers only check for
+    new files when the model has written (or deleted) something.
+    '''
+    if self.watchers is not None or self.series is not None:
+      return
+    helpers = [self.input_helper] + self.extra_input_helpers
+    self.watchers = [None if ih.is_static() else JsonWatcher(ih.path()) for ih in helpers]
+    for reader, w in zip(self.readers or [], self.watchers):
+      # Pick up anything written before the watcher started.
+      reader.update()
+      reader.watcher = w
+    self.stale = True
+
+  def trace_field(self, trace):
+    '''Returns the flattened json field name for a trace, see json_field(..)'''
+    return json_field(trace)
+
   def set_title_from_first_file(self, files):
     if len(files) > 0:
       try:
-        with open(files[0]) as f:
-          fdata = json.load(f)
+        fdata = self.input_helper.load_json(files[0])
 
         title_lines = self.ewp_title.get_text().splitlines()
         first_line = title_lines[0]
@@ -688,7 +938,7 @@ class ExpandingWindow(object):
           pass # nothing to do - title already has CMT, lat and lon...
 
       except (IOError, ValueError) as e:
-        logging.error("Problem: '%s' reading file '%s'" % (e, f))
+        logging.error("Problem: '%s' reading file '%s'" % (e, files[0]))
 
     else:
       pass # Nothing to do; no files, so can't find CMT or lat/lon
@@ -799,8 +1049,9 @@ class ExpandingWindow(object):
     '''Relimit the axes, autoscale the axes, and try to force a re-draw.'''
     logging.debug("Relimit axes, autoscale axes.")
     for ax in self.axes:
-      ax.relim()
+      self.relim(ax)
       ax.autoscale(enable=True, axis='both', tight=False)
+    self.refine_lines()
 
     self.log_xtickinfo("RELIM_AUTOSCALE_DRAW")
 
@@ -815,7 +1066,7 @@ class ExpandingWindow(object):
     logging.debug("Turn on grid and legend.")
     for ax in self.axes:
       if self.input_helper.monthly():
-        loc = mplticker.MultipleLocator(base=12)
+        loc = YearTickLocator(nbins=10, integer=True)
         ax.xaxis.set_major_locator(loc)
 
       ax.grid(True) # <-- w/o parameter, this toggles!!
@@ -829,6 +1080,7 @@ class ExpandingWindow(object):
 
     if dynamic:
       logging.info("Setup animation.")
+      self.start_watching()
       self.ani = animation.FuncAnimation(self.fig, self.update, interval=100,
                                          init_func=self.init, blit=(not self.no_blit))
 
@@ -958,8 +1210,9 @@ if __name__ == '__main__':
           images.'''))
 
   parser.add_argument('--from-archive', default=False,
-      help=textwrap.dedent('''Generate plots from an archive of json files, 
-          instead of the normal /tmp directory.'''))
+      help=textwrap.dedent('''Generate plots from an archive of json files
+          (or a calibration store, see scripts/calstore.py), instead of the
+          normal /tmp directory.'''))
 
   parser.add_argument('--archive-series', default=[], nargs='+',
       help=textwrap.dedent("""Stitch data from the provided archive series onto
@@ -970,7 +1223,8 @@ if __name__ == '__main__':
 
   parser.add_argument('--monthly', action='store_true', #default='/tmp/cal-dvmdostem',
       help=textwrap.dedent('''Read and disply monthly json files instead of 
-          yearly. NOTE: may be slow!!'''))
+          yearly. Long series are drawn at a level of detail to suit the
+          plot size, zoom in to see every point.'''))
 
   parser.add_argument('--data-path', default=None,
       help=textwrap.dedent('''Look for json files in the specified path'''))
@@ -983,10 +1237,15 @@ if __name__ == '__main__':
           implied. The final --save-name is assembled from the --save-name option
           passed on the command line (if any), the suite, and the PFT,
           resulting in something like this: '_Environment_PFT0.pdf' if no
-          --save-name is specified on the command line. NOTE: With some versions
-          of python and matplotlib, running with --bulk will be extremely slow!
+          --save-name is specified on the command line. The json data is read
+          once and shared with a pool of worker processes (see --bulk-workers)
+          that render the plots with the Agg backend.
           '''))
 
+  parser.add_argument('--bulk-workers', default=None, type=int,
+      help=textwrap.dedent('''Number of worker processes to use with --bulk.
+          Defaults to the number of cores.'''))
+
 
   print("Parsing command line arguments...")
   args = parser.parse_args()
@@ -1089,11 +1348,11 @@ if __name__ == '__main__':
     if len(input_helper.files()) > 0:
       # Figure out which CMT we are dealing with
       try:
-        with open(input_helper.files()[0], 'r') as ff:
-          fdata = json.load(ff)
-          cmtstr = fdata["CMT"] # returns string like "CMT05"
+        first_file = input_helper.files()[0]
+        fdata = input_helper.load_json(first_file)
+        cmtstr = fdata["CMT"] # returns string like "CMT05"
       except (IOError, ValueError) as e:
-        logging.error("Problem: '%s' reading file '%s'" % (e, f))
+        logging.error("Problem: '%s' reading file '%s'" % (e, first_file))
 
       def load_targets(the_path):
         found_targets = False
@@ -1140,39 +1399,18 @@ if __name__ == '__main__':
     caltargets = {}
 
   if args.bulk:
-    logging.warning("Attempting to switch backends.")
-    logging.warning("Apparently this is an experimental feature; your mileage may vary.")
+    logging.warning("Switching to the Agg backend to render plots in bulk.")
     plt.switch_backend("Agg")
 
-    logging.info("Building a bunch of plot objects...")
-
-    jobs = []
-
-    for PFT in range(0,10):
-
-      for k, S in configured_suites.items():
-
-        logger.info("Set the right pft in the suite's traces list..")
-        for trace in S['traces']:
-          if 'pft' in list(trace.keys()):
-            trace['pft'] = 'PFT%i' % PFT
-
-        # SETUP THE WORKER PROCESS
-        p = multiprocessing.Process(
-            target=worker,
-            args=(
-                input_helper,
-                S,
-                caltargets,
-                "%s\nTargets Values for: %s" % (k, target_title_tag),
-                additional_input_helpers,
-                "%s_%s_pft%s"%(args.save_name,k,PFT),
-                args.save_format
-            )
-        )
-        jobs.append(p)
-        p.start()
-
+    bulk_render(
+        [input_helper] + additional_input_helpers,
+        configured_suites,
+        caltargets,
+        target_title_tag,
+        args.save_name,
+        args.save_format,
+        workers=args.bulk_workers
+    )
 
   else:
     logging.info("Build a single plot object...")
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+
+# Random access to the .json files in a calibration archive (a .tar or
+# .tar.gz of the dvmdostem calibration directory) without extracting it.
+#
+# The first time an archive is opened its members are scanned and an index
+# (name, offset and size of each member in the uncompressed tar stream) is
+# written next to the archive as ARCHIVE.index.json. The index is keyed by a
+# checksum of the archive, so it is rebuilt if the archive changes. After
+# that a member is read by seeking straight to its data:
+#
+#  - uncompressed .tar: O(1), a seek and a read.
+#  - .tar.gz with the optional indexed_gzip package installed: O(1), the
+#    gzip seek points are stored next to the archive as ARCHIVE.gzidx.
+#  - plain .tar.gz: members are decompressed on the way to the one that is
+#    asked for, so reading members in order is a single pass through the
+#    archive; use `decompress(..)` (or the 'decompress' sub command) to make
+#    an uncompressed copy for random access.
+#
+# Files inside an archive can be addressed with "virtual" paths made by
+# joining the archive path and the member name, e.g.:
+#
+#   /data/eq-data.tar.gz/tmp/dvmdostem/calibration/yearly/00012.json
+#
+# and read with `load_json(..)`, which also works for regular files (the
+# optional orjson package is used to parse them if it is installed). The
+# same goes for the records in a calibration store (see calstore.py), e.g.:
+#
+#   /data/run.sqlite/yearly/eq/00012.json
+
+import os
+import json
+import gzip
+import shutil
+import hashlib
+import tarfile
+import argparse
+import textwrap
+import collections
+
+INDEX_SUFFIX = '.index.json'
+GZIP_INDEX_SUFFIX = '.gzidx'
+
+# Bump if the layout of the index file changes.
+INDEX_VERSION = 1
+
+ARCHIVE_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+def user_cache_dir():
+  '''Location for index files when the archive's directory is not writable.'''
+  return os.path.join('/tmp', 'dvmdostem-user-{}'.format(str(os.getuid())), 'archive-index')
+
+def checksum(path, sample=1048576):
+  '''
+  Cheap checksum for (potentially very large) archives: sha1 of the file
+  size and the first and last `sample` bytes. For compressed archives the
+  tail holds the CRC of the whole uncompressed stream so any change to the
+  contents is caught.
+  '''
+  size = os.path.getsize(path)
+  h = hashlib.sha1(str(size).encode())
+  with open(path, 'rb') as f:
+    h.update(f.read(sample))
+    if size > sample:
+      f.seek(max(sample, size - sample))
+      h.update(f.read(sample))
+  return h.hexdigest()
+
+def compression(path):
+  '''Returns one of 'gz', 'bz2', 'xz' or None, based on the magic bytes.'''
+  with open(path, 'rb') as f:
+    magic = f.read(6)
+  if magic.startswith(b'\x1f\x8b'):
+    return 'gz'
+  if magic.startswith(b'BZh'):
+    return 'bz2'
+  if magic.startswith(b'\xfd7zXZ\x00'):
+    return 'xz'
+  return None
+
+
+class CalibrationArchive(object):
+  '''
+  Reads members of a (possibly compressed) tar archive by seeking to them,
+  using an index of the member offsets that is built once and cached next
+  to the archive. See the notes at the top of this module.
+  '''
+  def __init__(self, path, cache=8):
+    self.path = os.path.abspath(path)
+    self.compression = compression(self.path)
+    self._fobj = None
+    self._recent = collections.OrderedDict()
+    self._cache_size = cache
+    self._load_index()
+
+  def index_path(self, suffix=INDEX_SUFFIX):
+    '''Path for the index file, next to the archive if that is writable.'''
+    if os.access(os.path.dirname(self.path), os.W_OK):
+      return self.path + suffix
+    return os.path.join(user_cache_dir(), self.checksum + suffix)
+
+  def _load_index(self):
+    self.checksum = checksum(self.path)
+    try:
+      with open(self.index_path()) as f:
+        idx = json.load(f)
+      if idx['checksum'] == self.checksum and idx['version'] == INDEX_VERSION:
+        self._set_members(idx['members'])
+        return
+      print("Archive index for {} is out of date, rebuilding.".format(self.path))
+    except (IOError, OSError, ValueError, KeyError):
+      pass
+    self.build_index()
+
+  def _set_members(self, members):
+    self._members = collections.OrderedDict((m[0], tuple(m[1:])) for m in members)
+
+  def build_index(self):
+    '''Scans the archive (one pass) and writes the member index file.'''
+    print("Indexing archive {}...".format(self.path))
+    members = []
+    with tarfile.open(self.path, 'r:*') as tf:
+      for ti in tf:
+        if ti.isfile():
+          members.append([ti.name, ti.offset_data, ti.size, ti.mtime])
+    self._set_members(members)
+
+    dest = self.index_path()
+    try:
+      if not os.path.isdir(os.path.dirname(dest)):
+        os.makedirs(os.path.dirname(dest))
+      with open(dest + '.tmp', 'w') as f:
+        json.dump(dict(version=INDEX_VERSION, checksum=self.checksum, members=members), f)
+      os.rename(dest + '.tmp', dest)
+    except (IOError, OSError) as e:
+      print("WARNING! Unable to save archive index to {} ({})".format(dest, e))
+
+  def _open(self):
+    '''Opens (once) a seekable file object for the uncompressed tar stream.'''
+    if self._fobj is not None:
+      return self._fobj
+
+    if self.compression == 'gz':
+      try:
+        import indexed_gzip
+      except ImportError:
+        indexed_gzip = None
+      if indexed_gzip is not None:
+        self._fobj = indexed_gzip.IndexedGzipFile(self.path)
+        gzidx = self.index_path(GZIP_INDEX_SUFFIX + '-' + self.checksum[:12])
+        if os.path.isfile(gzidx):
+          self._fobj.import_index(gzidx)
+        else:
+          self._fobj.build_full_index()
+          try:
+            self._fobj.export_index(gzidx)
+          except (IOError, OSError, ValueError) as e:
+            print("WARNING! Unable to save gzip index to {} ({})".format(gzidx, e))
+      else:
+        self._fobj = gzip.open(self.path, 'rb')
+    elif self.compression == 'bz2':
+      import bz2
+      self._fobj = bz2.BZ2File(self.path, 'rb')
+    elif self.compression == 'xz':
+      import lzma
+      self._fobj = lzma.LZMAFile(self.path, 'rb')
+    else:
+      self._fobj = open(self.path, 'rb')
+    return self._fobj
+
+  def close(self):
+    if self._fobj is not None:
+      self._fobj.close()
+      self._fobj = None
+
+  def names(self):
+    '''All the (regular file) members, in archive order.'''
+    return list(self._members.keys())
+
+  def json_members(self, which):
+    '''
+    Returns the sorted member names of the .json files in the first
+    directory named `which` ('yearly' or 'monthly') in the archive.
+    '''
+    dirs = sorted(set(os.path.dirname(n) for n in self._members
+        if n.endswith('.json') and os.path.basename(os.path.dirname(n)) == which))
+    if len(dirs) == 0:
+      return []
+    return sorted(n for n in self._members
+        if n.endswith('.json') and os.path.dirname(n) == dirs[0])
+
+  def __contains__(self, name):
+    return name in self._members
+
+  def mtime(self, name):
+    '''Modification time of member `name` (as stored in the archive).'''
+    return float(self._members[name][2])
+
+  def read(self, name):
+    '''Returns the bytes of member `name`.'''
+    if name in self._recent:
+      return self._recent[name]
+    offset, size = self._members[name][0:2]
+    f = self._open()
+    f.seek(offset)
+    data = f.read(size)
+    if len(data) != size:
+      raise IOError("Short read for member '{}' of {}".format(name, self.path))
+
+    # Keep a few members around: clients often look at the previous record
+    # again, which would mean starting over in a plain .tar.gz.
+    self._recent[name] = data
+    while len(self._recent) > self._cache_size:
+      self._recent.popitem(last=False)
+    return data
+
+  def load_json(self, name):
+    '''Parses member `name` as json.'''
+    return json_loads(self.read(name))
+
+  def iter_json(self, names):
+    '''
+    Yields (name, data) for each of `names`, reading the members in archive
+    order so that a compressed archive is only decompressed once.
+    '''
+    for name in sorted(names, key=lambda n: self._members[n][0]):
+      yield name, self.load_json(name)
+
+
+# The json parser, see json_loads(..)
+_fast_loads = []
+
+def json_loads(data):
+  '''
+  Parses json text (bytes or str). Uses the optional orjson package, which
+  is several times quicker on the calibration files, if it is installed;
+  text it rejects (e.g. NaN values) is handed to the json module.
+  '''
+  if len(_fast_loads) == 0:
+    try:
+      import orjson
+      _fast_loads.append(orjson.loads)
+    except ImportError:
+      _fast_loads.append(None)
+  if _fast_loads[0] is not None:
+    try:
+      return _fast_loads[0](data)
+    except ValueError:
+      pass
+  return json.loads(data.decode('utf-8') if isinstance(data, bytes) else data)
+
+
+_open_archives = {}
+
+def get_archive(path):
+  '''Returns a (shared) CalibrationArchive for `path`.'''
+  key = os.path.abspath(path)
+  stamp = os.path.getmtime(key)
+  if key not in _open_archives or _open_archives[key][0] != stamp:
+    if key in _open_archives:
+      _open_archives[key][1].close()
+    _open_archives[key] = (stamp, CalibrationArchive(key))
+  return _open_archives[key][1]
+
+def is_archive(path):
+  return os.path.isfile(path) and path.endswith(ARCHIVE_EXTENSIONS)
+
+def _is_store(path):
+  import scripts.calstore as cs
+  return cs.is_store(path)
+
+def _container(path):
+  '''The archive (or calibration store) at `path`.'''
+  if is_archive(path):
+    return get_archive(path)
+  import scripts.calstore as cs
+  return cs.get_store(path)
+
+def split_path(path):
+  '''
+  For a virtual path pointing inside an archive (or calibration store)
+  returns a tuple (archive path, member name), otherwise None.
+  '''
+  if os.path.exists(path):
+    return None
+  head = path
+  while True:
+    parent = os.path.dirname(head)
+    if parent == head or parent == '':
+      return None
+    if is_archive(parent) or _is_store(parent):
+      return parent, os.path.relpath(path, parent)
+    head = parent
+
+def member_path(archive, name):
+  '''Virtual path for member `name` of `archive`.'''
+  return os.path.join(archive, name)
+
+def load_json(path):
+  '''Loads a json file from disk or from inside an archive (virtual path).'''
+  found = split_path(path)
+  if found is None:
+    with open(path, 'rb') as f:
+      return json_loads(f.read())
+  archive, name = found
+  return _container(archive).load_json(name)
+
+def getmtime(path):
+  '''Like os.path.getmtime, but works with virtual paths into an archive.'''
+  found = split_path(path)
+  if found is None:
+    return os.path.getmtime(path)
+  archive, name = found
+  if not is_archive(archive):
+    return _container(archive).mtime(name)
+  arch = get_archive(archive)
+  if name not in arch:
+    raise OSError("No member '{}' in {}".format(name, archive))
+  return arch.mtime(name)
+
+def decompress(path, dest=None):
+  '''
+  Writes an uncompressed copy of the archive at `path` (so members can be
+  read with a single seek) and returns the path of the copy.
+  '''
+  if dest is None:
+    dest = path
+    for ext, repl in (('.tgz', '.tar'), ('.tbz2', '.tar'), ('.txz', '.tar'), ('.gz', ''), ('.bz2', ''), ('.xz', '')):
+      if dest.endswith(ext):
+        dest = dest[:-len(ext)] + repl
+        break
+  if dest == path:
+    raise RuntimeError("{} does not look compressed.".format(path))
+  arch = CalibrationArchive(path)
+  f = arch._open()
+  f.seek(0)
+  with open(dest + '.tmp', 'wb') as out:
+    shutil.copyfileobj(f, out, 4 * 1024 * 1024)
+  arch.close()
+  os.rename(dest + '.tmp', dest)
+  CalibrationArchive(dest)
+  return dest
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent('''
+      Tools for reading calibration archives (.tar/.tar.gz of the calibration
+      json files) in place, without extracting them.
+    ''')
+  )
+  subparsers = parser.add_subparsers(help='sub commands', dest='command')
+
+  index_parser = subparsers.add_parser('index', help=textwrap.dedent('''
+    (Re)build the member index for an archive and print a summary.'''))
+  index_parser.add_argument('archive', help="Path to a .tar or .tar.gz archive.")
+
+  decompress_parser = subparsers.add_parser('decompress', help=textwrap.dedent('''
+    Write an uncompressed copy of an archive (next to the original) so that
+    any member can be read with a single seek.'''))
+  decompress_parser.add_argument('archive', help="Path to a .tar.gz archive.")
+  decompress_parser.add_argument('--dest', help="Path for the uncompressed copy.")
+
+  args = parser.parse_args()
+
+  if args.command == 'index':
+    arch = CalibrationArchive(args.archive)
+    arch.build_index()
+    print("{} members, {} yearly and {} monthly json files.".format(
+        len(arch.names()), len(arch.json_members('yearly')), len(arch.json_members('monthly'))))
+    print("Index: {}".format(arch.index_path()))
+
+  elif args.command == 'decompress':
+    print("Wrote {}".format(decompress(args.archive, args.dest)))
+
+  else:
+    parser.print_help()
@@ -1,7 +1,16 @@
 #!/usr/bin/env python
 
-import json
+import os
+import sys
 import glob
+import numpy as np
+
+# Look one directory up for the scripts/ and calibration/ packages.
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import scripts.archive_util as au
+import scripts.calstore as cs
+from calibration.InputHelper import JsonSchema, pft_stack
 
 #import textwrap
 #import numpy as np
@@ -14,6 +23,8 @@ Example usage:
 
 
     filelist = glob.glob("/tmp/dvmdostem/calibration/monthly/*.json")
+    # or, from a calibration store (see scripts/calstore.py)
+    filelist = cje.calibration_files("run/calibration.sqlite", 'monthly')
 
     cje.close_soil_C_cycle(filelist, report_level='fail')
     cje.close_soil_N_cycle(filelist, report_level='fail')
@@ -24,13 +35,23 @@ Example usage:
 
 
 
+def calibration_files(path, timeres='monthly'):
+    '''
+    Returns the sorted json files in the directory `path`, or, if `path` is a
+    calibration store (see scripts/calstore.py), the virtual paths of its
+    `timeres` records in run order. Either can be passed to jdata_array().
+    '''
+    if cs.is_store(path):
+        return cs.get_store(path).files(timeres)
+    return sorted(glob.glob(os.path.join(path, "*.json")))
+
+
 def jdata_generator(filenames):
     '''A generator function yielding a json data object from each file.'''
 
     for file in filenames:
         #print "In generator function for file: ", file
-        with open(file, 'r') as f:
-            data = json.load(f)
+        data = au.load_json(file)
         yield data
         # could wrap in try/catch and return empty json
         # if there is an exception - would allow for analyzing
@@ -38,9 +59,30 @@ def jdata_generator(filenames):
         # might have an nan.
 
 
+def jdata_array(filenames):
+    '''
+    Reads all the files into a structured array, one row per file (see
+    JsonSchema in calibration/InputHelper.py). Quicker than jdata_generator()
+    for long series, and the array can be passed to eco_total().
+
+    Raises RuntimeError if any of the files can't be read.
+    '''
+    records, ok = JsonSchema.from_file(filenames[0]).load(filenames)
+    if not ok.all():
+        raise RuntimeError("Unable to read json file(s): {}".format([f for f, good in zip(filenames, ok) if not good]))
+    return records
+
+
 def eco_total(key, alljsondata):
     '''A generator function yielding an ecosystem total across PFTs for a variable.'''
 
+    if isinstance(alljsondata, np.ndarray):
+        # Structured records (see jdata_array()): sum along the PFT axis.
+        values = pft_stack(alljsondata, key)
+        for t in np.cumsum(values.reshape(len(values), -1).sum(axis=1)):
+            yield t
+        return
+
     total = 0
     for timestep in alljsondata:
         for pft in ['PFT%i'%i for i in range(0,10)]:
@@ -56,13 +98,15 @@ def eco_total(key, alljsondata):
 
 if __name__ == '__main__':
 
-    filelist = glob.glob("/tmp/dvmdostem/calibration/monthly/*.json")
+    # A directory of monthly json files or a calibration store.
+    path = sys.argv[1] if len(sys.argv) > 1 else "/tmp/dvmdostem/calibration/monthly"
+    filelist = calibration_files(path, 'monthly')
     print(len(filelist))
 
 
     # data is an iterable thing, like a list, so can be passed
     # to functions expecting lists (or other iterable sequences)
-    data = jdata_generator(filelist)
+    data = jdata_array(filelist)
     
     # the eco_total function will iterate over all the json data
     # objects (data) and for each item in data it will find the
@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+
+# A single file (SQLite) store for the calibration json files of a run.
+#
+# A long run leaves tens of thousands of small json files behind, which are
+# slow to list, copy and scan on network file systems. Ingesting them into a
+# store gives one file with a table for each time resolution ('yearly',
+# 'monthly', 'daily'), one row per json file and one column per flattened
+# field (e.g. 'PFT0.VegCarbon.Leaf', see InputHelper.flatten_json(..)). Rows
+# are indexed by run stage, year and month, so queries like "the last 10
+# years of VegCarbon for PFT0 in eq" don't need to look at any other rows:
+#
+#   >>> store = CalibrationStore('run.sqlite')
+#   >>> store.ingest('/tmp/dvmdostem')   # json tree or .tar.gz of one
+#   >>> store.query('yearly', ['PFT0.VegCarbon'], stage='eq', last_years=10)
+#   {'stage': array([...]), 'year': ..., 'PFT0.VegCarbon.Leaf': ..., ...}
+#
+# Ingesting again only reads the json files that are new or have changed,
+# so the store can be updated after each stage of a run (the model clears
+# the json directory between stages, the store keeps every stage).
+#
+# The records can also be read as if they were json files, through "virtual"
+# paths (see archive_util.py), e.g.:
+#
+#   run.sqlite/monthly/eq/0000012.json
+#
+# which is how InputHelper, qcal and diagnostics read from a store.
+
+import os
+import sys
+import json
+import glob
+import sqlite3
+import argparse
+import textwrap
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import scripts.archive_util as au
+
+TIMERES = ['yearly', 'monthly', 'daily']
+
+# Run stages, in run order.
+STAGES = ['pr', 'eq', 'sp', 'tr', 'sc']
+
+STORE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+
+# Default file name for a store kept in a run directory.
+DEFAULT_NAME = 'calibration.sqlite'
+
+# Columns in each table that are not json fields.
+META_COLUMNS = ['stage', 'idx', 'year', 'month', 'name', 'mtime']
+
+def is_store(path):
+  '''True if `path` is a calibration store (an SQLite file).'''
+  if not (os.path.isfile(path) and path.endswith(STORE_EXTENSIONS)):
+    return False
+  with open(path, 'rb') as f:
+    return f.read(16) == b'SQLite format 3\x00'
+
+def _column(position):
+  '''
+  Table column for the field at `position`. The field names are not used
+  as column names, SQLite column names are case insensitive.
+  '''
+  return 'f%d' % position
+
+def _kind(value):
+  if isinstance(value, bool):
+    return 'bool'
+  if isinstance(value, int):
+    return 'int'
+  if isinstance(value, float):
+    return 'real'
+  if isinstance(value, str):
+    return 'text'
+  return 'json'
+
+def _unflatten(flat):
+  '''Inverse of InputHelper.flatten_json(..)'''
+  data = {}
+  for k, v in flat.items():
+    d = data
+    parts = k.split('.')
+    for p in parts[:-1]:
+      d = d.setdefault(p, {})
+    d[parts[-1]] = v
+  return data
+
+def _stage_order(column='stage'):
+  '''SQL expression sorting the stages in run order.'''
+  return "instr('{}', {})".format(' '.join(STAGES), column)
+
+
+class CalibrationStore(object):
+  '''
+  A calibration store, see the notes at the top of this module. The file is
+  created if it doesn't exist.
+  '''
+  def __init__(self, path):
+    self.path = os.path.abspath(path)
+    self.db = sqlite3.connect(self.path)
+    self.db.execute("CREATE TABLE IF NOT EXISTS fields (timeres TEXT, name TEXT, kind TEXT, position INTEGER, PRIMARY KEY (timeres, name))")
+    self.db.execute("CREATE TABLE IF NOT EXISTS sources (timeres TEXT, path TEXT, mtime REAL, stage TEXT, idx INTEGER, PRIMARY KEY (timeres, path))")
+    self.db.commit()
+    self._fields = {}
+
+  def close(self):
+    self.db.close()
+
+  def _table(self, timeres):
+    if timeres not in TIMERES:
+      raise RuntimeError("Invalid time resolution: {}! Must be one of {}".format(timeres, TIMERES))
+    return timeres
+
+  def _has_table(self, timeres):
+    return self.db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (self._table(timeres),)).fetchone() is not None
+
+  def _field_kinds(self, timeres):
+    '''Ordered dict-like list of (name, kind) for the fields of `timeres`.'''
+    if timeres not in self._fields:
+      rows = self.db.execute("SELECT name, kind FROM fields WHERE timeres=? ORDER BY position", (timeres,)).fetchall()
+      self._fields[timeres] = rows
+    return self._fields[timeres]
+
+  def _columns(self, timeres, names):
+    '''Table columns for the fields `names`.'''
+    positions = dict((n, i) for i, (n, k) in enumerate(self._field_kinds(timeres)))
+    return [_column(positions[n]) for n in names]
+
+  def fields(self, timeres):
+    '''The flattened field names stored for `timeres`, in json file order.'''
+    return [n for n, k in self._field_kinds(timeres)]
+
+  def stages(self, timeres):
+    '''The stages (in run order) with records for `timeres`.'''
+    if not self._has_table(timeres):
+      return []
+    rows = self.db.execute("SELECT DISTINCT stage FROM {} ORDER BY {}".format(timeres, _stage_order())).fetchall()
+    return [r[0] for r in rows]
+
+  def expand(self, timeres, names):
+    '''
+    Expands each of `names` that is not itself a field to all the fields it
+    is a prefix of, e.g. 'PFT0.VegCarbon' to 'PFT0.VegCarbon.Leaf',
+    'PFT0.VegCarbon.Stem' and 'PFT0.VegCarbon.Root'. Raises KeyError for
+    names that match nothing.
+    '''
+    known = self.fields(timeres)
+    result = []
+    for n in names:
+      if n in known:
+        result.append(n)
+        continue
+      found = [k for k in known if k.startswith(n + '.')]
+      if len(found) == 0:
+        raise KeyError("Can't find field '{}' in the {} records in {}".format(n, timeres, self.path))
+      result += found
+    return result
+
+  def _source_files(self, source, timeres):
+    '''Returns a list of (path, mtime) for the json files of `timeres` in `source`.'''
+    if au.is_archive(source):
+      archive = au.get_archive(source)
+      return [(au.member_path(source, m), archive.mtime(m)) for m in archive.json_members(timeres)]
+    for d in [os.path.join(source, 'calibration', timeres), os.path.join(source, timeres)]:
+      if os.path.isdir(d):
+        files = sorted(glob.glob(os.path.join(d, '*.json')))
+        return [(f, os.path.getmtime(f)) for f in files]
+    return []
+
+  def _add_fields(self, timeres, records):
+    '''Adds table columns for any fields in `records` that are new.'''
+    known = dict(self._field_kinds(timeres))
+    new = []
+    for r in records:
+      for k, v in r.items():
+        if k not in known and v is not None:
+          known[k] = _kind(v)
+          new.append((k, known[k]))
+
+    if not self._has_table(timeres):
+      self.db.execute("CREATE TABLE {} (stage TEXT, idx INTEGER, year INTEGER, month INTEGER, name TEXT, mtime REAL, PRIMARY KEY (stage, idx))".format(timeres))
+      self.db.execute("CREATE INDEX {0}_stage_year_month ON {0} (stage, year, month)".format(timeres))
+
+    position = len(self._field_kinds(timeres))
+    for i, (k, kind) in enumerate(new):
+      sqltype = {'real': 'REAL', 'int': 'INTEGER', 'bool': 'INTEGER'}.get(kind, 'TEXT')
+      self.db.execute("ALTER TABLE {} ADD COLUMN {} {}".format(timeres, _column(position + i), sqltype))
+      self.db.execute("INSERT INTO fields VALUES (?, ?, ?, ?)", (timeres, k, kind, position + i))
+    self._fields.pop(timeres, None)
+    return known
+
+  def ingest(self, source, timeres=None, stage=None):
+    '''
+    Adds the json files from `source` (a directory, e.g. /tmp/dvmdostem, or
+    an archive of one) to the store. Only files that are new, or changed
+    since they were last ingested, are read. The stage and year are taken
+    from the 'Runstage', 'Year' and 'Month' fields of each file; `stage` is
+    used for files without a 'Runstage'.
+
+    Returns a dict with the number of files read for each time resolution.
+    '''
+    # flatten_json lives with the rest of the json handling.
+    from calibration.InputHelper import flatten_json
+
+    counts = {}
+    for tr in (TIMERES if timeres is None else [timeres]):
+      found = self._source_files(source, self._table(tr))
+      done = dict(self.db.execute("SELECT path, mtime FROM sources WHERE timeres=?", (tr,)).fetchall())
+      todo = [(p, m) for p, m in found if done.get(os.path.abspath(p)) != m]
+
+      records, meta = [], []
+      for p, m in todo:
+        try:
+          flat = flatten_json(au.load_json(p))
+        except (IOError, ValueError) as e:
+          print("WARNING! Skipping {} ({})".format(p, e))
+          continue
+        name = os.path.basename(p)
+        idx = int(os.path.splitext(name)[0])
+        s = flat.get('Runstage', stage)
+        if s is None:
+          raise RuntimeError("Can't tell the stage for {}, please specify one.".format(p))
+        meta.append((s, idx, flat.get('Year', idx // 12 if tr == 'monthly' else idx), flat.get('Month'), name, m, os.path.abspath(p)))
+        records.append(flat)
+
+      counts[tr] = len(records)
+      if len(records) == 0:
+        continue
+
+      kinds = self._add_fields(tr, records)
+      names = [n for n, k in self._field_kinds(tr)]
+      sql = "INSERT OR REPLACE INTO {} ({}) VALUES ({})".format(tr,
+          ", ".join(META_COLUMNS + self._columns(tr, names)),
+          ", ".join(["?"] * (len(META_COLUMNS) + len(names))))
+
+      def rows():
+        for (s, idx, year, month, name, m, p), r in zip(meta, records):
+          values = [r.get(n) for n in names]
+          values = [json.dumps(v) if kinds[n] == 'json' and v is not None else v for n, v in zip(names, values)]
+          yield [s, idx, year, month, name, m] + values
+
+      with self.db:
+        self.db.executemany(sql, rows())
+        self.db.executemany("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)",
+            [(tr, p, m, s, idx) for s, idx, year, month, name, m, p in meta])
+    return counts
+
+  def _where(self, timeres, stage=None, years=None, last_years=None, months=None):
+    '''Builds the WHERE clause (and parameters) for query(..) and records(..)'''
+    clauses, params = [], []
+    if stage is not None:
+      stages = [stage] if isinstance(stage, str) else list(stage)
+      clauses.append("stage IN ({})".format(", ".join("?" * len(stages))))
+      params += stages
+    if years is not None:
+      clauses.append("year >= ? AND year < ?")
+      params += [years[0], years[1]]
+    if months is not None:
+      clauses.append("month IN ({})".format(", ".join("?" * len(months))))
+      params += list(months)
+    if last_years is not None:
+      sql = "SELECT DISTINCT stage, year FROM {} {} ORDER BY {}, year".format(timeres,
+          "WHERE " + " AND ".join(clauses) if clauses else "", _stage_order())
+      pairs = self.db.execute(sql, params).fetchall()[-last_years:] if last_years > 0 else []
+      if len(pairs) == 0:
+        clauses.append("0")
+      else:
+        clauses.append("(stage, year) IN (VALUES {})".format(", ".join(["(?, ?)"] * len(pairs))))
+        params += [v for pair in pairs for v in pair]
+    return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+  def query(self, timeres, fields, stage=None, years=None, last_years=None, months=None):
+    '''
+    Returns a dict mapping 'stage', 'idx', 'year', 'month' and each of the
+    `fields` (expanded, see expand(..)) to numpy arrays, one value per
+    record, in run order. Numeric fields are float arrays with nan where a
+    record is missing the field.
+
+    Parameters
+    ----------
+    stage : str or list of str, optional
+      Only these stages.
+    years : (int, int), optional
+      Only years from the first up to (not including) the second.
+    last_years : int, optional
+      Only the last N years (of the selected stages).
+    months : list of int, optional
+      Only these months (monthly records).
+    '''
+    empty = dict((k, np.zeros(0)) for k in META_COLUMNS[:4])
+    if not self._has_table(timeres):
+      return empty
+    fields = self.expand(timeres, fields)
+    kinds = dict(self._field_kinds(timeres))
+    where, params = self._where(timeres, stage, years, last_years, months)
+    sql = "SELECT stage, idx, year, month, {} FROM {} {} ORDER BY {}, idx".format(
+        ", ".join(self._columns(timeres, fields) or ["NULL"]), timeres, where, _stage_order())
+    rows = self.db.execute(sql, params).fetchall()
+
+    result = dict(
+      stage=np.array([r[0] for r in rows], dtype=str),
+      idx=np.array([r[1] for r in rows], dtype=int),
+      year=np.array([r[2] for r in rows], dtype=float),
+      month=np.array([np.nan if r[3] is None else r[3] for r in rows], dtype=float),
+    )
+    for i, f in enumerate(fields):
+      values = [r[4 + i] for r in rows]
+      if kinds[f] in ('text', 'json'):
+        result[f] = np.array(['' if v is None else v for v in values], dtype=str)
+      else:
+        result[f] = np.array([np.nan if v is None else v for v in values], dtype=float)
+    return result
+
+  def records(self, timeres, stage=None):
+    '''Returns a list of (stage, name, mtime) for each record, in run order.'''
+    if not self._has_table(timeres):
+      return []
+    where, params = self._where(timeres, stage)
+    return self.db.execute("SELECT stage, name, mtime FROM {} {} ORDER BY {}, idx".format(
+        timeres, where, _stage_order()), params).fetchall()
+
+  def files(self, timeres, stage=None):
+    '''Virtual paths (see member_path(..)) for each record, in run order.'''
+    return [member_path(self.path, timeres, s, n) for s, n, m in self.records(timeres, stage)]
+
+  def _row(self, member):
+    parts = member.replace(os.sep, '/').split('/')
+    if len(parts) != 3 or parts[0] not in TIMERES:
+      raise IOError("No record '{}' in {}".format(member, self.path))
+    timeres, stage, name = parts
+    if not self._has_table(timeres):
+      raise IOError("No record '{}' in {}".format(member, self.path))
+    return timeres, stage, name
+
+  def mtime(self, member):
+    '''Modification time (of the json file it came from) for a record.'''
+    timeres, stage, name = self._row(member)
+    row = self.db.execute("SELECT mtime FROM {} WHERE stage=? AND name=?".format(timeres), (stage, name)).fetchone()
+    if row is None:
+      raise OSError("No record '{}' in {}".format(member, self.path))
+    return row[0]
+
+  def load_json(self, member):
+    '''Rebuilds the (nested) json data for the record `member`, e.g. 'monthly/eq/0000012.json'.'''
+    timeres, stage, name = self._row(member)
+    kinds = self._field_kinds(timeres)
+    cur = self.db.execute("SELECT {} FROM {} WHERE stage=? AND name=?".format(
+        ", ".join(self._columns(timeres, [n for n, k in kinds]) or ["NULL"]), timeres), (stage, name))
+    row = cur.fetchone()
+    if row is None:
+      raise IOError("No record '{}' in {}".format(member, self.path))
+    flat = {}
+    for (n, kind), v in zip(kinds, row):
+      if v is None:
+        continue
+      if kind == 'bool':
+        v = bool(v)
+      elif kind == 'json':
+        v = json.loads(v)
+      flat[n] = v
+    return _unflatten(flat)
+
+
+_open_stores = {}
+
+def get_store(path):
+  '''Returns a (shared) CalibrationStore for `path`.'''
+  key = os.path.abspath(path)
+  if key not in _open_stores:
+    _open_stores[key] = CalibrationStore(key)
+  return _open_stores[key]
+
+def member_path(store, timeres, stage, name):
+  '''Virtual path for one record of `store`.'''
+  return os.path.join(store, timeres, stage, name)
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent('''
+      Compacts the calibration json files of a run into a single SQLite file
+      that can be queried (and read by the calibration tools) without
+      scanning the file system.
+    ''')
+  )
+  subparsers = parser.add_subparsers(help='sub commands', dest='command')
+
+  ingest_parser = subparsers.add_parser('ingest', help=textwrap.dedent('''
+    Add (new or changed) json files to a store, creating it if needed.'''))
+  ingest_parser.add_argument('store', help="Path to the store, e.g. run.sqlite")
+  ingest_parser.add_argument('source', nargs='?', default='/tmp/dvmdostem',
+      help="A json tree (holding calibration/yearly etc.) or an archive of one.")
+  ingest_parser.add_argument('--timeres', choices=TIMERES, help="Only this time resolution.")
+  ingest_parser.add_argument('--stage', choices=STAGES, help="Stage for files without a 'Runstage'.")
+
+  info_parser = subparsers.add_parser('info', help="Summarize the contents of a store.")
+  info_parser.add_argument('store')
+
+  query_parser = subparsers.add_parser('query', help=textwrap.dedent('''
+    Print (csv) some fields from a store.'''))
+  query_parser.add_argument('store')
+  query_parser.add_argument('fields', nargs='+', help="Fields or prefixes, e.g. PFT0.VegCarbon")
+  query_parser.add_argument('--timeres', choices=TIMERES, default='yearly')
+  query_parser.add_argument('--stage', choices=STAGES)
+  query_parser.add_argument('--last-years', type=int)
+  query_parser.add_argument('--years', type=int, nargs=2, metavar=('START', 'END'))
+
+  args = parser.parse_args()
+
+  if args.command == 'ingest':
+    store = CalibrationStore(args.store)
+    counts = store.ingest(args.source, timeres=args.timeres, stage=args.stage)
+    for tr, n in counts.items():
+      print("{:>8}: read {} json files".format(tr, n))
+
+  elif args.command == 'info':
+    store = CalibrationStore(args.store)
+    for tr in TIMERES:
+      for s in store.stages(tr):
+        n = len(store.records(tr, s))
+        print("{:>8} {}: {} records, {} fields".format(tr, s, n, len(store.fields(tr))))
+
+  elif args.command == 'query':
+    store = CalibrationStore(args.store)
+    result = store.query(args.timeres, args.fields, stage=args.stage,
+        years=args.years, last_years=args.last_years)
+    names = ['stage', 'year', 'month'] + store.expand(args.timeres, args.fields)
+    print(",".join(names))
+    for i in range(len(result['stage'])):
+      print(",".join(str(result[n][i]) for n in names))
+
+  else:
+    parser.print_help()
@@ -7,10 +7,10 @@
 import os                         # general path manipulations
 import shutil                     # cleaning up files
 import glob                       # listing/finding data files
-import json                       # reading data files
 import signal                     # for exiting gracefully
 import itertools
-import tarfile                    # opening archived data
+import collections
+import multiprocessing
 import argparse                   # command line interface
 import textwrap                   # help formatting
 import numpy as np                # general maths
@@ -23,19 +23,20 @@ if sys.version_info[0] < 3:
 else:
     from io import StringIO
 
+# Add dvm-dos-tem directory to path so that we can import archive_util and
+# the InputHelper from the calibration directory.
+# Assumes that this script is living in the dvm-dos-tem/scripts/ directory.
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+import scripts.archive_util as au
+import scripts.calstore as cs
+import scripts.output_utils as ou
+from calibration.InputHelper import InputHelper, pft_stack
 
 def exit_gracefully(signum, frame):
   '''A function for quitting w/o leaving a stacktrace on the users console.'''
   print("Caught signal='%s', frame='%s'. Quitting - gracefully." % (signum, frame))
   sys.exit(1)
 
-# Generator function for extracting specific files from a tar archive
-def monthly_files(tarfileobj):
-  '''Get the */monthly/*.json files...'''
-  for tarinfo in tarfileobj:
-    if 'monthly' in tarinfo.name:
-      yield tarinfo
-
 def analyze(cjd, pjd):
   '''
   Extract every ounce of knowledge from a pair of json data objects.
@@ -84,6 +85,15 @@ def analyze(cjd, pjd):
   return results
 
 
+def file_slice(**kwargs):
+  '''Parses the 'fileslice' kwarg (a string like 'start:end') into a slice.'''
+  if 'fileslice' in kwargs:
+      slice_string = kwargs['fileslice']
+      # parse string into slice object
+      # https://stackoverflow.com/questions/680826/python-create-slice-object-from-string/681949#681949
+      return slice(*[int(x.strip()) if x.strip() else None for x in slice_string.split(':')])
+  return slice(None,None,None)
+
 def file_loader(**kwargs):
   '''
   Build a list of files to open.
@@ -94,34 +104,26 @@ def file_loader(**kwargs):
     A string of the form 'start:end'
 
   fromarchive : str, optional
-    A path to a .tar.gz archive to read from.
+    A path to a .tar.gz archive (or a calibration store, see calstore.py)
+    to read from.
 
   Returns
   -------
   jfiles : list of str
     A list of .json file paths.
   '''
-  if 'fileslice' in kwargs:
-      slice_string = kwargs['fileslice']
-      # parse string into slice object
-      # https://stackoverflow.com/questions/680826/python-create-slice-object-from-string/681949#681949
-      custom_slice = slice(*[int(x.strip()) if x.strip() else None for x in slice_string.split(':')])
-  else:
-      custom_slice = slice(None,None,None)
-
-  if "fromarchive" in kwargs:
-    tf = tarfile.open(kwargs['fromarchive'])
-
-    # might be able to use tar checksum (crc) to implement some kind of caching...
-    TMP_EXTRACT_LOCATION = '/tmp/com.iab.dvmdostem.diagnostics.23f23f2' # <-- could be a checksum of the tar?
-
-    if ( os.path.isdir(TMP_EXTRACT_LOCATION) or os.path.isfile(TMP_EXTRACT_LOCATION) ):
-      print("Cleaning up the temporary location: ", TMP_EXTRACT_LOCATION)
-      shutil.rmtree(TMP_EXTRACT_LOCATION)
-    tf.extractall(TMP_EXTRACT_LOCATION, members=monthly_files(tf))
-    full_glob = os.path.join(TMP_EXTRACT_LOCATION, "tmp/dvmdostem/calibration/monthly/*.json")
-    print("Matching this pattern: ", full_glob)
-    jfiles = glob.glob(full_glob)
+  custom_slice = file_slice(**kwargs)
+
+  if kwargs.get("fromarchive") and cs.is_store(kwargs['fromarchive']):
+    jfiles = cs.get_store(kwargs['fromarchive']).files('monthly')
+    print("Found {} monthly records in store: {}".format(len(jfiles), kwargs['fromarchive']))
+  elif kwargs.get("fromarchive"):
+    # The files are read in place, nothing is extracted. The paths point
+    # inside the archive (see archive_util.py) and are read with load_json().
+    archive = au.get_archive(kwargs['fromarchive'])
+    members = archive.json_members('monthly')
+    print("Found {} monthly files in archive: {}".format(len(members), kwargs['fromarchive']))
+    jfiles = [au.member_path(kwargs['fromarchive'], m) for m in members]
   else:
     pattern_string = "/tmp/dvmdostem/calibration/monthly/*.json"
     print("Looking for json files matching pattern:", pattern_string)
@@ -132,6 +134,109 @@ def file_loader(**kwargs):
 
   return jfiles
 
+def column_loader(**kwargs):
+  '''
+  Like file_loader(), but also returns the data, as columns (one array per
+  flattened json field, e.g. 'PFT3.VegCarbon.Leaf') lined up with the file
+  list. The columns come from the InputHelper column cache, so the json
+  files are only parsed the first time.
+
+  Returns
+  -------
+  jfiles : list of str
+    A list of .json file paths.
+  cols : dict
+    Maps flattened field names to arrays, one value per file.
+  '''
+  custom_slice = file_slice(**kwargs)
+
+  if kwargs.get("fromarchive"):
+    ih = InputHelper(kwargs['fromarchive'], monthly=True)
+  else:
+    ih = InputHelper("/tmp/dvmdostem", monthly=True)
+  print("Loading columns for json files in:", ih.path())
+
+  cols = ih.columns(ih.fields())
+  jfiles = ih.cached_files()[custom_slice]
+  cols = dict((k, v[custom_slice]) for k, v in cols.items())
+
+  print("Custom file slice: {} ({} files)".format(custom_slice, len(jfiles)))
+  return jfiles, cols
+
+def unflatten(flat):
+  '''
+  Inverse of InputHelper.flatten_json(): turns {'PFT3.VegCarbon.Leaf': x}
+  into {'PFT3': {'VegCarbon': {'Leaf': x}}}.
+  '''
+  nested = {}
+  for k, v in flat.items():
+    d = nested
+    parts = k.split('.')
+    for p in parts[:-1]:
+      d = d.setdefault(p, {})
+    d[parts[-1]] = v
+  return nested
+
+def record(cols, idx):
+  '''Rebuilds the json data object for file `idx` from the columns.'''
+  flat = {}
+  for k, v in cols.items():
+    value = v[idx]
+    if v.dtype.kind == 'U':
+      value = str(value)
+    elif float(value).is_integer():
+      value = int(value)
+    else:
+      value = float(value)
+    flat[k] = value
+  return unflatten(flat)
+
+def pairwise_records(cols):
+  '''
+  Yields a tuple (idx, current, previous) of json data objects for each
+  file, i.e. a two record sliding window over the series; `previous` is None
+  for the first file. Each record is built once, from the columns (see
+  column_loader()).
+  '''
+  pjd = None
+  for idx in range(len(cols['CMT'])):
+    jdata = record(cols, idx)
+    yield idx, jdata, pjd
+    pjd = jdata
+
+def series(cols):
+  '''
+  Returns a pair (current, previous) of structured arrays (see
+  InputHelper.JsonSchema) with one row per time step, `previous` being
+  shifted by one (nan for the first step). These can be passed straight to
+  analyze() or any of the bal_*() functions to get the deltas and errors
+  for every time step in a few array operations.
+  '''
+  numeric = [k for k, v in cols.items() if v.dtype.kind != 'U']
+  dtype = np.dtype([('CMT', 'U32')] + [(k, 'f8') for k in numeric if k != 'CMT'])
+  cjd = np.zeros(len(cols['CMT']), dtype=dtype)
+  for k in dtype.names:
+    cjd[k] = cols[k]
+  cjd['CMT'] = str(cols['CMT'][0]) # Assume it doesn't change!
+
+  pjd = np.empty_like(cjd)
+  pjd[1:] = cjd[:-1]
+  for k in dtype.names[1:]:
+    pjd[k][0] = np.nan
+  pjd['CMT'] = cjd['CMT']
+  return cjd, pjd
+
+def analyze_series(cols):
+  '''
+  Array version of analyze() for a whole series of json files, given as
+  columns (see column_loader()). Returns a dict of DeltaError objects
+  holding arrays with one value per file.
+  '''
+  if len(cols['CMT']) == 0:
+    return {}
+  cjd, pjd = series(cols)
+  return analyze(cjd, pjd)
+
 def onclick(event):
   if event.xdata != None and event.ydata != None:
     i_edy = np.rint(event.ydata) # rint - convert to integer with rounding
@@ -176,20 +281,15 @@ def error_image(save_plots=False, save_format="pdf", **kwargs):
   else:
     plotlist = kwargs["plotlist"]
 
-  jfiles = sorted(file_loader(**kwargs))
+  jfiles, cols = column_loader(**kwargs)
 
 
   # Figure out the month and year for the first and last
   # data files. Assumes that the datafiles are contiguous.
-  with open(jfiles[0], 'r') as f:
-    jdata = json.load(f)
-    m1 = int(jdata["Month"])
-    y1 = (jdata["Year"])
-
-  with open(jfiles[-1], 'r') as f:
-    jdata = json.load(f)
-    mlast = (jdata["Month"])
-    yrlast = (jdata["Year"])
+  m1 = int(cols["Month"][0])
+  y1 = int(cols["Year"][0])
+  mlast = int(cols["Month"][-1])
+  yrlast = int(cols["Year"][-1])
 
   # Pad out the array so it fills an even 
   # number of months/years. So if the slice
@@ -202,20 +302,12 @@ def error_image(save_plots=False, save_format="pdf", **kwargs):
   imgarrays_err = np.array([np.copy(empty) for i in plotlist])
   imgarrays_delta = np.array([np.copy(empty) for i in plotlist])
 
-  # Run over all the files, calculating all the derived 
-  # diagnostics.
-  pjd = None
-  for idx, jfile in enumerate(jfiles):
-    with open(jfile, 'r') as f:
-      jdata = json.load(f)
-
-    diagnostics = analyze(jdata, pjd)
+  # Calculate all the derived diagnostics for the whole series at once.
+  diagnostics = analyze_series(cols)
 
-    for pltnum, key in enumerate(plotlist):
-      imgarrays_err[pltnum][idx+m1] = diagnostics[key].err
-      imgarrays_delta[pltnum][idx+m1] = diagnostics[key].delta
-
-    pjd = jdata
+  for pltnum, key in enumerate(plotlist):
+    imgarrays_err[pltnum][m1:m1+len(jfiles)] = diagnostics[key].err
+    imgarrays_delta[pltnum][m1:m1+len(jfiles)] = diagnostics[key].delta
 
   # Old method - resulted in 2 or more plots per panel (i.e. 'C soil', 
   # 'C veg', etc), and then one figure for each error, delta, and error/delta.
@@ -290,7 +382,7 @@ def image_plot(imgarrays, plotlist, title='', save=False, format='pdf', savetag=
     print("min/max values in data array:", data.min(), data.max())
 
     # Transform data to 2D shape for showing as an image
-    data = data.reshape(len(data)/12, 12)
+    data = data.reshape(len(data)//12, 12)
 
     # Not totally sure how this part works, but it seems to help make room
     # for the colorbar axes
@@ -373,8 +465,9 @@ def image_plot(imgarrays, plotlist, title='', save=False, format='pdf', savetag=
 
 def plot_tests(test_list, **kwargs):
   #title =  "------  %s  ------" % t
+  tables = compile_tables(test_list, **kwargs)
   for t in test_list:
-    data = compile_table_by_year(t, **kwargs)
+    data = tables[t]
 
     np.loadtxt(StringIO(data), skiprows=1)
     [_f for _f in data.split("\n")[0].split(" ") if _f]
@@ -416,9 +509,10 @@ def run_tests(test_list, **kwargs):
             f.write("")
 
 
+    tables = compile_tables(test_list, **kwargs)
     for t in test_list:
         title =  "------  %s  ------" % t
-        data = compile_table_by_year(t, **kwargs)
+        data = tables[t]
 
         # print to console (p2c)
         if 'p2c' in kwargs and kwargs['p2c'] == True:
@@ -430,43 +524,62 @@ def run_tests(test_list, **kwargs):
                 f.write(title); f.write("\n")
                 f.write(data)
 
-def compile_table_by_year(test_case, **kwargs):
-
-    jfiles = file_loader(**kwargs)
-
-    # map 'test case' strings to various test and 
-    # reporting functions we have written in the module.
-    function_dict = {
-        'N_soil_balance':             Check_N_cycle_soil_balance,
-        'N_veg_balance':              Check_N_cycle_veg_balance,
-        'C_soil_balance':             Check_C_cycle_soil_balance,
-        'C_veg_balance':              Check_C_cycle_veg_balance,
-        'C_veg_vascular_balance':     Check_C_cycle_veg_vascular_balance,
-        'C_veg_nonvascular_balance':  Check_C_cycle_veg_nonvascular_balance,
-        'report_soil_C':              Report_Soil_C
-    }
+def compile_tables(test_cases, **kwargs):
+    '''
+    Builds the tabular reports for all of `test_cases` (keys of CHECKS) in
+    a single pass over the json files; each file is read and parsed once no
+    matter how many reports are requested. The balances are computed for
+    the whole series at once (see analyze_series()).
 
-    check_func = function_dict[test_case]
+    --> various kwargs, passed to file loader
 
-    header = check_func(0, header=True)
+    Returns
+    -------
+    tables : OrderedDict
+      Maps each test case to its report (header line and one row per file).
+    '''
+    jfiles, cols = column_loader(**kwargs)
 
-    table_data = ""
-    for idx, jfile in enumerate(jfiles):
-        with open(jfile, 'r') as f:
-            jdata = json.load(f)
+    check_funcs = [(t, CHECKS[t]) for t in test_cases]
 
-        prev_jdata = None
-        if idx > 0:
-            with open(jfiles[idx-1], 'r') as prev_jf:
-                prev_jdata = json.load(prev_jf)
+    # Balances for all the rows up front, see analyze_series()
+    results = analyze_series(cols)
 
-        row = check_func(idx, jd=jdata, pjd=prev_jdata, header=False)
+    rows = dict((t, [f(0, header=True)]) for t, f in check_funcs)
+    for idx, jdata, prev_jdata in pairwise_records(cols):
+        bal = dict((k, DeltaError(r.delta[idx], r.err[idx])) for k, r in results.items())
+        for t, f in check_funcs:
+            rows[t].append(f(idx, jd=jdata, pjd=prev_jdata, bal=bal, header=False))
 
-        table_data = table_data + row
+    return collections.OrderedDict((t, "".join(rows[t])) for t in test_cases)
 
-    full_report = header + table_data
+def compile_table_by_year(test_case, **kwargs):
+    '''Builds the tabular report for a single test case, see compile_tables().'''
+    return compile_tables([test_case], **kwargs)[test_case]
+
+# A dict for mapping community type numbers
+# to differnet combos of PFTs for vascular/non-vascular
+# We should really build this programatically based on the parameter files
+# or something! Bound to get out of whack if we try to maintain manually!
+CMTLU = {
+  1: { # Black spruce - split guesses by looking at parameters/cmt_calparbgc.txt
+    'all'      : [0,1,2,3,4,5,6,7,8,9],
+    'vasc'     : [0,1,2,3,4,5,6],
+    'nonvasc'  : [7, 8]
+  },
+  4: {
+    'all'      : [0,1,2,3,4,5,6,7,8,9], # <- ?? need to include 9 ??
+    'vasc'     : [0,1,2,3,4,5,6],
+    'nonvasc'  : [7,8]
+  },
+  5: {
+    'all'      : [0,1,2,3,4,5,6,7,8,9],
+    'vasc'     : [0,1,2,3,4],
+    'nonvasc'  : [5,6,7]
+  },
+  6: {}
+}
 
-    return full_report
 
 def sum_across(key, jdata, xsec):
   '''
@@ -483,42 +596,24 @@ def sum_across(key, jdata, xsec):
   -------
   total : float
     The sum of the values for 'key' across the cross-section specified by 'xsec'.
+    Works the same with the array records from series().
   '''
-  # Setup a dict for mapping community type numbers
-  # to differnet combos of PFTs for vascular/non-vascular
-  # We should really build this programatically based on the parameter files
-  # or something! Bound to get out of whack if we try to maintain manually!
-  CMTLU = {
-    1: { # Black spruce - split guesses by looking at parameters/cmt_calparbgc.txt
-      'all'      : [0,1,2,3,4,5,6,7,8,9],
-      'vasc'     : [0,1,2,3,4,5,6],
-      'nonvasc'  : [7, 8]
-    },
-    4: {
-      'all'      : [0,1,2,3,4,5,6,7,8,9], # <- ?? need to include 9 ??
-      'vasc'     : [0,1,2,3,4,5,6],
-      'nonvasc'  : [7,8]
-    },
-    5: {
-      'all'      : [0,1,2,3,4,5,6,7,8,9],
-      'vasc'     : [0,1,2,3,4],
-      'nonvasc'  : [5,6,7]
-    },
-    6: {}
-  }
-
-  CMT = int(jdata['CMT'].lstrip('CMT')) # reduce from string like 'CMT01'
+  CMT = int(str(np.ravel(jdata['CMT'])[0]).lstrip('CMT')) # reduce from string like 'CMT01'
   if CMT not in list(CMTLU.keys()):
     print("%% ERROR! {:%>65s}".format('%'))
     print(" YOU MIGHT BE THE FIRST TO WORK WITH THIS COMMUNITY TYPE!")
-    print(" ADD THE VASCULAR/NON-VASCULAR SPLIT TO THE LOOKUP TABLE")
-    print(" IN THE sum_across() FUNCTION.")
+    print(" ADD THE VASCULAR/NON-VASCULAR SPLIT TO THE CMTLU LOOKUP")
+    print(" TABLE USED BY THE sum_across() FUNCTION.")
     print("%%%%%%%%%%{:%>65s}".format('%'))
     sys.exit(-1)
 
   pfts = CMTLU[CMT][xsec]
   total = np.nan
-  if jdata != None:
+  if isinstance(jdata, (np.ndarray, np.void)):
+    # Structured records, reduce along the PFT (and compartment) axes.
+    values = pft_stack(jdata, key, pfts=pfts)
+    return values.sum(axis=tuple(range(np.ndim(jdata), values.ndim)))
+  if jdata is not None:
     total = 0
     for pft in ['PFT%i'%i for i in pfts]:
       if ( type(jdata[pft][key]) == dict ): # sniff out compartment variables
@@ -533,7 +628,7 @@ def sum_across(key, jdata, xsec):
 
 def ecosystem_sum_soilC(jdata):
   total = np.nan
-  if jdata != None:
+  if jdata is not None:
     total = 0
     total += jdata["RawCSum"]
     total += jdata["SomaSum"]
@@ -553,7 +648,7 @@ class DeltaError(object):
 
 def bal_C_standing_dead(cjd, pjd):
   delta = np.nan
-  if pjd != None:
+  if pjd is not None:
     delta = cjd["StandingDeadC"] - pjd["StandingDeadC"]
   sum_of_fluxes = cjd["BurnAbvVeg2DeadC"] - cjd["D2WoodyDebrisC"]
   err = delta - sum_of_fluxes
@@ -561,7 +656,7 @@ def bal_C_standing_dead(cjd, pjd):
 
 def bal_N_standing_dead(cjd, pjd):
   delta = np.nan
-  if pjd != None:
+  if pjd is not None:
     delta = cjd["StandingDeadN"] - pjd["StandingDeadN"]
   sum_of_fluxes = cjd["BurnAbvVeg2DeadN"] - cjd["D2WoodyDebrisN"]
   err = delta - sum_of_fluxes
@@ -569,7 +664,7 @@ def bal_N_standing_dead(cjd, pjd):
 
 def bal_C_woody_debris(cjd, pjd):
   delta = np.nan
-  if pjd != None:
+  if pjd is not None:
     delta = cjd["WoodyDebrisC"] - pjd["WoodyDebrisC"]
   sum_of_fluxes = cjd["D2WoodyDebrisC"] - cjd["RHwdeb"]
   err = delta - sum_of_fluxes
@@ -577,21 +672,22 @@ def bal_C_woody_debris(cjd, pjd):
 
 def bal_N_woody_debris(cjd, pjd):
   delta = np.nan
-  if pjd != None:
+  if pjd is not None:
     delta = cjd["WoodyDebrisN"] - pjd["WoodyDebrisN"]
 
   # Avoid divide by zero problem - assume no RH if there is no WoodyDebrisC
-  if cjd["WoodyDebrisC"] != 0:
-    sum_of_fluxes = cjd["D2WoodyDebrisN"] - (cjd["RHwdeb"] * cjd["WoodyDebrisN"]/cjd["WoodyDebrisC"])
-  else:
-    sum_of_fluxes = cjd["D2WoodyDebrisN"]
+  # (written with np.where so it also works on whole series)
+  wdc = np.asarray(cjd["WoodyDebrisC"], dtype=float)
+  has_wdc = wdc != 0
+  rh_n = np.where(has_wdc, cjd["RHwdeb"] * cjd["WoodyDebrisN"] / np.where(has_wdc, wdc, 1.0), 0.0)
+  sum_of_fluxes = cjd["D2WoodyDebrisN"] - rh_n
 
   err = delta - sum_of_fluxes
   return DeltaError(delta, err)
 
 def bal_C_soil(curr_jd, prev_jd):
   delta = np.nan
-  if prev_jd != None:
+  if prev_jd is not None:
     delta = ecosystem_sum_soilC(curr_jd) - ecosystem_sum_soilC(prev_jd)
 
   sum_of_fluxes = sum_across("LitterfallCarbonAll", curr_jd, 'all') \
@@ -624,7 +720,7 @@ def bal_C_veg(curr_jd, pjd, xsec='all'):
   '''
 
   delta = np.nan
-  if pjd != None:
+  if pjd is not None:
     delta = sum_across("VegCarbon", curr_jd, xsec) - sum_across("VegCarbon", pjd, xsec)
 
   if xsec == 'all':
@@ -651,7 +747,7 @@ def bal_C_veg(curr_jd, pjd, xsec='all'):
 
 def bal_N_soil_org(jd, pjd):
   delta = np.nan
-  if pjd != None:
+  if pjd is not None:
     delta = jd["OrganicNitrogenSum"] - pjd["OrganicNitrogenSum"]
 
   sum_of_fluxes = sum_across("LitterfallNitrogenPFT", jd, 'all') \
@@ -666,7 +762,7 @@ def bal_N_soil_org(jd, pjd):
 
 def bal_N_soil_avl(jd, pjd):
   delta = np.nan
-  if pjd != None:
+  if pjd is not None:
     delta = jd["AvailableNitrogenSum"] - pjd["AvailableNitrogenSum"]
   sum_of_fluxes = (jd["NetNMin"] + jd["AvlNInput"]) - (jd["NExtract"] + jd["AvlNLost"])
   err = delta - sum_of_fluxes
@@ -675,7 +771,7 @@ def bal_N_soil_avl(jd, pjd):
 def bal_N_veg_tot(jd, pjd, xsec='all'):
 
   delta = np.nan
-  if pjd != None:
+  if pjd is not None:
     delta = sum_across("NAll", jd, xsec) - sum_across("NAll", pjd, xsec)
 
   if xsec == 'all':
@@ -705,7 +801,7 @@ def bal_N_veg_tot(jd, pjd, xsec='all'):
 def bal_N_veg_str(jd, pjd, xsec='all'):
 
   delta = np.nan
-  if pjd != None:
+  if pjd is not None:
     delta = sum_across("VegStructuralNitrogen", jd, xsec) - sum_across("VegStructuralNitrogen", pjd, xsec) # <-- will sum compartments
 
   if xsec == 'all':
@@ -740,7 +836,7 @@ def bal_N_veg_str(jd, pjd, xsec='all'):
 def bal_N_veg_lab(jd, pjd, xsec='all'):
 
   delta = np.nan
-  if pjd != None:
+  if pjd is not None:
     delta = sum_across("VegLabileNitrogen", jd, xsec) - sum_across("VegLabileNitrogen", pjd, xsec)
 
   if xsec=='all' or xsec == 'vasc' or xsec == 'nonvasc':
@@ -752,8 +848,11 @@ def bal_N_veg_lab(jd, pjd, xsec='all'):
   return DeltaError(delta, err)
 
 
-def Check_N_cycle_veg_balance(idx, header=False, jd=None, pjd=None):
+def Check_N_cycle_veg_balance(idx, header=False, jd=None, pjd=None, bal=None):
     '''Checking....?'''
+    if not header and bal is None:
+        bal = analyze(jd, pjd)
+
     if header:
         return "{:<4} {:>6} {:>2} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}\n".format(
                 "idx", "yr", "m", "errT", "errS", "errL", "deltaN", "delNStr", "delNLab", "sumFlxT","sumFlxS", "sumFlxL"
@@ -767,20 +866,23 @@ def Check_N_cycle_veg_balance(idx, header=False, jd=None, pjd=None):
                 idx,
                 jd["Year"],
                 jd["Month"],
-                bal_N_veg_tot(jd, pjd, xsec='all').err,
-                bal_N_veg_str(jd, pjd, xsec='all').err,
-                bal_N_veg_lab(jd, pjd, xsec='all').err,
+                bal['N_veg_tot'].err,
+                bal['N_veg_str'].err,
+                bal['N_veg_lab'].err,
 
-                bal_N_veg_tot(jd, pjd, xsec='all').delta,
-                bal_N_veg_str(jd, pjd, xsec='all').delta,
-                bal_N_veg_lab(jd, pjd, xsec='all').delta,
+                bal['N_veg_tot'].delta,
+                bal['N_veg_str'].delta,
+                bal['N_veg_lab'].delta,
 
                 sum_str_N_flux + sum_lab_N_flux,
                 sum_str_N_flux,
                 sum_lab_N_flux,
         )
 
-def Check_N_cycle_soil_balance(idx, header=False, jd=None, pjd=None):
+def Check_N_cycle_soil_balance(idx, header=False, jd=None, pjd=None, bal=None):
+
+    if not header and bal is None:
+        bal = analyze(jd, pjd)
 
     if header:
       return "{:<6} {:<6} {:<2} {:>10} {:>10} {:>10} {:>10}\n".format("idx","yr","m","errORGN","delORGN","errAVL","delAVL" )
@@ -789,13 +891,16 @@ def Check_N_cycle_soil_balance(idx, header=False, jd=None, pjd=None):
         idx,
         jd["Year"],
         jd["Month"],
-        bal_N_soil_org(jd, pjd).err,
-        bal_N_soil_org(jd, pjd).delta,
-        bal_N_soil_avl(jd, pjd).err,
-        bal_N_soil_avl(jd, pjd).delta
+        bal['N_soil_org'].err,
+        bal['N_soil_org'].delta,
+        bal['N_soil_avl'].err,
+        bal['N_soil_avl'].delta
     )
 
-def Check_C_cycle_soil_balance(idx, header=False, jd=None, pjd=None):
+def Check_C_cycle_soil_balance(idx, header=False, jd=None, pjd=None, bal=None):
+    if not header and bal is None:
+        bal = analyze(jd, pjd)
+
     if header:
         return '{:<4} {:>2} {:>4} {:>8} {:>10} {:>10}     {:>10} {:>10} {:>10} {:>10} {:>10}\n'.format(
                'idx', 'm', 'yr', 'err', 'deltaC', 'lfmdcrh', 'sumsoilC', 'ltrfal', 'mossdeathc', 'RH', 'checksum'
@@ -805,8 +910,8 @@ def Check_C_cycle_soil_balance(idx, header=False, jd=None, pjd=None):
               idx,
               jd["Month"],
               jd["Year"],
-              bal_C_soil(jd, pjd).err,
-              bal_C_soil(jd, pjd).delta,
+              bal['C_soil'].err,
+              bal['C_soil'].delta,
               sum_across("LitterfallCarbonAll", jd, 'all')  + sum_across("MossDeathC", jd, 'all') - jd["RH"],
               ecosystem_sum_soilC(jd),
               sum_across("LitterfallCarbonAll", jd, 'all') ,
@@ -815,7 +920,7 @@ def Check_C_cycle_soil_balance(idx, header=False, jd=None, pjd=None):
               (jd['RHsomcr']+jd['RHsompr']+jd['RHsoma']+jd['RHraw']+jd['RHmossc']+jd['RHwdeb']),
           )
 
-def Report_Soil_C(idx, header=False, jd=None, pjd=None):
+def Report_Soil_C(idx, header=False, jd=None, pjd=None, bal=None):
     '''Create a table/report for Soil Carbon'''
     if header:
         return '{:<4} {:>4} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}\n'.format(
@@ -841,8 +946,11 @@ def Report_Soil_C(idx, header=False, jd=None, pjd=None):
 
             )
 
-def Check_C_cycle_veg_balance(idx, header=False, jd=None, pjd=None):
+def Check_C_cycle_veg_balance(idx, header=False, jd=None, pjd=None, bal=None):
     '''Should duplicate Vegetation_Bgc::deltastate()'''
+    if not header and bal is None:
+        bal = analyze(jd, pjd)
+
     if header:
         return '{:<4} {:>2} {:>4} {:>10} {:>10} {:>15}     {:>10} {:>15} {:>15} {:>15}\n'.format(
                'idx', 'm', 'yr', 'err', 'deltaC', 'NPP-LFallC-mdc', 'mdc', 'VegC', 'NPP', 'LFallC' )
@@ -852,8 +960,8 @@ def Check_C_cycle_veg_balance(idx, header=False, jd=None, pjd=None):
                 idx,
                 jd['Month'],
                 jd['Year'],
-                bal_C_veg(jd, pjd, xsec='all').err,
-                bal_C_veg(jd, pjd, xsec='all').delta,
+                bal['C_veg'].err,
+                bal['C_veg'].delta,
 
                 sum_across("NPPAll", jd, 'all')  - sum_across("LitterfallCarbonAll", jd, 'all')  - sum_across("MossDeathC", jd, 'all'),
                 sum_across("MossDeathC", jd, 'all'),
@@ -862,7 +970,7 @@ def Check_C_cycle_veg_balance(idx, header=False, jd=None, pjd=None):
                 sum_across("LitterfallCarbonAll", jd, 'all') ,
             )
 
-def Check_C_cycle_veg_vascular_balance(idx, header=False, jd=None, pjd=None):
+def Check_C_cycle_veg_vascular_balance(idx, header=False, jd=None, pjd=None, bal=None):
     '''Should duplicate Vegetation_Bgc::deltastate()'''
 
     print("%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%")
@@ -872,6 +980,9 @@ def Check_C_cycle_veg_vascular_balance(idx, header=False, jd=None, pjd=None):
     # vascular PFT list (CMT05)
     vascular = [0,1,2,3,4]
 
+    if not header and bal is None:
+        bal = analyze(jd, pjd)
+
     if header:
         return '{:<4} {:>2} {:>4} {:>10} {:>10} {:>15} {:>10} {:>15} {:>15} {:>15}\n'.format(
                'idx', 'm', 'yr', 'err', 'deltaC', 'NPP-LFallC-mdc', 'mdc', 'VegC', 'NPP', 'LFallC' )
@@ -881,8 +992,8 @@ def Check_C_cycle_veg_vascular_balance(idx, header=False, jd=None, pjd=None):
                 jd['Month'],
                 jd['Year'],
 
-                bal_C_veg(jd, pjd, xsec='vasc').err,
-                bal_C_veg(jd, pjd, xsec='vasc').delta,
+                bal['C_veg_vasc'].err,
+                bal['C_veg_vasc'].delta,
 
                 sum_across("NPPAll", jd, 'vasc')  - sum_across("LitterfallCarbonAll", jd, 'vasc')  - sum_across("MossDeathC",jd,'vasc'),
 
@@ -892,7 +1003,7 @@ def Check_C_cycle_veg_vascular_balance(idx, header=False, jd=None, pjd=None):
                 sum_across("LitterfallCarbonAll", jd, 'vasc')
             )
 
-def Check_C_cycle_veg_nonvascular_balance(idx, header=False, jd=None, pjd=None):
+def Check_C_cycle_veg_nonvascular_balance(idx, header=False, jd=None, pjd=None, bal=None):
     '''Should duplicate Vegetation_Bgc::deltastate()'''
 
     print("%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%")
@@ -902,6 +1013,9 @@ def Check_C_cycle_veg_nonvascular_balance(idx, header=False, jd=None, pjd=None):
     # non-vascular PFT list (CMT05)
     non_vasc = [5,6,7]
 
+    if not header and bal is None:
+        bal = analyze(jd, pjd)
+
     if header:
         return '{:<4} {:>2} {:>4} {:>10} {:>10} {:>15} {:>10} {:>15} {:>15} {:>15}\n'.format(
                'idx', 'm', 'yr', 'err', 'deltaC', 'NPP-LFallC-mdc', 'mdc', 'VegC', 'NPP', 'LFallC' )
@@ -913,8 +1027,8 @@ def Check_C_cycle_veg_nonvascular_balance(idx, header=False, jd=None, pjd=None):
                 jd['Month'],
                 jd['Year'],
 
-                bal_C_veg(jd, pjd, xsec='nonvasc').err,
-                bal_C_veg(jd, pjd, xsec='nonvasc').delta,
+                bal['C_veg_nonvasc'].err,
+                bal['C_veg_nonvasc'].delta,
 
                 sum_across("NPPAll", jd, 'nonvasc')  - sum_across("LitterfallCarbonAll", jd, 'nonvasc')  - sum_across("MossDeathC", jd, 'nonvasc'),
                 sum_across("MossDeathC", jd, 'nonvasc'),
@@ -923,6 +1037,277 @@ def Check_C_cycle_veg_nonvascular_balance(idx, header=False, jd=None, pjd=None):
                 sum_across("LitterfallCarbonAll", jd, 'nonvasc') ,
             )
 
+# Carbon and nitrogen budgets that can be checked on the netCDF outputs of a
+# (regional) run, see nc_budget_closure(). For each budget the change in the
+# sum of the `pools` from one timestep to the next should equal the sum of
+# the `inputs` minus the sum of the `outputs` during the timestep. Outputs
+# with PFT, compartment or layer dimensions are summed over them. Monthly
+# outputs give the most meaningful results.
+NC_BUDGETS = collections.OrderedDict([
+    ('C_veg', dict(
+        pools=['VEGC'],
+        inputs=['NPP'],
+        outputs=['LTRFALC', 'MOSSDEATHC', 'BURNVEG2AIRC', 'BURNVEG2SOIABVC',
+                 'BURNVEG2SOIBLWC', 'BURNVEG2DEADC'])),
+    ('C_dead', dict(
+        pools=['DEADC', 'DWDC'],
+        inputs=['BURNVEG2DEADC'],
+        outputs=['WDRH'])),
+    ('C_soil', dict(
+        pools=['SHLWC', 'DEEPC', 'MINEC'],
+        inputs=['LTRFALC', 'MOSSDEATHC', 'BURNVEG2SOIABVC', 'BURNVEG2SOIBLWC'],
+        outputs=['RH', 'BURNSOIC'])),
+    ('C_ecosystem', dict(
+        pools=['VEGC', 'DEADC', 'DWDC', 'SHLWC', 'DEEPC', 'MINEC'],
+        inputs=['NPP'],
+        outputs=['RH', 'WDRH', 'BURNVEG2AIRC', 'BURNSOIC'])),
+    ('N_veg', dict(
+        pools=['VEGN'],
+        inputs=['NUPTAKEST', 'NUPTAKELAB'],
+        outputs=['LTRFALN', 'MOSSDEATHN', 'BURNVEG2AIRN', 'BURNVEG2SOIABVN',
+                 'BURNVEG2SOIBLWN', 'BURNVEG2DEADN'])),
+    ('N_soil_org', dict(
+        pools=['ORGN'],
+        inputs=['LTRFALN', 'MOSSDEATHN', 'BURNVEG2SOIABVN', 'BURNVEG2SOIBLWN'],
+        outputs=['NETNMIN', 'BURNSOILN'])),
+    ('N_soil_avl', dict(
+        pools=['AVLN'],
+        inputs=['NETNMIN', 'NINPUT'],
+        outputs=['NUPTAKEST', 'NUPTAKELAB', 'NLOST'])),
+])
+
+# Per pixel statistics reported for each budget by nc_budget_closure()
+NC_CLOSURE_STATS = ['max_abs_err', 'argmax', 'mean_abs_err', 'rms_err', 'count']
+
+def _nc_budget_vars(budget):
+  spec = NC_BUDGETS[budget]
+  return spec['pools'] + spec['inputs'] + spec['outputs']
+
+def _nc_totals(sv, t0, t1):
+  '''
+  Reads timesteps t0:t1 of `sv` (a StagedVariable) and sums over any
+  dimensions between time and (y, x). Returns a float array (time, y, x)
+  with nan for masked values.
+  '''
+  data = sv[t0:t1]
+  data = np.ma.filled(np.ma.asarray(data, dtype=np.float64), np.nan)
+  return data.reshape((data.shape[0], -1) + data.shape[-2:]).sum(axis=1)
+
+def nc_budget_errors(outdir, budgets, timeres='monthly', stage='tr', chunk_size=120, outputs=None):
+  '''
+  Streams the netCDF outputs for one `stage` in chunks of `chunk_size`
+  timesteps and yields a tuple (t0, errors) for each chunk. `errors` maps
+  each of `budgets` (keys of NC_BUDGETS) to a tuple of arrays (delta, err),
+  each (time, y, x), where delta is the change in the pools and err is
+  delta minus the net flux. The first timestep of the stage has no delta
+  (nan).
+
+  Each output file is read once per chunk, no matter how many budgets use
+  it.
+  '''
+  if outputs is None:
+    outputs = ou.RunOutputs(outdir)
+
+  names = []
+  for b in budgets:
+    names += [v for v in _nc_budget_vars(b) if v not in names]
+  svs = dict((v, outputs.get(v, timeres, [stage])) for v in names)
+  n = len(svs[names[0]])
+  for v, sv in svs.items():
+    if len(sv) != n:
+      raise RuntimeError("Time dimension of {} ({}) doesn't match {} ({})!".format(v, len(sv), names[0], n))
+
+  last = {}
+  for t0 in range(0, n, chunk_size):
+    t1 = min(n, t0 + chunk_size)
+    totals = dict((v, _nc_totals(sv, t0, t1)) for v, sv in svs.items())
+
+    errors = collections.OrderedDict()
+    for b in budgets:
+      spec = NC_BUDGETS[b]
+      pool = sum(totals[v] for v in spec['pools'])
+      flux = sum(totals[v] for v in spec['inputs']) - sum(totals[v] for v in spec['outputs'])
+
+      prev = last.get(b, np.full(pool.shape[1:], np.nan))
+      delta = np.diff(np.concatenate((prev[np.newaxis], pool)), axis=0)
+      errors[b] = (delta, delta - flux)
+      last[b] = pool[-1]
+
+    yield t0, errors
+
+def _nc_stage_closure(task):
+  '''
+  Worker for nc_budget_closure(); must be module level so it can be pickled.
+  Returns (stage, {budget: {stat: (y, x) array}}).
+  '''
+  outdir, stage, timeres, budgets, chunk_size, save_maps = task
+
+  outputs = ou.RunOutputs(outdir)
+  stats = {}
+  mapfile = None
+  try:
+    for t0, errors in nc_budget_errors(outdir, budgets, timeres, stage, chunk_size, outputs):
+      for b, (delta, err) in errors.items():
+        if b not in stats:
+          shape = err.shape[1:]
+          stats[b] = dict(max_abs_err=np.full(shape, -np.inf), argmax=np.full(shape, -1),
+              sum_abs=np.zeros(shape), sum_sq=np.zeros(shape), count=np.zeros(shape, dtype=int))
+        st = stats[b]
+        valid = ~np.isnan(err)
+        abserr = np.where(valid, np.abs(err), -np.inf)
+        i = abserr.argmax(axis=0)
+        chunk_max = np.take_along_axis(abserr, i[np.newaxis], axis=0)[0]
+        better = chunk_max > st['max_abs_err']
+        st['max_abs_err'] = np.where(better, chunk_max, st['max_abs_err'])
+        st['argmax'] = np.where(better, i + t0, st['argmax'])
+        st['sum_abs'] += np.where(valid, np.abs(err), 0).sum(axis=0)
+        st['sum_sq'] += np.where(valid, err**2, 0).sum(axis=0)
+        st['count'] += valid.sum(axis=0)
+
+      if save_maps:
+        if mapfile is None:
+          mapfile = _nc_closure_mapfile(save_maps, stage, timeres, errors)
+        for b, (delta, err) in errors.items():
+          mapfile.variables[b][t0:t0 + err.shape[0]] = err
+  finally:
+    if mapfile is not None:
+      mapfile.close()
+
+  result = collections.OrderedDict()
+  for b, st in stats.items():
+    count = st['count']
+    with np.errstate(invalid='ignore', divide='ignore'):
+      result[b] = dict(
+          max_abs_err=np.where(count > 0, st['max_abs_err'], np.nan),
+          argmax=st['argmax'],
+          mean_abs_err=st['sum_abs'] / count,
+          rms_err=np.sqrt(st['sum_sq'] / count),
+          count=count,
+      )
+  return stage, result
+
+def _nc_closure_mapfile(save_maps, stage, timeres, errors):
+  '''Creates the netCDF file for the error maps of one stage.'''
+  import netCDF4
+  if not os.path.isdir(save_maps):
+    os.makedirs(save_maps)
+  path = os.path.join(save_maps, "budget_closure_{}_{}.nc".format(timeres, stage))
+  ds = netCDF4.Dataset(path, 'w')
+  shape = list(errors.values())[0][1].shape
+  ds.createDimension('time', None)
+  ds.createDimension('y', shape[1])
+  ds.createDimension('x', shape[2])
+  for b in errors:
+    v = ds.createVariable(b, 'f8', ('time', 'y', 'x'), zlib=True)
+    v.long_name = "{} closure error (delta pools - net flux)".format(b)
+  return ds
+
+def nc_budget_closure(outdir, budgets=None, timeres='monthly', stages=None,
+    chunk_size=120, ref_run_status=None, worst=10, save_maps=None, workers=None):
+  '''
+  Checks carbon and nitrogen budget closure (see NC_BUDGETS) for every
+  pixel on the netCDF outputs in `outdir`. The stages are processed in
+  parallel (one process each), each streaming its output files in time
+  chunks.
+
+  Parameters
+  ----------
+  budgets : list of str, optional
+    Keys of NC_BUDGETS. By default every budget whose outputs are all
+    available for `timeres`.
+  timeres : str
+    'monthly' or 'yearly'.
+  stages : list of str, optional
+    Defaults to all the stages with outputs.
+  ref_run_status : str, optional
+    Path to a run_status.nc file; failed pixels are left out of the worst
+    pixel lists. Defaults to `outdir`/run_status.nc if it exists.
+  worst : int
+    How many of the worst pixels to list for each stage and budget.
+  save_maps : str, optional
+    A directory to write the full (time, y, x) error maps to, one netCDF
+    file per stage.
+  workers : int, optional
+    Size of the process pool; defaults to one process per stage. Use 1 to
+    run serially.
+
+  Returns
+  -------
+  results : OrderedDict
+    Maps (stage, budget) to a dict of (y, x) arrays (see NC_CLOSURE_STATS)
+    and a 'worst' list of (y, x, max_abs_err, timestep) tuples.
+  '''
+  outputs = ou.RunOutputs(outdir)
+  if budgets is None:
+    budgets = [b for b in NC_BUDGETS
+        if all(len(outputs.stages(v, timeres)) > 0 for v in _nc_budget_vars(b))]
+  for b in budgets:
+    missing = [v for v in _nc_budget_vars(b) if len(outputs.stages(v, timeres)) == 0]
+    if len(missing) > 0:
+      raise RuntimeError("Can't check {} budget, missing {} outputs: {}".format(b, timeres, ', '.join(missing)))
+  if len(budgets) == 0:
+    raise RuntimeError("No budgets can be checked with the {} outputs in {}".format(timeres, outdir))
+
+  if stages is None:
+    stages = [s for s in ou.STAGES
+        if all(s in outputs.stages(v, timeres) for b in budgets for v in _nc_budget_vars(b))]
+
+  if ref_run_status is None and os.path.isfile(os.path.join(outdir, 'run_status.nc')):
+    ref_run_status = os.path.join(outdir, 'run_status.nc')
+
+  tasks = [(outdir, s, timeres, budgets, chunk_size, save_maps) for s in stages]
+  if workers == 1 or len(tasks) == 1:
+    stage_results = [_nc_stage_closure(t) for t in tasks]
+  else:
+    pool = multiprocessing.Pool(workers or len(tasks))
+    try:
+      stage_results = pool.map(_nc_stage_closure, tasks)
+    finally:
+      pool.close()
+      pool.join()
+
+  results = collections.OrderedDict()
+  for stage, result in stage_results:
+    for b, st in result.items():
+      active = np.ones(st['max_abs_err'].shape, dtype=bool)
+      if ref_run_status is not None:
+        active = ou.PixelIndex.load(ref_run_status=ref_run_status).active_mask()
+      score = np.where(active & ~np.isnan(st['max_abs_err']), st['max_abs_err'], -np.inf)
+      order = np.argsort(score, axis=None)[::-1][:worst]
+      ys, xs = np.unravel_index(order, score.shape)
+      st['worst'] = [(int(y), int(x), float(st['max_abs_err'][y, x]), int(st['argmax'][y, x]))
+          for y, x in zip(ys, xs) if np.isfinite(score[y, x])]
+      results[(stage, b)] = st
+
+  return results
+
+def nc_budget_report(results):
+  '''Formats the results of nc_budget_closure() as a text table.'''
+  lines = ["{:<5} {:<12} {:>12} {:>12} {:>12}   {}".format(
+      'stage', 'budget', 'max|err|', 'mean|err|', 'rms', 'worst pixels (y,x): max|err| @ timestep')]
+  for (stage, b), st in results.items():
+    lines.append("{:<5} {:<12} {:>12.4g} {:>12.4g} {:>12.4g}   {}".format(
+        stage, b,
+        np.nanmax(st['max_abs_err']) if np.any(st['count'] > 0) else np.nan,
+        np.nanmean(st['mean_abs_err']) if np.any(st['count'] > 0) else np.nan,
+        np.nanmean(st['rms_err']) if np.any(st['count'] > 0) else np.nan,
+        ", ".join("({},{}): {:.4g} @ {}".format(*w) for w in st['worst'])))
+  return "\n".join(lines) + "\n"
+
+
+# Map 'test case' strings to the various test and reporting functions we
+# have written in the module. compile_tables() runs any number of these in
+# the same pass over the data.
+CHECKS = collections.OrderedDict([
+    ('N_soil_balance',            Check_N_cycle_soil_balance),
+    ('N_veg_balance',             Check_N_cycle_veg_balance),
+    ('C_soil_balance',            Check_C_cycle_soil_balance),
+    ('C_veg_balance',             Check_C_cycle_veg_balance),
+    ('C_veg_vascular_balance',    Check_C_cycle_veg_vascular_balance),
+    ('C_veg_nonvascular_balance', Check_C_cycle_veg_nonvascular_balance),
+    ('report_soil_C',             Report_Soil_C),
+])
+
 if __name__ == '__main__':
 
   # Callback for SIGINT. Allows exit w/o printing stacktrace to users screen
@@ -940,18 +1325,10 @@ if __name__ == '__main__':
     'N_standing_dead', 'N_woody_debris'
   ]
 
-  tab_reports_and_timeseries_choices = [
-    'N_soil_balance',
-    'N_veg_balance',
-    'C_soil_balance',
-    'C_veg_balance',
-    'C_veg_vascular_balance',
-    'C_veg_nonvascular_balance',
-    'report_soil_C'
-  ]
+  tab_reports_and_timeseries_choices = list(CHECKS.keys())
 
   # Make a table listing options for the help text
-  t = itertools.zip_longest(error_image_choices, tab_reports_and_timeseries_choices)
+  t = itertools.zip_longest(error_image_choices, tab_reports_and_timeseries_choices, fillvalue="")
   option_table = "\n".join(["{:>30} {:>30}".format(r[0], r[1]) for r in t])
   option_table = "\n" + option_table
 
@@ -1018,8 +1395,9 @@ if __name__ == '__main__':
       help="A custom file slice string")
 
   parser.add_argument('-a', '--from-archive', default=False,
-      help=textwrap.dedent('''Generate plots from an archive of json files, 
-          instead of the normal /tmp directory.'''))
+      help=textwrap.dedent('''Generate plots from an archive of json files
+          (or a calibration store, see calstore.py), instead of the normal
+          /tmp directory.'''))
 
   parser.add_argument('-i', '--error-image', default=False, nargs='+',
       choices=error_image_choices+['all'], metavar="P",
@@ -1049,6 +1427,28 @@ if __name__ == '__main__':
       choices=['pdf', 'png', 'jpg'],
       help="Choose a file format to use for saving plots.")
 
+  parser.add_argument('--nc-budgets', metavar='OUTDIR', default=False,
+      help=textwrap.dedent('''\
+        Check carbon and nitrogen budget closure for every pixel using the
+        netCDF outputs in OUTDIR (instead of the calibration json files).
+        Prints error statistics and the worst pixels for each stage and
+        budget. Budgets: {}'''.format(', '.join(NC_BUDGETS.keys()))))
+
+  parser.add_argument('--budgets', nargs='+', choices=list(NC_BUDGETS.keys()), metavar='B',
+      help="Which budgets to check with --nc-budgets (default: all that have outputs).")
+
+  parser.add_argument('--timeres', default='monthly', choices=['monthly', 'yearly'],
+      help="Time resolution of the outputs to use with --nc-budgets.")
+
+  parser.add_argument('--stages', nargs='+', choices=ou.STAGES, metavar='S',
+      help="Stages to check with --nc-budgets (default: all); checked in parallel.")
+
+  parser.add_argument('--worst', type=int, default=10,
+      help="How many of the worst pixels to list with --nc-budgets.")
+
+  parser.add_argument('--save-maps', metavar='DIR',
+      help="Write the (time, y, x) closure error maps for --nc-budgets to netCDF files in DIR.")
+
   print("Parsing command line arguments...")
   args = parser.parse_args()
   print("Command line argument settings:")
@@ -1090,5 +1490,11 @@ if __name__ == '__main__':
     print("Creating tabular reports...")
     run_tests(args.tab_reports, fileslice=slstr, p2c=True)
 
+  if args.nc_budgets:
+    print("Checking budget closure on netCDF outputs...")
+    results = nc_budget_closure(args.nc_budgets, budgets=args.budgets, timeres=args.timeres,
+        stages=args.stages, worst=args.worst, save_maps=args.save_maps)
+    print(nc_budget_report(results))
+
 
 
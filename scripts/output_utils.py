@@ -13,6 +13,10 @@ import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 import netCDF4 as nc
 import collections
+import warnings
+import json
+import time
+import multiprocessing
 
 
 def get_last_n_eq(var, timeres='yearly', fileprefix='', n=10):
@@ -34,28 +38,183 @@ def get_last_n_eq(var, timeres='yearly', fileprefix='', n=10):
 
 
 
-def sum_monthly_flux_to_yearly(data):
+#
+# Temporal aggregation.
+#
+# All of the functions below work on arrays of any rank as long as time is the
+# first axis, e.g. (time, y, x), (time, pft, y, x), (time, layer, y, x) or
+# (time, pftpart, pft, y, x). Groups of timesteps are reduced with a single
+# numpy ufunc.reduceat(..) call, so there are no Python loops over time.
+#
+# dvmdostem uses a 365 day (no leap) calendar.
+#
+DAYS_IN_MONTH = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+SEASONS = ['DJF', 'MAM', 'JJA', 'SON']
+
+_AGG_UFUNCS = {
+  'sum': np.add,
+  'mean': np.add,
+  'min': np.minimum,
+  'max': np.maximum,
+}
+
+
+def aggregate_time(data, starts, how='mean', out=None):
   '''
-  Expects `data` to be at least a 1D array, with the first axis being time.
-  Also assumes that the time axis starts and stops on Jan 1 and Dec 31. In 
-  otherwords, if you had a 2 years of monthly data that ran from Aug 1 thru
-  July 31, this function would NOT work!  
+  Reduces `data` along the time axis (axis 0) in groups of consecutive
+  timesteps.
+
+  `data`: (numpy array or masked array) any rank, time must be the first axis.
+
+  `starts`: (sequence of ints) the index of the first timestep of each group.
+  Must be increasing. Each group runs up to the start of the next group, the
+  last group runs to the end of `data`.
+
+  `how`: (str) one of 'sum', 'mean', 'min', or 'max'.
+
+  `out`: (numpy array or masked array) optional buffer for the result, with
+  shape `(len(starts),) + data.shape[1:]`. Useful for avoiding temporary
+  arrays when processing many files of the same shape.
+
+  Masked values are ignored. A group with no unmasked values is masked in
+  the result. If `data` is a masked array the result is a masked array,
+  otherwise a plain numpy array.
+
+  Sums and means of integer data are computed as float64; min and max keep
+  the dtype of `data`.
+
+  Returns the reduced array with shape `(len(starts),) + data.shape[1:]`.
+  '''
+  if how not in _AGG_UFUNCS:
+    raise RuntimeError("Invalid aggregation '{}'. Must be one of {}".format(how, list(_AGG_UFUNCS.keys())))
+
+  starts = np.asarray(starts, dtype=np.intp)
+  if len(starts) < 1:
+    raise RuntimeError("Must have at least one group to aggregate!")
+  if starts[0] < 0 or np.any(np.diff(starts) <= 0) or starts[-1] >= data.shape[0]:
+    raise RuntimeError("Group start indices must be increasing and within the time axis!")
+
+  ufunc = _AGG_UFUNCS[how]
+
+  if how in ('min', 'max') or np.issubdtype(data.dtype, np.floating):
+    dtype = data.dtype
+  else:
+    dtype = np.float64
+
+  mask = np.ma.getmask(data)
+  if mask is np.ma.nomask or not mask.any():
+    mask = None
+    values = np.ma.getdata(data)
+  else:
+    # Replace masked values with the identity for the reduction.
+    if how in ('sum', 'mean'):
+      fill = 0
+    elif np.issubdtype(data.dtype, np.floating):
+      fill = np.inf if how == 'min' else -np.inf
+    else:
+      info = np.iinfo(data.dtype)
+      fill = info.max if how == 'min' else info.min
+    values = data.filled(fill)
+
+  outshape = (len(starts),) + data.shape[1:]
+  if out is not None:
+    if out.shape != outshape:
+      raise RuntimeError("out has shape {}, expected {}".format(out.shape, outshape))
+    buf = np.ma.getdata(out)
+  else:
+    buf = np.empty(outshape, dtype=dtype)
+
+  ufunc.reduceat(values, starts, axis=0, out=buf)
+
+  bshape = (-1,) + (1,) * (data.ndim - 1)
+  if mask is None:
+    count = None
+    if how == 'mean':
+      lengths = np.diff(np.append(starts, data.shape[0]))
+      buf /= lengths.reshape(bshape)
+  else:
+    count = np.add.reduceat(~mask, starts, axis=0, dtype=np.intp)
+    if how == 'mean':
+      with np.errstate(invalid='ignore', divide='ignore'):
+        buf /= count
+
+  if isinstance(data, np.ma.MaskedArray):
+    result_mask = np.ma.nomask if count is None else (count == 0)
+    if isinstance(out, np.ma.MaskedArray):
+      out.mask = result_mask
+      return out
+    return np.ma.masked_array(buf, mask=result_mask)
+
+  return buf
+
+
+def _check_time_multiple(data, n, what):
+  if data.shape[0] % n != 0:
+    raise RuntimeError('data size for dimension 0 (time) must be an even multiple of {} ({})'.format(n, what))
+
+
+def monthly_to_yearly(data, how='mean', out=None):
+  '''
+  Aggregates monthly `data` to yearly. The time axis must start in January
+  and have a length that is a multiple of 12. See `aggregate_time(..)` for
+  details about `how` and `out`.
   '''
-  if (data.shape[0] % 12) != 0:
-    raise RuntimeError('data size for dimension 0 (time) must be an even multiple of 12')
+  _check_time_multiple(data, 12, 'months per year')
+  return aggregate_time(data, np.arange(0, data.shape[0], 12), how=how, out=out)
 
-  newshape = [data.shape[0] // 12]
-  for i in data.shape[1:]:
-    newshape.append(i)
 
-  yearly_data = np.zeros((newshape)) * np.nan
+def monthly_to_seasonal(data, how='mean', out=None):
+  '''
+  Aggregates monthly `data` to seasons (DJF, MAM, JJA, SON). The time axis
+  must start in January and have a length that is a multiple of 12.
+
+  Seasons follow the usual climatological convention, with December counted
+  in the winter (DJF) of the following year. That means the first DJF only
+  has January and February, and the final December is not used.
+
+  Returns an array with 4 timesteps per year, ordered DJF, MAM, JJA, SON. See
+  `aggregate_time(..)` for details about `how` and `out`.
+  '''
+  _check_time_multiple(data, 12, 'months per year')
+  nyears = data.shape[0] // 12
+  starts = (np.arange(nyears)[:,None] * 12 + np.array([-1, 2, 5, 8])).ravel()
+  starts[0] = 0
+  # View without the final December, so the last SON is Sep, Oct, Nov.
+  return aggregate_time(data[:-1], starts, how=how, out=out)
 
-  for i in range(0, newshape[0]):
-    yr_start = (i * 12)
-    yr_end = (i * 12) + 12
-    yearly_data[i] = np.sum(data[yr_start:yr_end], axis=0)
 
-  return yearly_data
+def daily_to_monthly(data, how='mean', out=None):
+  '''
+  Aggregates daily `data` to monthly, assuming a 365 day (no leap) calendar.
+  The time axis must start on Jan 1 and have a length that is a multiple of
+  365. See `aggregate_time(..)` for details about `how` and `out`.
+  '''
+  _check_time_multiple(data, 365, 'days per year')
+  nyears = data.shape[0] // 365
+  month_starts = np.concatenate(([0], np.cumsum(DAYS_IN_MONTH)[:-1]))
+  starts = (np.arange(nyears)[:,None] * 365 + month_starts).ravel()
+  return aggregate_time(data, starts, how=how, out=out)
+
+
+def yearly_to_decadal(data, how='mean', out=None):
+  '''
+  Aggregates yearly `data` to decades (groups of 10 timesteps, starting with
+  the first timestep). If the length of the time axis is not a multiple of 10
+  then the last group is a partial decade. See `aggregate_time(..)` for
+  details about `how` and `out`.
+  '''
+  return aggregate_time(data, np.arange(0, data.shape[0], 10), how=how, out=out)
+
+
+def sum_monthly_flux_to_yearly(data):
+  '''
+  Expects `data` to be at least a 1D array, with the first axis being time.
+  Also assumes that the time axis starts and stops on Jan 1 and Dec 31. In
+  otherwords, if you had a 2 years of monthly data that ran from Aug 1 thru
+  July 31, this function would NOT work!
+  '''
+  return monthly_to_yearly(data, how='sum')
 
 
 def sum_across_compartments(data):
@@ -111,12 +270,11 @@ def average_monthly_pool_to_yearly(data):
   The function will compute the average of the input array along the time 
   dimension in strides of 12.
 
-  Returns a 3D, 4D, or 5D numpy array with dimensions e.g. `(time, layers, y, x)`, 
-  (same as input), but the length of the returned time dimension will be 
-  1/12th of the length of the input array.
+  Returns a 3D, 4D, or 5D numpy masked array with dimensions e.g.
+  `(time, layers, y, x)`, (same as input), but the length of the returned time
+  dimension will be 1/12th of the length of the input array.
 
-  Note: this function contains a loop and could probably be vectorized somehow
-  with some fancy numpy indexing.
+  See also `monthly_to_yearly(..)`.
 
   Examples:
       Load a monthly file with soil layer data and convert it to yearly.
@@ -130,30 +288,18 @@ def average_monthly_pool_to_yearly(data):
       >>> a = np.ma.masked_values(a, -99999)
       >>> 
       >>> b = average_monthly_pool_to_yearly(a)
-      >>> print a.shape, b.shape
+      >>> print(a.shape, b.shape)
       (1308, 22, 10, 10) (109, 22, 10, 10)
 
   '''
-  if len(data.shape) != 4:
-    raise RuntimeError('data input parameter must have 4 dimensions.')
+  if len(data.shape) not in (3, 4, 5):
+    raise RuntimeError('data input parameter must have 3, 4, or 5 dimensions.')
   if data.shape[0] % 12 > 0:
     raise RuntimeError('data input parameter first dimension (time) must be evenly divisible by 12')
   if not isinstance(data, np.ma.core.MaskedArray):
     raise RuntimeError('data input parameter must be a numpy masked array!')
 
-  original_dims = list(data.shape)
-  new_time = original_dims[0] / 12
-  new_dims = original_dims
-  new_dims[0] = new_time
-
-  output = np.ones(new_dims) * np.nan
-  for i in range(0, new_time):
-    yr_start = i * 12
-    yr_end = i*12 + 12
-
-    output[i] = data[yr_start:yr_end].mean(axis=0)
-
-  return output
+  return monthly_to_yearly(data, how='mean')
 
 
 def stitch_stages(var, timestep, stages, fileprefix=''):
@@ -174,29 +320,525 @@ def stitch_stages(var, timestep, stages, fileprefix=''):
     - The file's variable name is the same as the variable name in the filename.
     - There is a units attribute?
 
-  Returns a tuple (`data`, `units`), where `data` is a multi-dimensional numpy 
-  array that is the concatenation of the input arrays along the time axis and 
+  Returns a tuple (`data`, `units`), where `data` is a multi-dimensional numpy
+  array that is the concatenation of the input arrays along the time axis and
   `units` is the unit string that is found in the input netcdf files.
+
+  This reads everything into memory. For big runs it is usually better to use
+  `RunOutputs(fileprefix).get(var, timestep, stages)` and only index the part
+  of the data that is actually needed.
   '''
+  sv = RunOutputs(fileprefix).get(var, timestep, stages)
+  for p in sv.paths:
+    print("Trying to open: ", p)
 
-  expected_file_names = ["{}_{}_{}.nc".format(var, timestep, stg) for stg in stages]
-  expected_file_names = [os.path.join(fileprefix, i) for i in expected_file_names]
+  return (sv.read(), sv.units)
+
+
+STAGES = ['pr', 'eq', 'sp', 'tr', 'sc']
+
+
+class StagedVariable(object):
+  '''
+  A lazy, time-sliceable view of one dvmdostem output variable that may be
+  spread across several run stage files (e.g. "VEGC_yearly_eq.nc",
+  "VEGC_yearly_sp.nc", ...). The files are treated as if they were stitched
+  together along the time axis, but nothing is read until the view is indexed
+  and then only the requested hyperslab is read from the file(s) that overlap
+  the request. The result is assembled in a single preallocated array, so
+  there is no repeated concatenation.
+
+  Instances are normally created with `RunOutputs.get(...)`.
+
+  The first item of an index applies to the (stitched) time axis and may be
+  an integer, a slice, or a sequence of integers. Any remaining items are
+  passed through to the netCDF variable in each file, so the usual
+  `netCDF4.Variable` indexing rules apply, including `Ellipsis`.
+
+  Example:
+
+    >>> ro = RunOutputs('/path/to/output')
+    >>> vegc = ro.get('VEGC', 'yearly', ['eq','sp','tr'])
+    >>> vegc.shape
+    (1215, 10, 10, 10)
+    >>> vegc[-10:, ..., 0, 0].shape  # last 10 years, pixel (0,0), all pfts
+    (10, 10)
+  '''
 
-  full_ds = np.array([])
-  units_str = ''
-  for i, exp_file in enumerate(expected_file_names):
-    print("Trying to open: ", exp_file)
-    with nc.Dataset(exp_file, 'r') as f:
-      #print f.variables[var].units
-      if i == 0:
-        full_ds = f.variables[var][:]
-        units_str = f.variables[var].units
+  def __init__(self, var, timeres, stages, paths, sizes, units, dimensions, shape):
+    self.var = var
+    self.timeres = timeres
+    self.stages = list(stages)
+    self.paths = list(paths)
+    self.sizes = [int(i) for i in sizes]
+    self.units = units
+    self.dimensions = dimensions
+    self.shape = tuple([sum(self.sizes)] + list(shape[1:]))
+
+    # Starting offset along the stitched time axis for each stage file.
+    self.offsets = [int(i) for i in np.cumsum([0] + self.sizes[:-1])]
+
+  def __len__(self):
+    return self.shape[0]
+
+  def __repr__(self):
+    return "<StagedVariable {} {} stages={} shape={} units='{}'>".format(
+        self.var, self.timeres, self.stages, self.shape, self.units)
+
+  @property
+  def ndim(self):
+    return len(self.shape)
+
+  def stage_slice(self, stage):
+    '''Returns the slice of the stitched time axis that is covered by `stage`.'''
+    i = self.stages.index(stage)
+    return slice(self.offsets[i], self.offsets[i] + self.sizes[i])
+
+  def _read_file(self, path, tkey, rest):
+    return read_hyperslab(path, self.var, (tkey,) + rest, ndim=self.ndim)
+
+  def plan(self, key):
+    '''
+    Works out which files (and which parts of them) need to be read for
+    `key`. Returns a dict with the list of `reads`, each a tuple
+    (path, file_key, output_positions), plus what is needed to put the pieces
+    back together with `assemble(..)`. This lets callers do the reads
+    however they like (e.g. in parallel, see `load_many(..)`).
+    '''
+    if not isinstance(key, tuple):
+      key = (key,)
+    tkey, rest = key[0], key[1:]
+
+    if tkey is Ellipsis:
+      tkey, rest = slice(None), (Ellipsis,) + rest
+
+    tidx = np.atleast_1d(np.arange(len(self))[tkey])
+
+    # Figure out the (sorted, unique) time indices needed from each file;
+    # each file is read once and the pieces are scattered into the output.
+    uidx, inverse = np.unique(tidx, return_inverse=True)
+
+    reads = []
+    for path, off, n in zip(self.paths, self.offsets, self.sizes):
+      sel = (uidx >= off) & (uidx < off + n)
+      if not np.any(sel):
+        continue
+      local = uidx[sel] - off
+      steps = np.diff(local)
+      if len(local) == 1 or np.all(steps == steps[0]):
+        step = 1 if len(local) == 1 else int(steps[0])
+        lkey = slice(int(local[0]), int(local[-1]) + 1, step)
       else:
-        full_ds = np.concatenate( (full_ds, f.variables[var][:]), axis=0 )
-        if f.variables[var].units != units_str:
-          raise RuntimeError("Something is wrong with your input files! Units don't match!")
+        lkey = local
+      reads.append((path, (lkey,) + rest, np.nonzero(sel)[0]))
+
+    if len(reads) == 0:
+      # Empty selection along time; still let netCDF work out the shape.
+      reads.append((self.paths[0], (slice(0, 0),) + rest, np.array([], dtype=int)))
+
+    return dict(
+        reads=reads,
+        ntime=len(uidx),
+        reorder=None if np.array_equal(uidx, tidx) else inverse.reshape(-1),
+        scalar_time=isinstance(tkey, (int, np.integer)),
+    )
+
+  def assemble(self, plan, pieces):
+    '''
+    Puts the `pieces` (one for each item in `plan['reads']`, in the same
+    order) read for a `plan(..)` together into a single masked array.
+    '''
+    if plan['ntime'] == 0:
+      return pieces[0]
+
+    first = pieces[0]
+    out = np.ma.masked_all((plan['ntime'],) + first.shape[1:], dtype=first.dtype)
+    for (path, fkey, positions), piece in zip(plan['reads'], pieces):
+      out[positions] = piece
+
+    if plan['reorder'] is not None:
+      out = out[plan['reorder']]
+
+    if plan['scalar_time']:
+      out = out[0]
+
+    return out
+
+  def __getitem__(self, key):
+    p = self.plan(key)
+    pieces = [self._read_file(path, fkey[0], fkey[1:]) for path, fkey, positions in p['reads']]
+    return self.assemble(p, pieces)
+
+  def read(self):
+    '''Reads and returns the entire (stitched) variable.'''
+    return self[:]
+
+
+class RunOutputs(object):
+  '''
+  An index of the dvmdostem output files in a directory.
+
+  The directory is listed once, when the object is created (or when
+  `refresh()` is called). File headers (time axis length, units, dimensions)
+  are read the first time a file is needed and then remembered. Data is only
+  read when a `StagedVariable` returned by `get(...)` is indexed.
+
+  Outputs from dvmdostem are assumed to have one variable per file and the
+  file-naming pattern:
+
+      `var`_`timeres`_`stage`.nc
+  '''
+
+  def __init__(self, outdir=''):
+    self.outdir = outdir
+    self.refresh()
+
+  def refresh(self):
+    '''(Re)lists the output directory and forgets any cached header info.'''
+    self.files = {}
+    self._headers = {}
+    for fname in os.listdir(self.outdir if self.outdir else '.'):
+      if not fname.endswith('.nc'):
+        continue
+      parts = fname[:-3].split('_')
+      if len(parts) != 3 or parts[2] not in STAGES:
+        continue
+      self.files[tuple(parts)] = os.path.join(self.outdir, fname)
+
+  def variables(self, timeres=None):
+    '''Returns a sorted list of variable names found in the directory.'''
+    return sorted(set([v for v, tr, s in self.files if timeres in (None, tr)]))
+
+  def stages(self, var, timeres):
+    '''Returns the stages (in run order) that have a file for `var` and `timeres`.'''
+    return [s for s in STAGES if (var, timeres, s) in self.files]
+
+  def path(self, var, timeres, stage):
+    '''Returns the path to the file for `var`, `timeres` and `stage`.'''
+    try:
+      return self.files[(var, timeres, stage)]
+    except KeyError:
+      raise RuntimeError("Can't find file: {}".format(
+          os.path.join(self.outdir, "{}_{}_{}.nc".format(var, timeres, stage))))
+
+  def header(self, var, timeres, stage):
+    '''
+    Returns a dict with the `shape`, `units` and `dimensions` of `var` in the
+    file for `timeres` and `stage`. Cached after the first call.
+    '''
+    key = (var, timeres, stage)
+    if key not in self._headers:
+      with nc.Dataset(self.path(var, timeres, stage), 'r') as ds:
+        v = ds.variables[var]
+        self._headers[key] = dict(
+            shape=v.shape,
+            units=getattr(v, 'units', ''),
+            dimensions=v.dimensions,
+        )
+    return self._headers[key]
+
+  def get(self, var, timeres, stages=None):
+    '''
+    Returns a `StagedVariable` for `var` and `timeres` that spans `stages`, a
+    list containing one or more of "pr","eq","sp","tr","sc" in the order they
+    should be stitched together. If `stages` is None, then all the stages
+    present in the directory are used.
+
+    Raises RuntimeError if a file is missing or if the units or non-time
+    dimensions don't match between stages.
+    '''
+    if stages is None:
+      stages = self.stages(var, timeres)
+    if len(stages) < 1:
+      raise RuntimeError("No files for {} {} in {}".format(var, timeres, self.outdir))
+
+    paths = [self.path(var, timeres, s) for s in stages]
+    headers = [self.header(var, timeres, s) for s in stages]
+
+    first = headers[0]
+    for s, h in zip(stages, headers):
+      if h['units'] != first['units']:
+        raise RuntimeError("Something is wrong with your input files! Units don't match!")
+      if h['shape'][1:] != first['shape'][1:]:
+        raise RuntimeError("Something is wrong with your input files! Shapes don't match for stage {}!".format(s))
+
+    return StagedVariable(var, timeres, stages, paths,
+        [h['shape'][0] for h in headers], first['units'], first['dimensions'], first['shape'])
+
+
+def _timed_read(task):
+  '''Worker for load_many(..). Must be module level so it can be pickled.'''
+  path, var, key, ndim = task
+  t0 = time.time()
+  data = read_hyperslab(path, var, key, ndim=ndim)
+  return data, time.time() - t0
+
+
+def _selected_dims(dimensions, key):
+  '''Returns the dimension names that remain after indexing with `key`.'''
+  if not isinstance(key, tuple):
+    key = (key,)
+  if Ellipsis in key:
+    i = key.index(Ellipsis)
+    n = len(dimensions) - (len(key) - 1)
+    key = key[:i] + (slice(None),) * n + key[i+1:]
+  key = key + (slice(None),) * (len(dimensions) - len(key))
+  return tuple(d for d, k in zip(dimensions, key) if not isinstance(k, (int, np.integer)))
+
+
+def load_many(outdir, variables, timeres, stages=None, selection=None, workers=4,
+    as_xarray=False, verbose=True):
+  '''
+  Loads many output variables at once, reading the files in parallel.
+
+  The output directory is listed once. Each variable is stitched across
+  `stages` (see `RunOutputs.get(..)`) and indexed with `selection`, and the
+  individual file reads are spread across a pool of `workers`.
+
+  `variables`: (list) variable names, e.g. ['GPP', 'VEGC', 'SOC'].
+
+  `timeres`: (str) one of 'yearly', 'monthly', 'daily'.
+
+  `stages`: (list) stages to stitch together; by default all stages found for
+  each variable.
+
+  `selection`: (tuple) optional index applied to every variable, time first,
+  e.g. `(slice(-120, None), Ellipsis, 0, 0)` for the last 120 timesteps of
+  pixel (0,0). Default is everything.
+
+  `workers`: (int) size of the worker process pool. Use 1 to read serially.
+  A process pool is used (and not threads) because the HDF5 library under
+  netCDF4 is generally not built to be thread safe.
+
+  `as_xarray`: (bool) return an xarray.Dataset (requires xarray) instead of
+  a dict.
+
+  Returns a tuple (`data`, `info`). `data` is an OrderedDict mapping variable
+  name to a (masked) numpy array, or an xarray.Dataset with the units stored
+  as variable attributes. `info` maps each variable name to a dict with the
+  `units`, `dimensions` (after selection), `stages`, and `reads`, a list of
+  (file path, seconds) tuples with the time taken to read each file.
+  '''
+  if selection is None:
+    selection = slice(None)
+
+  outputs = RunOutputs(outdir)
+
+  views = collections.OrderedDict()
+  plans = collections.OrderedDict()
+  tasks = []
+  for v in variables:
+    views[v] = outputs.get(v, timeres, stages)
+    plans[v] = views[v].plan(selection)
+    for path, fkey, positions in plans[v]['reads']:
+      tasks.append((path, v, fkey, views[v].ndim))
+
+  start = time.time()
+  if workers is None or workers > 1:
+    pool = multiprocessing.Pool(workers)
+    try:
+      results = pool.map(_timed_read, tasks)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    results = [_timed_read(t) for t in tasks]
+  elapsed = time.time() - start
+
+  data = collections.OrderedDict()
+  info = collections.OrderedDict()
+  i = 0
+  for v, sv in views.items():
+    n = len(plans[v]['reads'])
+    pieces = [r[0] for r in results[i:i+n]]
+    data[v] = sv.assemble(plans[v], pieces)
+    info[v] = dict(
+        units=sv.units,
+        dimensions=_selected_dims(sv.dimensions, selection),
+        stages=sv.stages,
+        reads=[(t[0], r[1]) for t, r in zip(tasks[i:i+n], results[i:i+n])],
+    )
+    i += n
+
+  if verbose:
+    for v in info:
+      for path, secs in info[v]['reads']:
+        print("{:>8.3f}s {}".format(secs, path))
+    print("Read {} files for {} variables in {:.3f}s".format(len(tasks), len(variables), elapsed))
+
+  if as_xarray:
+    import xarray as xr
+    ds = xr.Dataset()
+    for v in data:
+      ds[v] = xr.DataArray(np.ma.filled(data[v].astype(np.float64), np.nan),
+          dims=info[v]['dimensions'], attrs=dict(units=info[v]['units']))
+    return ds, info
+
+  return data, info
+
+
+#
+# Pixel-major (transposed) cache.
+#
+# dvmdostem writes outputs time-major, (time, ..., y, x), so reading a long
+# time series for a single pixel means a strided read through the whole file.
+# The transpose cache stores a copy of selected output files as memory-mapped
+# .npy arrays laid out (y, x, time, ...), so the full time series for one
+# pixel is a single contiguous read. Cache files live in a hidden directory
+# next to the outputs, along with a small json file recording the source
+# file's size and modification time; a cache that does not match its source
+# file is ignored.
+#
+TRANSPOSE_CACHE_DIR = '.pixel-major'
+
+
+def transpose_cache_paths(ncfile):
+  '''Returns a tuple of the (.npy, .json) cache file paths for `ncfile`.'''
+  d, f = os.path.split(ncfile)
+  base = os.path.join(d, TRANSPOSE_CACHE_DIR, os.path.splitext(f)[0])
+  return base + '.npy', base + '.json'
+
 
-  return (full_ds, units_str)
+def _source_signature(ncfile):
+  st = os.stat(ncfile)
+  return dict(source_size=st.st_size, source_mtime=st.st_mtime)
+
+
+def load_transpose_cache(ncfile):
+  '''
+  Returns a tuple (`array`, `meta`) with the memory-mapped pixel-major array
+  and the metadata dict for `ncfile`, or None if there is no cache or the
+  cache is out of date.
+  '''
+  npy, meta_path = transpose_cache_paths(ncfile)
+  if not (os.path.exists(npy) and os.path.exists(meta_path)):
+    return None
+  with open(meta_path) as f:
+    meta = json.load(f)
+  sig = _source_signature(ncfile)
+  if meta['source_size'] != sig['source_size'] or meta['source_mtime'] != sig['source_mtime']:
+    return None
+  return np.load(npy, mmap_mode='r'), meta
+
+
+def build_transpose_cache(outdir, variables=None, timeres=None, stages=None, chunk_size=120, force=False):
+  '''
+  Builds (or refreshes) the pixel-major cache for output files in `outdir`.
+
+  `variables`, `timeres` and `stages` restrict which files are cached; by
+  default every output file in `outdir` is cached. Files with an up to date
+  cache are skipped unless `force` is True.
+
+  The source file is read `chunk_size` timesteps at a time and written into
+  a memory-mapped .npy file, so memory use stays bounded.
+
+  Returns a list of the .npy files that were written.
+  '''
+  outputs = RunOutputs(outdir)
+  written = []
+  for (var, tr, stage), ncfile in sorted(outputs.files.items()):
+    if variables is not None and var not in variables:
+      continue
+    if timeres is not None and tr != timeres:
+      continue
+    if stages is not None and stage not in stages:
+      continue
+    if not force and load_transpose_cache(ncfile) is not None:
+      continue
+
+    npy, meta_path = transpose_cache_paths(ncfile)
+    if not os.path.isdir(os.path.dirname(npy)):
+      os.makedirs(os.path.dirname(npy))
+
+    print("Building pixel-major cache for {}".format(ncfile))
+    with nc.Dataset(ncfile, 'r') as ds:
+      v = ds.variables[var]
+      if v.dimensions[0] != 'time' or v.dimensions[-2:] != ('y', 'x'):
+        print("Skipping {}, dimensions are not (time, ..., y, x)".format(ncfile))
+        continue
+      fill = getattr(v, '_FillValue', nc.default_fillvals.get(v.dtype.str[1:]))
+      ntime = v.shape[0]
+      # (time, ..., y, x) -> (y, x, time, ...)
+      order = (v.ndim - 2, v.ndim - 1) + tuple(range(0, v.ndim - 2))
+      shape = tuple(v.shape[i] for i in order)
+
+      tmp = npy + '.tmp.npy'
+      mm = np.lib.format.open_memmap(tmp, mode='w+', dtype=v.dtype, shape=shape)
+      for t0 in range(0, ntime, chunk_size):
+        t1 = min(t0 + chunk_size, ntime)
+        block = np.ma.filled(v[t0:t1], fill)
+        mm[:, :, t0:t1] = block.transpose(order)
+      mm.flush()
+      del mm
+
+      meta = dict(
+          var=var,
+          dimensions=list(v.dimensions),
+          shape=list(v.shape),
+          units=getattr(v, 'units', ''),
+          fill_value=None if fill is None else fill.item() if hasattr(fill, 'item') else fill,
+      )
+
+    os.rename(tmp, npy)
+    meta.update(_source_signature(ncfile))
+    with open(meta_path, 'w') as f:
+      json.dump(meta, f)
+    written.append(npy)
+
+  return written
+
+
+def _pixel_key(rest, ndim):
+  '''
+  If `rest` (an index without the time item) selects a single (y, x) pixel
+  and everything in between, returns (y, x), otherwise None.
+  '''
+  if len(rest) < 2 or not all(isinstance(i, (int, np.integer)) for i in rest[-2:]):
+    return None
+  middle = rest[:-2]
+  if len(middle) == 1 and middle[0] is Ellipsis:
+    return rest[-2], rest[-1]
+  if ndim is not None and len(middle) == ndim - 3 and all(isinstance(i, slice) and i == slice(None) for i in middle):
+    return rest[-2], rest[-1]
+  return None
+
+
+def read_pixel_series(ncfile, var, y, x, time=slice(None)):
+  '''
+  Reads the time series for the pixel (`y`, `x`) from `ncfile`, using the
+  pixel-major cache if there is an up to date one, otherwise reading from the
+  netCDF file directly.
+
+  `time` may be an int, slice or sequence of ints.
+
+  Returns a masked array with the shape (time, ...), i.e. the same as
+  `netCDF4.Dataset(ncfile).variables[var][time, ..., y, x]`.
+  '''
+  cached = load_transpose_cache(ncfile)
+  if cached is None:
+    with nc.Dataset(ncfile, 'r') as ds:
+      return ds.variables[var][time, ..., y, x]
+
+  mm, meta = cached
+  data = np.array(mm[y, x][time])
+  if meta['fill_value'] is None:
+    return np.ma.masked_array(data)
+  return np.ma.masked_equal(data, meta['fill_value'], copy=False)
+
+
+def read_hyperslab(ncfile, var, key, ndim=None):
+  '''
+  Reads `var` from `ncfile` for index `key` (a tuple, time first). Single
+  pixel reads, e.g. `(time, ..., y, x)`, are served from the pixel-major
+  cache if there is an up to date one (see `build_transpose_cache(..)`).
+  `ndim` is the number of dimensions of `var`; if it is not given then only
+  keys with an Ellipsis before the pixel are recognized as pixel reads.
+  '''
+  pixel = _pixel_key(key[1:], ndim)
+  if pixel is not None:
+    return read_pixel_series(ncfile, var, pixel[0], pixel[1], key[0])
+  with nc.Dataset(ncfile, 'r') as ds:
+    return ds.variables[var][key]
 
 
 def check_files(fnames):
@@ -241,6 +883,179 @@ def check_files(fnames):
     print("Warning! No dimensions, can't check for time as first dimension!")
 
 
+class PixelIndex(object):
+  '''
+  A compact index of the active pixels in a domain, built from a dvmdostem
+  vegetation map (variable 'veg_class') and/or a run_status.nc file (variable
+  'run_status'), both with dimensions (y, x).
+
+  The pixels are stored as flat indices (y * X + x) grouped by CMT number and
+  by run status value, so selecting e.g. "all CMT 4 pixels that ran
+  successfully" is a set operation on small integer arrays. Data can then be
+  gathered into a compact (time, ..., npix) array instead of building a full
+  masked array, which saves the memory for all the inactive pixels.
+
+  Use `PixelIndex.load(..)` to get an instance; it keeps a cache keyed by the
+  file paths and modification times, so each map is only read once, and is
+  re-read if the file changes.
+
+  Masked (fill value) pixels in either map are never considered active.
+
+  Example:
+
+    >>> pidx = PixelIndex.load('vegetation.nc', 'run_status.nc')
+    >>> flat = pidx.select(cmtnum=4)
+    >>> vegc = RunOutputs('output/').get('VEGC', 'yearly', ['tr'])
+    >>> compact = pidx.read(vegc, flat)     # (time, pft, npix)
+    >>> full = pidx.scatter(compact, flat)  # (time, pft, y, x), masked
+  '''
+
+  _cache = {}
+
+  @classmethod
+  def load(cls, ref_veg_map=None, ref_run_status=None):
+    '''
+    Returns a (possibly cached) PixelIndex for the vegetation map and/or run
+    status files. At least one must be specified.
+    '''
+    if ref_veg_map is None and ref_run_status is None:
+      raise RuntimeError("Must specify a vegetation map and/or a run status file!")
+
+    key = []
+    for path in (ref_veg_map, ref_run_status):
+      if path is None:
+        key.append(None)
+      else:
+        key.append((os.path.abspath(path), os.path.getmtime(path)))
+    key = tuple(key)
+
+    if key not in cls._cache:
+      # Forget any stale entries for the same files.
+      for k in [k for k in cls._cache if [i and i[0] for i in k] == [i and i[0] for i in key]]:
+        del cls._cache[k]
+      cls._cache[key] = cls(ref_veg_map, ref_run_status)
+
+    return cls._cache[key]
+
+  @staticmethod
+  def _read_map(path, varname):
+    with nc.Dataset(path, 'r') as ds:
+      return ds.variables[varname][:]
+
+  @staticmethod
+  def _group(values, valid):
+    '''Returns a dict mapping each valid value to the sorted flat indices that have it.'''
+    flat = np.nonzero(valid.ravel())[0]
+    vals = np.asarray(values).ravel()[flat]
+    order = np.argsort(vals, kind='stable')
+    uvals, starts = np.unique(vals[order], return_index=True)
+    groups = np.split(flat[order], starts[1:])
+    return {int(v): g for v, g in zip(uvals, groups)}
+
+  def __init__(self, ref_veg_map=None, ref_run_status=None, shape=None):
+    '''
+    Reads the maps and builds the index. Normally use `PixelIndex.load(..)`
+    instead. With neither file, makes an index where every pixel of a
+    domain with (y, x) `shape` is active.
+    '''
+    self.ref_veg_map = ref_veg_map
+    self.ref_run_status = ref_run_status
+    self.shape = shape
+    self.veg_class = None
+    self.run_status = None
+    self.by_cmt = {}
+    self.by_status = {}
+
+    if ref_veg_map is not None:
+      self.veg_class = self._read_map(ref_veg_map, 'veg_class')
+      self.shape = self.veg_class.shape
+      self.by_cmt = self._group(self.veg_class, ~np.ma.getmaskarray(self.veg_class))
+
+    if ref_run_status is not None:
+      self.run_status = self._read_map(ref_run_status, 'run_status')
+      if self.veg_class is not None and self.run_status.shape != self.shape:
+        raise RuntimeError("Vegetation map and run status file have different shapes!")
+      self.shape = self.run_status.shape
+      self.by_status = self._group(self.run_status, ~np.ma.getmaskarray(self.run_status))
+
+  @property
+  def size(self):
+    return int(np.prod(self.shape))
+
+  def cmts(self):
+    '''Returns a sorted list of the CMT numbers in the vegetation map.'''
+    return sorted(self.by_cmt.keys())
+
+  def select(self, cmtnum=None, exclude_failed=True):
+    '''
+    Returns a sorted array of flat pixel indices for pixels with `cmtnum` (or
+    all pixels with a veg_class if `cmtnum` is None). If `exclude_failed` is
+    True and there is a run status file, then pixels with run_status < 0
+    (and pixels without a run status) are left out.
+    '''
+    if cmtnum is not None:
+      if self.veg_class is None:
+        raise RuntimeError("Can't select by CMT without a vegetation map!")
+      flat = self.by_cmt.get(int(cmtnum), np.array([], dtype=np.intp))
+    elif self.veg_class is not None:
+      flat = np.sort(np.concatenate([np.array([], dtype=np.intp)] + list(self.by_cmt.values())))
+    else:
+      flat = np.arange(self.size)
+
+    if exclude_failed and self.run_status is not None:
+      ok = [g for s, g in self.by_status.items() if s >= 0]
+      ok = np.concatenate([np.array([], dtype=np.intp)] + ok)
+      flat = np.intersect1d(flat, ok, assume_unique=True)
+
+    return flat
+
+  def active_mask(self, cmtnum=None, exclude_failed=True):
+    '''Returns a 2D (y, x) boolean array, True for the pixels from `select(..)`.'''
+    m = np.zeros(self.size, dtype=bool)
+    m[self.select(cmtnum, exclude_failed)] = True
+    return m.reshape(self.shape)
+
+  def coords(self, flat):
+    '''Converts flat pixel indices to a tuple of (y, x) coordinate arrays.'''
+    return np.unravel_index(flat, self.shape)
+
+  def gather(self, data, flat):
+    '''
+    Gathers the pixels `flat` from an in-memory array `data` whose last two
+    dimensions are (y, x). Returns an array with shape
+    `data.shape[:-2] + (len(flat),)`.
+    '''
+    if tuple(data.shape[-2:]) != tuple(self.shape):
+      raise RuntimeError("Data spatial dimensions {} don't match the pixel index {}".format(data.shape[-2:], self.shape))
+    return data.reshape(data.shape[:-2] + (-1,))[..., flat]
+
+  def read(self, sv, flat, time=slice(None)):
+    '''
+    Reads only the pixels `flat` (and timesteps `time`) from `sv`, a
+    `StagedVariable` (or anything indexable like a netCDF variable). Only the
+    bounding box around the selected pixels is read from disk.
+
+    Returns an array with shape `(ntime, ...) + (len(flat),)`.
+    '''
+    if len(flat) == 0:
+      return np.ma.masked_all(sv[time, ..., 0:0, 0:0].shape[:-2] + (0,))
+    ys, xs = self.coords(flat)
+    y0, y1, x0, x1 = ys.min(), ys.max() + 1, xs.min(), xs.max() + 1
+    block = sv[time, ..., y0:y1, x0:x1]
+    local = (ys - y0) * (x1 - x0) + (xs - x0)
+    return block.reshape(block.shape[:-2] + (-1,))[..., local]
+
+  def scatter(self, compact, flat):
+    '''
+    Inverse of `gather(..)`: returns a masked array with shape
+    `compact.shape[:-1] + (y, x)` with the values from `compact` at pixels
+    `flat` and everything else masked.
+    '''
+    full = np.ma.masked_all(compact.shape[:-1] + (self.size,), dtype=compact.dtype)
+    full[..., flat] = compact
+    return full.reshape(compact.shape[:-1] + tuple(self.shape))
+
+
 def mask_by_cmt(data, cmtnum, vegmap_filepath):
   '''
   Expects `data` to be at least a 2D array with the last two dimensions being
@@ -268,12 +1083,15 @@ def mask_by_cmt(data, cmtnum, vegmap_filepath):
     In [143]: np.broadcast_to(np.random.randint(0,2,(5,5)), ba.shape).shape
     Out[143]: (2, 3, 4, 5, 5)
 
+  The vegetation map is only read once (see `PixelIndex`). If you only need
+  the data for the unmasked pixels, `PixelIndex.gather(..)` uses much less
+  memory.
   '''
-  vegmap = nc.Dataset(vegmap_filepath, 'r')
+  pidx = PixelIndex.load(ref_veg_map=vegmap_filepath)
 
-  vegmask = np.ma.masked_not_equal(vegmap.variables['veg_class'][:], cmtnum)
+  vegmask = ~pidx.active_mask(cmtnum, exclude_failed=False)
 
-  vmnd_mask = np.broadcast_to(vegmask.mask, data.shape)
+  vmnd_mask = np.broadcast_to(vegmask, data.shape)
 
   # Full data, masked by veg type
   vmnd_all = np.ma.masked_array(data, vmnd_mask)
@@ -296,16 +1114,189 @@ def mask_by_failed_run_status(data, run_status_filepath="run_status.nc"):
 
   Example: see mask_by_cmt(...)
   '''
-  runstat = nc.Dataset(run_status_filepath)
+  pidx = PixelIndex.load(ref_run_status=run_status_filepath)
 
-  runstatmask = np.ma.masked_less(runstat.variables['run_status'][:], 0)
+  runstatmask = ~pidx.active_mask()
 
-  rsnd_mask = np.broadcast_to(runstatmask.mask, data.shape)
+  rsnd_mask = np.broadcast_to(runstatmask, data.shape)
 
   rsnd_all = np.ma.masked_array(data, rsnd_mask)
 
   return rsnd_all
 
+#
+# Tidy (long) format export.
+#
+# Each value in the output files becomes one row with the columns below.
+# Dimensions that a variable does not have (e.g. 'layer' for VEGC) are set to
+# -1. 'year' is the year index within the stage (time // 12 for monthly
+# outputs) and 'cmt' is the pixel's veg_class (-1 if no vegetation map was
+# given). The data is written as a hive partitioned Parquet dataset:
+#
+#   DEST/var=VEGC/stage=tr/part-0.parquet
+#
+# with one row group per time chunk, so readers can skip whole files by
+# variable and stage, and whole row groups by time/year.
+#
+TIDY_COLUMNS = ['time', 'year', 'y', 'x', 'cmt', 'pft', 'pftpart', 'layer', 'value']
+
+
+def _tidy_block(block, tnames, t0, ys, xs, cmts, steps_per_year):
+  '''
+  Flattens `block`, a compact (time, ..., npix) array from PixelIndex.read(..)
+  with the non-spatial dimension names `tnames`, into a dict of 1D columns.
+  Masked values are dropped.
+  '''
+  valid = ~np.ma.getmaskarray(block)
+  idx = np.nonzero(valid)
+
+  cols = collections.OrderedDict()
+  cols['time'] = (idx[0] + t0).astype(np.int32)
+  cols['year'] = (cols['time'] // steps_per_year).astype(np.int32)
+  pix = idx[-1]
+  cols['y'] = ys[pix].astype(np.int32)
+  cols['x'] = xs[pix].astype(np.int32)
+  cols['cmt'] = cmts[pix].astype(np.int32)
+  for d in ['pft', 'pftpart', 'layer']:
+    if d in tnames:
+      cols[d] = idx[tnames.index(d)].astype(np.int32)
+    else:
+      cols[d] = np.full(len(pix), -1, dtype=np.int32)
+  cols['value'] = np.ma.getdata(block)[valid].astype(np.float64)
+  return cols
+
+
+def export_parquet(outdir, dest, variables=None, timeres='yearly', stages=None,
+    ref_run_status=None, ref_veg_map=None, chunk_size=120):
+  '''
+  Exports dvmdostem output files to a tidy, partitioned Parquet dataset at
+  `dest` (a directory). Requires the pyarrow package.
+
+  `variables` and `stages` restrict what is exported; by default everything
+  found in `outdir` for `timeres`.
+
+  `ref_run_status`: (str) path to a run_status.nc file; pixels with
+  run_status < 0 are skipped. Defaults to `outdir`/run_status.nc if it exists.
+
+  `ref_veg_map`: (str) optional path to a vegetation map, used to fill the
+  'cmt' column so queries can filter by community type.
+
+  Files are read `chunk_size` timesteps at a time and each chunk is written
+  as a row group, so memory use stays bounded.
+
+  Returns a list of the Parquet files written.
+
+  See `query_parquet(..)` for reading the data back.
+  '''
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+
+  if ref_run_status is None and os.path.exists(os.path.join(outdir, 'run_status.nc')):
+    ref_run_status = os.path.join(outdir, 'run_status.nc')
+
+  outputs = RunOutputs(outdir)
+  if variables is None:
+    variables = outputs.variables(timeres)
+
+  pidx = None
+  if ref_run_status is not None or ref_veg_map is not None:
+    pidx = PixelIndex.load(ref_veg_map, ref_run_status)
+    flat = pidx.select()
+
+  steps_per_year = {'yearly': 1, 'monthly': 12, 'daily': 365}[timeres]
+
+  written = []
+  for var in variables:
+    for stage in (stages if stages is not None else outputs.stages(var, timeres)):
+      sv = outputs.get(var, timeres, [stage])
+      if sv.dimensions[0] != 'time' or sv.dimensions[-2:] != ('y', 'x'):
+        print("Skipping {} {} {}, dimensions are not (time, ..., y, x)".format(var, timeres, stage))
+        continue
+
+      if pidx is None:
+        p = PixelIndex(shape=sv.shape[-2:])
+        flat = p.select()
+      else:
+        p = pidx
+      ys, xs = p.coords(flat)
+      if p.veg_class is not None:
+        cmts = np.ma.filled(p.veg_class, -1).ravel()[flat]
+      else:
+        cmts = np.full(len(flat), -1)
+
+      partdir = os.path.join(dest, 'var={}'.format(var), 'stage={}'.format(stage))
+      if not os.path.isdir(partdir):
+        os.makedirs(partdir)
+      fname = os.path.join(partdir, 'part-0.parquet')
+
+      print("Exporting {} to {}".format(sv.paths[0], fname))
+      writer = None
+      try:
+        for t0 in range(0, len(sv), chunk_size):
+          t1 = min(t0 + chunk_size, len(sv))
+          block = p.read(sv, flat, time=slice(t0, t1))
+          cols = _tidy_block(block, sv.dimensions[:-2], t0, ys, xs, cmts, steps_per_year)
+          table = pa.table(cols)
+          if writer is None:
+            writer = pq.ParquetWriter(fname, table.schema)
+          writer.write_table(table)
+      finally:
+        if writer is not None:
+          writer.close()
+      written.append(fname)
+
+  return written
+
+
+def query_parquet(dest, variables=None, stages=None, cmtnum=None, pixels=None,
+    years=None, columns=None):
+  '''
+  Reads back (part of) a dataset written by `export_parquet(..)` into a
+  pandas DataFrame. Requires the pyarrow package.
+
+  The filters are pushed down into the reads: `variables` and `stages` prune
+  whole partitions (directories), and `years` is checked against the Parquet
+  row group statistics (each row group is one chunk of time) so row groups
+  that can't match are never read. Row groups span the whole domain, so
+  `cmtnum` and `pixels` don't skip any reads, they only filter the rows.
+
+  `cmtnum`: (int) only rows for this community type.
+
+  `pixels`: (list) of (y, x) tuples.
+
+  `years`: (tuple) (start, end) year indices, end exclusive.
+
+  `columns`: (list) optional subset of columns to return.
+
+  Returns a pandas DataFrame.
+  '''
+  import pyarrow.dataset as pads
+
+  dataset = pads.dataset(dest, format='parquet', partitioning='hive')
+
+  filters = []
+  if variables is not None:
+    filters.append(pads.field('var').isin(list(variables)))
+  if stages is not None:
+    filters.append(pads.field('stage').isin(list(stages)))
+  if cmtnum is not None:
+    filters.append(pads.field('cmt') == int(cmtnum))
+  if years is not None:
+    filters.append((pads.field('year') >= int(years[0])) & (pads.field('year') < int(years[1])))
+  if pixels is not None:
+    pexpr = None
+    for y, x in pixels:
+      e = (pads.field('y') == int(y)) & (pads.field('x') == int(x))
+      pexpr = e if pexpr is None else (pexpr | e)
+    filters.append(pexpr)
+
+  expr = None
+  for f in filters:
+    expr = f if expr is None else (expr & f)
+
+  return dataset.to_table(filter=expr, columns=columns).to_pandas()
+
+
 def plot_comp_sst():
 
   ROWS=4; COLS=4 
@@ -357,7 +1348,7 @@ def plot_basic_timeseries(vars2plot, spatial_y, spatial_x, time_resolution, stag
 
 
 
-def plot_spatial_summary_timeseries(var, timestep, cmtnum, stages, ref_veg_map, ref_run_status, ax=None):
+def plot_spatial_summary_timeseries(var, timestep, cmtnum, stages, ref_veg_map, ref_run_status, ax=None, outputs=None):
   '''
   Plots a single line with min/max shading representing the `var` averaged over
   the spatial dimension, considering only pixels for `cmtnum`. Stitches together
@@ -383,38 +1374,211 @@ def plot_spatial_summary_timeseries(var, timestep, cmtnum, stages, ref_veg_map,
   this axes instance. If ax in None, then will create (and show) a new figure
   and plot.
 
+  `outputs`: (RunOutputs instance) an index of the output directory to read
+  from. If None, the current working directory is indexed.
+
   Attempts to find the requsite files for `var`, `timestep` and `stages`.
   Plots a timeseries of variable `var` after averaging over the spatial
   dimensions. If the data found in the input files is higher dimensionality
   than (time, y, x), for example (time, pft, y, x), then the data is 
   summed across PFTs before plotting.
 
+  The data is read and reduced in chunks along the time axis (see
+  `spatial_summary(..)`), so the full dataset is never held in memory.
+
+  If there is an up to date run digest (see `make_run_digest(..)`) made with
+  the same maps, the summary is taken from it instead.
+
   Returns `None`
   '''
-  data, units = stitch_stages(var, timestep, stages)
-  print("data size:", data.size)
+  found = _digest_summary(var, timestep, stages, cmtnum, ref_veg_map, ref_run_status,
+      outdir=outputs.outdir if outputs is not None else '')
+  if found is not None:
+    summary, units = found
+  else:
+    summary, units = spatial_summary(var, timestep, stages, cmtnum=cmtnum,
+        ref_veg_map=ref_veg_map, ref_run_status=ref_run_status, outputs=outputs)
 
-  data = mask_by_cmt(data, cmtnum, ref_veg_map)
-  print("data count after masking cmt:", data.count())
+  plot_spatial_summary_table(summary, cmtnum, units, var, stages, ax=ax)
 
-  data = mask_by_failed_run_status(data, ref_run_status)
-  print("data count after masking run status:", data.count())
 
-  if len(data.shape) == 5: # assume (time, pftpart, pft, y, x)
-    data = sum_across_compartments(data)
+def pixel_index_for(cmtnum=None, ref_veg_map=None, ref_run_status=None):
+  '''
+  Returns the cached `PixelIndex` needed to select `cmtnum` from
+  `ref_veg_map` and skip failed pixels from `ref_run_status`. The vegetation
+  map is ignored if `cmtnum` is None. Returns None if neither file is needed.
+  '''
+  if cmtnum is None:
+    ref_veg_map = None
+  if ref_veg_map is None and ref_run_status is None:
+    return None
+  return PixelIndex.load(ref_veg_map, ref_run_status)
 
-  if len(data.shape) == 4: # assume (time, pft, y, x) or (time, layer, y, x)
-    data = sum_across_pfts(data) # alternatively, use sum_across_layers(..)
 
-  if len(data.shape) == 3: # assume (time, y, x)
-    pass # all set...
+def active_pixel_mask(cmtnum=None, ref_veg_map=None, ref_run_status=None):
+  '''
+  Builds a 2D (y, x) boolean array that is True for pixels that should be
+  considered, i.e. pixels in `ref_veg_map` with veg_class equal to `cmtnum`
+  and pixels in `ref_run_status` with run_status >= 0. Either test is skipped
+  if the corresponding argument is None. See `mask_by_cmt(..)` and
+  `mask_by_failed_run_status(..)`.
 
-  workhorse_spatial_summary_plot(data, cmtnum, units, var, stages, ax=ax)
+  Returns the 2D boolean array, or None if both tests are skipped.
+  '''
+  pidx = pixel_index_for(cmtnum, ref_veg_map, ref_run_status)
+  if pidx is None:
+    return None
+  return pidx.active_mask(cmtnum if pidx.veg_class is not None else None)
+
+
+SPATIAL_SUMMARY_STATS = ['count', 'mean', 'min', 'max', 'std']
+
+
+def _spatial_summary_table(ntime, percentiles, stats=SPATIAL_SUMMARY_STATS):
+  '''Makes an empty (time,) structured array for the spatial summary stats.'''
+  names = list(stats) + ['p{:g}'.format(p) for p in percentiles]
+  table = np.zeros(ntime, dtype=[(n, np.float64) for n in names])
+  return table
+
+
+def _summarize_pixels(block, table, percentiles):
+  '''
+  Fills `table` (structured array, see `_spatial_summary_table(..)`) with the
+  stats for `block`, a 2D (time, pixel) float array with nan for missing data.
+  '''
+  # nan* functions warn about all-nan rows (timesteps with no data).
+  with warnings.catch_warnings():
+    warnings.simplefilter('ignore', category=RuntimeWarning)
+    table['count'] = np.sum(~np.isnan(block), axis=1)
+    if 'sum' in table.dtype.names:
+      table['sum'] = np.where(table['count'] > 0, np.nansum(block, axis=1), np.nan)
+    table['mean'] = np.nanmean(block, axis=1)
+    table['min'] = np.nanmin(block, axis=1)
+    table['max'] = np.nanmax(block, axis=1)
+    table['std'] = np.nanstd(block, axis=1)
+    if len(percentiles) > 0:
+      pct = np.nanpercentile(block, percentiles, axis=1)
+      for p, row in zip(percentiles, pct):
+        table['p{:g}'.format(p)] = row
+
+
+def summarize_spatial_data(data, percentiles=(5, 50, 95)):
+  '''
+  Computes per-timestep spatial statistics for `data`, an in-memory (possibly
+  masked) array with dimensions (time, y, x). Masked pixels are ignored.
+
+  Returns a structured numpy array with one row per timestep, see
+  `spatial_summary(..)` for the fields.
+  '''
+  if len(data.shape) != 3:
+    raise RuntimeError('data input parameter must have 3 dimensions')
+  block = np.ma.filled(np.ma.asarray(data, dtype=np.float64).reshape(data.shape[0], -1), np.nan)
+  table = _spatial_summary_table(data.shape[0], percentiles)
+  _summarize_pixels(block, table, percentiles)
+  return table
+
+
+def spatial_summary(var, timeres, stages, cmtnum=None, ref_veg_map=None,
+    ref_run_status=None, outputs=None, chunk_size=120, percentiles=(5, 50, 95)):
+  '''
+  Streams through the output files for `var` (stitching `stages` together)
+  and reduces the spatial dimensions for each timestep, considering only
+  pixels in `cmtnum` (if `ref_veg_map` is given) that did not fail (if
+  `ref_run_status` is given).
+
+  The time axis is processed `chunk_size` timesteps at a time, and only the
+  bounding box of the active pixels is read, so memory use is bounded by
+  roughly `chunk_size` x (size of one timestep) regardless of run length.
+
+  If the data has more than 3 dimensions, e.g. (time, pft, y, x) or
+  (time, pftpart, pft, y, x), then it is summed over all of the non-spatial,
+  non-time dimensions before the spatial stats are computed.
+
+  `outputs`: (RunOutputs instance) the output directory index to read from.
+  If None, the current working directory is indexed.
+
+  `percentiles`: (sequence of numbers) percentiles to compute, in 0-100.
+
+  Returns a tuple (`summary`, `units`). `summary` is a structured numpy array
+  with one row per timestep and the fields 'count', 'mean', 'min', 'max',
+  'std' and one field per percentile named e.g. 'p5', 'p50', 'p95'. Rows
+  with no active pixels have a count of 0 and nan for everything else.
+
+  Example:
+
+    >>> summary, units = spatial_summary('VEGC', 'yearly', ['tr','sc'], 4,
+    ...     'vegetation.nc', 'run_status.nc', outputs=RunOutputs('output/'))
+    >>> plt.plot(summary['mean'])
+  '''
+  if outputs is None:
+    outputs = RunOutputs('')
+  sv = outputs.get(var, timeres, stages)
+
+  pidx = pixel_index_for(cmtnum, ref_veg_map, ref_run_status)
+  if pidx is None:
+    flat = np.arange(sv.shape[-2] * sv.shape[-1])
+  else:
+    if tuple(pidx.shape) != tuple(sv.shape[-2:]):
+      raise RuntimeError("Mask shape {} does not match the spatial dimensions of the data {}".format(pidx.shape, sv.shape[-2:]))
+    flat = pidx.select(cmtnum if pidx.veg_class is not None else None)
+
+  table = _spatial_summary_table(len(sv), percentiles)
+  if len(flat) == 0:
+    for n in table.dtype.names[1:]:
+      table[n] = np.nan
+    return table, sv.units
+
+  for t0 in range(0, len(sv), chunk_size):
+    t1 = min(t0 + chunk_size, len(sv))
+    # Compact (time, ..., npix) block with only the active pixels.
+    if pidx is None:
+      block = sv[t0:t1]
+      block = block.reshape(block.shape[:-2] + (-1,))
+    else:
+      block = pidx.read(sv, flat, time=slice(t0, t1))
+    if block.ndim > 2:
+      block = np.ma.sum(block, axis=tuple(range(1, block.ndim - 1)))
+    block = np.ma.asarray(block, dtype=np.float64)
+    _summarize_pixels(np.ma.filled(block, np.nan), table[t0:t1], percentiles)
+
+  return table, sv.units
+
+
+def plot_spatial_summary_table(summary, cmtnum, yunits, varname, stages, ax=None):
+  '''
+  Plots a line for the spatial mean along the time axis with shading for min
+  and max, using a table from `spatial_summary(..)` or
+  `summarize_spatial_data(..)`.
+
+  `cmtnum`, `yunits`, `varname` and `stages` are used for labels and the
+  title. `ax` works the same as for `workhorse_spatial_summary_plot(..)`.
+
+  Returns `None`
+  '''
+  if ax is not None:
+    print("Plotting on existing ax instance...")
+    target = ax
+  else:
+    print("Plotting on new ax, figure...")
+    target = plt.gca()
+
+  target.plot(summary['mean'], linewidth=0.5, label="CMT {}".format(cmtnum))
+  target.fill_between(
+      np.arange(0, len(summary)),
+      summary['min'],
+      summary['max'],
+      color='gray', alpha=0.25
+  )
+  target.set_ylabel(yunits)
+  target.set_title("{} for CMT {} averaged spatially for stages {}".format(varname, cmtnum, stages))
+
+  if ax is None:
+    plt.show(block=True)
 
 
 def workhorse_spatial_summary_plot(data, cmtnum, yunits, varname, stages, ax=None):
   '''
-  Worker function, plots a line for average along time axis (axis 0), 
+  Worker function, plots a line for average along time axis (axis 0),
   with shading for min and max.
 
   `data`: (numpy.ndarray) must have dimensions (time, y, x).
@@ -423,7 +1587,7 @@ def workhorse_spatial_summary_plot(data, cmtnum, yunits, varname, stages, ax=Non
 
   `varname`: (str) used for the plot title
 
-  `stages`: (list) used for the plot title, must contain one or 
+  `stages`: (list) used for the plot title, must contain one or
             more of "pr","eq","sp","tr","sc".
 
   `ax`: (matplotlib.axes._subplots.AxesSubplot instance) will plot line(s) on
@@ -432,31 +1596,269 @@ def workhorse_spatial_summary_plot(data, cmtnum, yunits, varname, stages, ax=Non
 
   Returns `None`
   '''
-  if ax is not None:
-    print("Plotting on existing ax instance...")
-    ax.plot(np.ma.average(data, axis=(1,2)), linewidth=0.5, label="CMT {}".format(cmtnum))
-    ax.fill_between(
-        np.arange(0, len(data)),
-        np.ma.min(data, axis=(1,2)), 
-        np.ma.max(data, axis=(1,2)), 
-        color='gray', alpha=0.25
-    )
-    ax.set_ylabel(yunits)
-    ax.set_title("{} for CMT {} averaged spatially for stages {}".format(varname, cmtnum, stages))
-    #plt.show(block=True)
+  summary = summarize_spatial_data(data, percentiles=())
+  plot_spatial_summary_table(summary, cmtnum, yunits, varname, stages, ax=ax)
 
-  else:
-    print("Plotting on new ax, figure...")
-    plt.plot(np.ma.average(data, axis=(1,2)), linewidth=0.5, label="CMT {}".format(cmtnum))
-    plt.fill_between(
-        np.arange(0, len(data)),
-        np.ma.min(data, axis=(1,2)), 
-        np.ma.max(data, axis=(1,2)), 
-        color='gray', alpha=0.25
-    )
-    plt.ylabel(yunits)
-    plt.title("{} for CMT {} averaged spatially for stages {}".format(varname, cmtnum, stages))
-    plt.show(block=True)
+
+#
+# Run digest.
+#
+# A single .npz file, written once after a run (see `make_run_digest(..)`),
+# holding spatial summaries for each output variable and stage, broken down
+# by CMT and by run status. The plotting functions check for a digest in the
+# output directory first and only read the raw outputs if there is no up to
+# date digest made with the same vegetation and run status maps.
+#
+RUN_DIGEST_FILE = 'run_digest.npz'
+
+DIGEST_STATS = ['count', 'sum', 'mean', 'min', 'max', 'std']
+
+STEPS_PER_YEAR = {'yearly': 1, 'monthly': 12, 'daily': 365}
+
+
+def _digest_ref(path):
+  '''Identifies a reference map file for the digest metadata.'''
+  if path is None:
+    return None
+  path = os.path.abspath(path)
+  return dict(path=path, mtime=os.path.getmtime(path) if os.path.exists(path) else None)
+
+
+def _digest_groups(pidx):
+  '''
+  Returns an ordered dict mapping digest group names to flat pixel indices:
+  'all' (every active pixel), 'cmtN' (active pixels for each CMT) and
+  'statusN' (every pixel with each run status value).
+  '''
+  groups = collections.OrderedDict()
+  groups['all'] = pidx.select()
+  for cmt in pidx.cmts():
+    groups['cmt{}'.format(cmt)] = pidx.select(cmt)
+  for s in sorted(pidx.by_status):
+    groups['status{}'.format(s)] = pidx.by_status[s]
+  return groups
+
+
+def make_run_digest(outdir, variables=None, timeres=('yearly', 'monthly'),
+    stages=None, ref_veg_map=None, ref_run_status=None, percentiles=(5, 50, 95)):
+  '''
+  Summarizes the outputs in `outdir` and saves the results to a digest file
+  (`outdir`/run_digest.npz) so plots don't have to read the raw outputs again.
+  Meant to be run once after a model run finishes.
+
+  For every variable, time resolution in `timeres` and stage (by default
+  everything found in `outdir`) the digest holds one table per pixel group
+  with the spatial 'count', 'sum', 'mean', 'min', 'max', 'std' and
+  `percentiles` for each timestep (see `spatial_summary(..)`). There are also
+  tables for yearly (for monthly and daily files) and decadal means, made by
+  averaging each pixel over the period before the spatial stats are taken.
+  For variables with a pft dimension the spatial mean of each PFT is stored
+  as well.
+
+  The pixel groups are 'all' (pixels that didn't fail), 'cmtN' for each CMT
+  in `ref_veg_map` (pixels that didn't fail) and 'statusN' for each value in
+  `ref_run_status`. `ref_run_status` defaults to `outdir`/run_status.nc if it
+  exists.
+
+  The files are read in time chunks, like `spatial_summary(..)`, so memory
+  use stays bounded.
+
+  Returns the path to the digest file. See `RunDigest` for reading it.
+  '''
+  if ref_run_status is None and os.path.exists(os.path.join(outdir, 'run_status.nc')):
+    ref_run_status = os.path.join(outdir, 'run_status.nc')
+
+  outputs = RunOutputs(outdir)
+  pidx = None
+  if ref_veg_map is not None or ref_run_status is not None:
+    pidx = PixelIndex.load(ref_veg_map, ref_run_status)
+
+  meta = dict(
+      percentiles=list(percentiles),
+      ref_veg_map=_digest_ref(ref_veg_map),
+      ref_run_status=_digest_ref(ref_run_status),
+      sources={},
+      units={},
+      dimensions={},
+  )
+  arrays = {}
+
+  for tr in timeres:
+    spy = STEPS_PER_YEAR[tr]
+    decade = 10 * spy
+    # Whole decades per chunk so the yearly and decadal groups line up.
+    chunk_size = decade * max(1, 120 // decade)
+    products = [(tr, 1)] + ([('yearly', spy)] if spy > 1 else []) + [('decadal', decade)]
+
+    for var in (variables if variables is not None else outputs.variables(tr)):
+      for stage in (stages if stages is not None else outputs.stages(var, tr)):
+        if (var, tr, stage) not in outputs.files:
+          continue
+        sv = outputs.get(var, tr, [stage])
+        if sv.dimensions[0] != 'time' or sv.dimensions[-2:] != ('y', 'x'):
+          print("Skipping {} {} {}, dimensions are not (time, ..., y, x)".format(var, tr, stage))
+          continue
+
+        p = pidx if pidx is not None else PixelIndex(shape=sv.shape[-2:])
+        if tuple(p.shape) != tuple(sv.shape[-2:]):
+          raise RuntimeError("Mask shape {} does not match the spatial dimensions of the data {}".format(p.shape, sv.shape[-2:]))
+        groups = _digest_groups(p)
+        allflat = np.unique(np.concatenate([np.array([], dtype=np.intp)] + list(groups.values())))
+        positions = collections.OrderedDict((g, np.searchsorted(allflat, f)) for g, f in groups.items())
+
+        print("Summarizing {}".format(sv.paths[0]))
+        n = len(sv)
+        tables = {}
+        for g in groups:
+          for prod, size in products:
+            tables[(g, prod)] = _spatial_summary_table(-(-n // size), percentiles, stats=DIGEST_STATS)
+        pft_axis = sv.dimensions.index('pft') if 'pft' in sv.dimensions else None
+        if pft_axis is not None:
+          for g in groups:
+            tables[(g, 'pft')] = np.full((n, sv.shape[pft_axis]), np.nan)
+
+        for t0 in range(0, n, chunk_size):
+          t1 = min(t0 + chunk_size, n)
+          block = p.read(sv, allflat, time=slice(t0, t1))
+          total = block
+          if block.ndim > 2:
+            total = np.ma.sum(block, axis=tuple(range(1, block.ndim - 1)))
+
+          for prod, size in products:
+            agg = total if size == 1 else aggregate_time(total, np.arange(0, t1 - t0, size), how='mean')
+            agg = np.ma.filled(np.ma.asarray(agg, dtype=np.float64), np.nan)
+            r0 = t0 // size
+            for g, pos in positions.items():
+              _summarize_pixels(agg[:, pos], tables[(g, prod)][r0:r0 + len(agg)], percentiles)
+
+          if pft_axis is not None:
+            by_pft = block
+            other = tuple(i for i in range(1, block.ndim - 1) if i != pft_axis)
+            if other:
+              by_pft = np.ma.sum(block, axis=other)
+            by_pft = np.ma.filled(np.ma.asarray(by_pft, dtype=np.float64), np.nan)
+            with warnings.catch_warnings():
+              warnings.simplefilter('ignore', category=RuntimeWarning)
+              for g, pos in positions.items():
+                tables[(g, 'pft')][t0:t1] = np.nanmean(by_pft[..., pos], axis=-1)
+
+        for (g, prod), table in tables.items():
+          arrays['/'.join([var, tr, stage, g, prod])] = table
+        meta['sources'][os.path.basename(sv.paths[0])] = _source_signature(sv.paths[0])
+        meta['units'][var] = sv.units
+        meta['dimensions'][var] = list(sv.dimensions)
+
+  dest = os.path.join(outdir, RUN_DIGEST_FILE)
+  tmp = dest[:-len('.npz')] + '.tmp.npz'
+  np.savez_compressed(tmp, __meta__=np.array(json.dumps(meta)), **arrays)
+  os.rename(tmp, dest)
+  print("Wrote run digest {} ({} tables)".format(dest, len(arrays)))
+  return dest
+
+
+class RunDigest(object):
+  '''
+  Reads a digest file written by `make_run_digest(..)`.
+
+  Use `RunDigest.load(outdir)`, which returns None if there is no digest or
+  if any of the output files it was made from have changed since. The digest
+  file stays open until `close()` is called, or use it in a `with` block.
+
+  Example:
+
+    >>> with RunDigest.load('output/') as digest:
+    ...   g = digest.group(cmtnum=4, ref_veg_map='vegetation.nc',
+    ...       ref_run_status='output/run_status.nc')
+    ...   vegc = digest.lookup('VEGC', 'yearly', ['tr','sc'], g)
+    >>> plt.plot(vegc['mean'])
+  '''
+
+  @classmethod
+  def load(cls, outdir=''):
+    '''Returns a RunDigest for `outdir`, or None if there is no up to date digest.'''
+    path = os.path.join(outdir, RUN_DIGEST_FILE)
+    if not os.path.exists(path):
+      return None
+    digest = cls(path)
+    if not digest.is_current():
+      print("Ignoring out of date run digest: {}".format(path))
+      digest.close()
+      return None
+    return digest
+
+  def __init__(self, path):
+    self.path = path
+    self._npz = np.load(path)
+    self.meta = json.loads(str(self._npz['__meta__']))
+
+  def close(self):
+    '''Closes the digest file.'''
+    self._npz.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def is_current(self):
+    '''True if all the output files the digest was made from are unchanged.'''
+    d = os.path.dirname(self.path)
+    for fname, sig in self.meta['sources'].items():
+      p = os.path.join(d, fname)
+      if not os.path.exists(p) or _source_signature(p) != sig:
+        return False
+    return True
+
+  def units(self, var):
+    return self.meta['units'].get(var)
+
+  def group(self, cmtnum=None, ref_veg_map=None, ref_run_status=None):
+    '''
+    Returns the name of the group that holds the same pixels that
+    `spatial_summary(..)` would use for these arguments, or None if the
+    digest was made with different maps.
+    '''
+    if _digest_ref(ref_run_status) != self.meta['ref_run_status']:
+      return None
+    if cmtnum is None:
+      return 'all' if self.meta['ref_veg_map'] is None else None
+    if _digest_ref(ref_veg_map) != self.meta['ref_veg_map']:
+      return None
+    return 'cmt{}'.format(cmtnum)
+
+  def lookup(self, var, timeres, stages, group, product=None):
+    '''
+    Returns the table for `var`, `timeres` and `group`, with `stages`
+    stitched together, or None if the digest doesn't have it.
+
+    `product`: None for one row per timestep, 'yearly' or 'decadal' for the
+    aggregated tables, or 'pft' for the (time, pft) array of spatial means.
+    '''
+    if group is None:
+      return None
+    keys = ['/'.join([var, timeres, s, group, product or timeres]) for s in stages]
+    if not all(k in self._npz.files for k in keys):
+      return None
+    return np.concatenate([self._npz[k] for k in keys])
+
+
+def _digest_summary(var, timeres, stages, cmtnum, ref_veg_map, ref_run_status,
+    product=None, outdir=''):
+  '''
+  Returns (`table`, `units`) from the run digest in `outdir` for the pixels
+  `spatial_summary(..)` would use, or None if there is no usable digest.
+  '''
+  digest = RunDigest.load(outdir)
+  if digest is None:
+    return None
+  with digest:
+    table = digest.lookup(var, timeres, stages,
+        digest.group(cmtnum, ref_veg_map, ref_run_status), product=product)
+    if table is None:
+      return None
+    print("Using run digest: {}".format(digest.path))
+    return table, digest.units(var)
 
 
 def plot_inputs(cmtnum, hist_fname, proj_fname, ref_veg_map):
@@ -538,31 +1940,39 @@ def boxplot_monthlies(var, stages, cmtnum, ref_veg_map, ref_run_status, facecolo
   `ref_run_status`: (str) path to run status map to use for masking failed cells
   `facecolor`: (str) color to use for the box.
 
+  Uses the run digest (see `make_run_digest(..)`) in the current directory
+  if there is an up to date one made with the same maps.
+
   Returns `None`
   '''
 
-  data, units = stitch_stages(var, 'monthly', stages)
-  print("data size:", data.size)
+  found = _digest_summary(var, 'monthly', stages, cmtnum, ref_veg_map, ref_run_status)
+  if found is not None:
+    summary, units = found
+    spatial_avg = np.ma.masked_invalid(summary['mean'])
+  else:
+    data, units = stitch_stages(var, 'monthly', stages)
+    print("data size:", data.size)
 
-  data = mask_by_cmt(data, cmtnum, ref_veg_map)
-  print("data count after masking cmt:", data.count())
+    data = mask_by_cmt(data, cmtnum, ref_veg_map)
+    print("data count after masking cmt:", data.count())
 
-  data = mask_by_failed_run_status(data, ref_run_status)
-  print("data count after masking run status:", data.count())
+    data = mask_by_failed_run_status(data, ref_run_status)
+    print("data count after masking run status:", data.count())
 
+    spatial_avg = np.ma.average(data, axis=(1,2))
 
   # list of months
   months = "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split(' ')
-  
+
   # empty dictionary
   monthstr2data = collections.OrderedDict()
 
-  # fill dict with data for each month
+  # fill dict with the spatial averages for each month
   for i, m in enumerate(months):
-      b0 = data[i::12,:,:]
-      monthstr2data[m] = data[i::12,:,:]
+      monthstr2data[m] = spatial_avg[i::12]
 
-  data2 = [np.ma.average(i, axis=(1,2)) for i in list(monthstr2data.values())]
+  data2 = list(monthstr2data.values())
 
   bp = plt.boxplot(
       data2,
@@ -583,23 +1993,31 @@ def boxplot_monthlies(var, stages, cmtnum, ref_veg_map, ref_run_status, facecolo
 def boxplot_by_pft(var, timestep, cmtnum, stages, ref_veg_map, ref_run_status):
   '''
   Work in progress...
+
+  Uses the run digest (see `make_run_digest(..)`) in the current directory
+  if there is an up to date one made with the same maps.
   '''
 
-  data, units = stitch_stages(var, timestep, stages)
-  print("data size:", data.size)
-  print(data.shape)
+  found = _digest_summary(var, timestep, stages, cmtnum, ref_veg_map, ref_run_status, product='pft')
+  if found is not None:
+    pft0avg, units = found
+    pft0avg = np.ma.masked_invalid(pft0avg)
+  else:
+    data, units = stitch_stages(var, timestep, stages)
+    print("data size:", data.size)
+    print(data.shape)
 
-  d2 = data
-  # d2 = sum_across_compartments(data)
-  # print "data size after summing compartments:", d2.size
+    d2 = data
+    # d2 = sum_across_compartments(data)
+    # print "data size after summing compartments:", d2.size
 
-  d3 = mask_by_cmt(d2, cmtnum, ref_veg_map)
-  print("data size after masking cmt:", d3.count())
+    d3 = mask_by_cmt(d2, cmtnum, ref_veg_map)
+    print("data size after masking cmt:", d3.count())
 
-  d3 = mask_by_failed_run_status(d3, ref_run_status)
-  print("data count after masking run status:", d3.count())
+    d3 = mask_by_failed_run_status(d3, ref_run_status)
+    print("data count after masking run status:", d3.count())
 
-  pft0avg = np.ma.average(d3, axis=(2,3))
+    pft0avg = np.ma.average(d3, axis=(2,3))
   #plt.plot(pft0avg) # Line plot
   plt.boxplot(
       pft0avg,
@@ -915,6 +2333,224 @@ def plot_soil_layers2(args):
   plt.show(block=True)
 
 
+def read_soil_profile(outdir, stage, timeres, pixels, timesteps, variables=None):
+  '''
+  Reads soil profiles (all layers) for one or more pixels and timesteps from
+  all the by-layer output files in `outdir`.
+
+  Looks in the `outdir` for any .nc file with 'layer' in the dimension list,
+  and `stage` and `timeres` in the name, e.g. "SOC_monthly_tr.nc". Each file
+  is opened exactly once and the requested timesteps are read for the
+  bounding box around `pixels` in a single read, which is then gathered down
+  to just the requested pixels.
+
+  `pixels`: a (y, x) tuple or a list of (y, x) tuples.
+
+  `timesteps`: an int, a slice, or a list of ints; indices along the time axis
+  of the `stage` files.
+
+  `variables`: (list) optional, restrict the output to these by-layer
+  variables. By default all by-layer variables in `outdir` are read.
+
+  Returns a tuple (`profile`, `units`). `profile` is a numpy structured array
+  with one row per (timestep, pixel, layer), ordered that way, with the
+  fields 'time', 'y', 'x', 'layer' and one float field per variable (nan for
+  masked values). `units` is a dict mapping variable name to units string.
+  It is easy to turn into a DataFrame with `pandas.DataFrame(profile)`.
+
+  Example:
+
+    >>> prof, units = read_soil_profile('output/', 'tr', 'yearly', [(0,0),(1,3)], slice(0,10))
+    >>> prof[(prof['y'] == 1) & (prof['time'] == 5)]['TLAYER']
+  '''
+  if isinstance(pixels, tuple) and len(pixels) == 2 and np.isscalar(pixels[0]):
+    pixels = [pixels]
+  ys = np.array([p[0] for p in pixels], dtype=int)
+  xs = np.array([p[1] for p in pixels], dtype=int)
+  y0, y1, x0, x1 = ys.min(), ys.max() + 1, xs.min(), xs.max() + 1
+
+  candidates = RunOutputs(outdir).files
+  candidates = sorted([(v, f) for (v, tr, st), f in candidates.items() if tr == timeres and st == stage])
+  if variables is not None:
+    candidates = [(v, f) for v, f in candidates if v in variables]
+
+  columns = collections.OrderedDict()
+  units = {}
+  tidx = None
+  for v, f in candidates:
+    with nc.Dataset(f, 'r') as ds:
+      if 'layer' not in ds.variables[v].dimensions:
+        continue
+      if tidx is None:
+        tidx = np.atleast_1d(np.arange(len(ds.dimensions['time']))[timesteps])
+      block = ds.variables[v][timesteps, :, y0:y1, x0:x1]
+      units[v] = getattr(ds.variables[v], 'units', '')
+
+    block = np.ma.asarray(block, dtype=np.float64)
+    if block.ndim == 3:
+      block = block[np.newaxis]
+    # (time, layer, y, x) -> (time, pixel, layer)
+    block = block[:, :, ys - y0, xs - x0].transpose(0, 2, 1)
+    columns[v] = np.ma.filled(block, np.nan)
+
+  if len(columns) == 0:
+    raise RuntimeError("Can't find any by-layer outputs for {} {} in {}".format(timeres, stage, outdir))
+
+  if len(set([c.shape for c in columns.values()])) > 1:
+    raise RuntimeError("Not all files/variables have the same lenght of layer dimensions")
+
+  nt, npix, nl = list(columns.values())[0].shape
+  profile = np.zeros(nt * npix * nl, dtype=[('time', int), ('y', int), ('x', int), ('layer', int)]
+      + [(v, np.float64) for v in columns])
+  profile['time'] = np.repeat(tidx, npix * nl)
+  profile['y'] = np.tile(np.repeat(ys, nl), nt)
+  profile['x'] = np.tile(np.repeat(xs, nl), nt)
+  profile['layer'] = np.tile(np.arange(nl), nt * npix)
+  for v, c in columns.items():
+    profile[v] = c.ravel()
+
+  return profile, units
+
+
+#
+# Regridding by-layer outputs onto fixed depths.
+#
+# dvmdostem soil layers move around: LAYERDEPTH (depth from the surface to the
+# top of each layer) and LAYERDZ (layer thickness) change with time and pixel.
+# The functions below map a by-layer variable onto a fixed depth grid for all
+# pixels and timesteps at once. The only Python loop is over the target
+# depths. Layers with missing or non-positive thickness are ignored, as are
+# layers where the variable is missing.
+#
+REGRID_METHODS = ['mean', 'mass', 'interp']
+
+
+def regrid_layers(values, top, dz, grid, method='mean'):
+  '''
+  Maps layer data onto a fixed depth grid.
+
+  `values`, `top`, `dz`: arrays (or masked arrays) with the same shape and
+  the layer axis last, e.g. (time, y, x, layer). `top` is the depth to the
+  top of each layer and `dz` the thickness, like the LAYERDEPTH and LAYERDZ
+  outputs.
+
+  `grid`: (sequence of numbers) increasing depths in the same units as `top`
+  and `dz`. For the 'mean' and 'mass' methods these are the K+1 boundaries
+  of the K target layers; for 'interp' they are the K target depths.
+
+  `method`:
+   - 'mean': thickness weighted average of the layers that overlap each
+     target layer. For intensive variables like TLAYER or VWCLAYER.
+   - 'mass': the amount in each target layer, assuming each source layer's
+     amount is spread evenly over its thickness, so totals are conserved.
+     For per-layer amounts like SOC or ORGN.
+   - 'interp': linear interpolation between layer midpoints. Depths above
+     the first or below the last midpoint (but still inside the soil column)
+     get the value of the nearest layer.
+
+  Returns a float64 array with shape `values.shape[:-1] + (K,)` with nan
+  where a target is outside the soil column or has no valid data.
+  '''
+  if method not in REGRID_METHODS:
+    raise RuntimeError("Invalid method '{}'. Must be one of {}".format(method, REGRID_METHODS))
+  grid = np.asarray(grid, dtype=np.float64)
+  if grid.ndim != 1 or np.any(np.diff(grid) <= 0):
+    raise RuntimeError("The depth grid must be a 1D sequence of increasing depths!")
+
+  values = np.ma.filled(np.ma.asarray(values, dtype=np.float64), np.nan)
+  top = np.ma.filled(np.ma.asarray(top, dtype=np.float64), np.nan)
+  dz = np.ma.filled(np.ma.asarray(dz, dtype=np.float64), np.nan)
+  if not (values.shape == top.shape == dz.shape):
+    raise RuntimeError("values, top and dz must have the same shape!")
+
+  with np.errstate(invalid='ignore'):
+    valid = np.isfinite(values) & np.isfinite(top) & np.isfinite(dz) & (dz > 0)
+  v = np.where(valid, values, 0.0)
+  top = np.where(valid, top, np.nan)
+  bottom = top + dz
+
+  if method == 'interp':
+    out = np.full(values.shape[:-1] + (len(grid),), np.nan)
+    mid = top + 0.5 * dz
+    col_top = np.min(np.where(valid, top, np.inf), axis=-1)
+    col_bottom = np.max(np.where(valid, bottom, -np.inf), axis=-1)
+    for k, d in enumerate(grid):
+      with np.errstate(invalid='ignore'):
+        lo = np.where(valid & (mid <= d), mid, -np.inf)
+        hi = np.where(valid & (mid >= d), mid, np.inf)
+      ilo = lo.argmax(axis=-1)[..., None]
+      ihi = hi.argmin(axis=-1)[..., None]
+      zlo = np.take_along_axis(lo, ilo, axis=-1)[..., 0]
+      zhi = np.take_along_axis(hi, ihi, axis=-1)[..., 0]
+      vlo = np.take_along_axis(v, ilo, axis=-1)[..., 0]
+      vhi = np.take_along_axis(v, ihi, axis=-1)[..., 0]
+      has_lo = np.isfinite(zlo)
+      has_hi = np.isfinite(zhi)
+      with np.errstate(invalid='ignore', divide='ignore'):
+        w = np.where(zhi > zlo, (d - zlo) / (zhi - zlo), 0.0)
+        res = np.where(has_lo & has_hi, vlo + w * (vhi - vlo), np.nan)
+      res = np.where(~has_lo & has_hi & (d >= col_top), vhi, res)
+      res = np.where(has_lo & ~has_hi & (d <= col_bottom), vlo, res)
+      out[..., k] = res
+    return out
+
+  out = np.full(values.shape[:-1] + (len(grid) - 1,), np.nan)
+  for k in range(len(grid) - 1):
+    # Thickness of each source layer that falls inside target layer k.
+    overlap = np.minimum(bottom, grid[k + 1]) - np.maximum(top, grid[k])
+    overlap = np.where(valid & (overlap > 0), overlap, 0.0)
+    covered = overlap.sum(axis=-1)
+    if method == 'mass':
+      amount = np.sum(v * overlap / np.where(valid, dz, 1.0), axis=-1)
+    else:
+      with np.errstate(invalid='ignore', divide='ignore'):
+        amount = np.sum(v * overlap, axis=-1) / covered
+    out[..., k] = np.where(covered > 0, amount, np.nan)
+  return out
+
+
+def regrid_soil_variable(outdir, var, timeres, stages, grid, method='mean',
+    chunk_size=120):
+  '''
+  Regrids the by-layer output `var` onto the fixed depth `grid` for every
+  pixel and timestep, using the LAYERDEPTH and LAYERDZ outputs for the same
+  `timeres` and `stages` to locate the layers. See `regrid_layers(..)` for
+  `grid` and `method`.
+
+  The files are read `chunk_size` timesteps at a time, so the only large
+  array in memory is the result.
+
+  Returns a tuple (`data`, `units`). `data` is a masked array with
+  dimensions (time, depth, y, x), masked where there is no data for a
+  target depth (e.g. below the bottom of the soil column or a failed pixel).
+
+  Example:
+
+    >>> tl, units = regrid_soil_variable('output/', 'TLAYER', 'monthly', ['tr'],
+    ...     [0.1, 0.2, 0.5, 1.0], method='interp')
+    >>> frozen_1m = (tl[:, 3] < 0).mean(axis=0)   # fraction of months frozen at 1m
+  '''
+  outputs = RunOutputs(outdir)
+  sv = outputs.get(var, timeres, stages)
+  depth = outputs.get('LAYERDEPTH', timeres, stages)
+  dz = outputs.get('LAYERDZ', timeres, stages)
+  for x in (sv, depth, dz):
+    if tuple(x.dimensions) != ('time', 'layer', 'y', 'x'):
+      raise RuntimeError("{} must have dimensions (time, layer, y, x), not {}".format(x.var, x.dimensions))
+    if x.shape[1:] != sv.shape[1:] or len(x) != len(sv):
+      raise RuntimeError("{} and {} have different shapes!".format(x.var, var))
+
+  nk = len(grid) if method == 'interp' else len(grid) - 1
+  result = np.full((len(sv), nk) + tuple(sv.shape[-2:]), np.nan)
+  for t0 in range(0, len(sv), chunk_size):
+    t1 = min(t0 + chunk_size, len(sv))
+    # (time, layer, y, x) -> (time, y, x, layer)
+    chunk = [np.moveaxis(np.ma.asarray(x[t0:t1]), 1, -1) for x in (sv, depth, dz)]
+    result[t0:t1] = np.moveaxis(regrid_layers(chunk[0], chunk[1], chunk[2], grid, method=method), -1, 1)
+
+  return np.ma.masked_invalid(result, copy=False), sv.units
+
+
 def print_soil_table(outdir, stage, timeres, Y, X, timestep):
   '''
   Prints a table to stdout with all the soil info.
@@ -927,54 +2563,22 @@ def print_soil_table(outdir, stage, timeres, Y, X, timestep):
 
   Prints a very wide table if there are many by-layer outputs available. A neat
   addition to this function would be a better way to control the width.
-  '''
 
-  def get_var_name(fpath):
-    '''Extract variable name from full path'''
-    return os.path.basename(fpath).split("_")[0]
-
-  allncfiles = glob.glob(os.path.join(outdir, "*_{}_{}.nc".format(timeres, stage)))
-  soilfiles = []
-  soillayerdimlengths = []
-  for f in allncfiles:
-    with nc.Dataset(f) as ds:
-      if 'layer' in ds.dimensions:
-        try:
-          numlayers = ds.dimensions['layer'].size # attribute only available in netCDF4 > 1.2.2
-        except AttributeError as e:
-          numlayers = len(ds.dimensions['layer'])
-        soilfiles.append(f)
-        soillayerdimlengths.append(numlayers)
-
-  soillayerdimlengths = set(soillayerdimlengths)
-  if len(soillayerdimlengths) > 1:
-    raise RuntimeError("Not all files/variables have the same lenght of layer dimensions")
+  See `read_soil_profile(..)` for getting the data without printing it.
+  '''
+  profile, units = read_soil_profile(outdir, stage, timeres, (Y, X), timestep)
+  varlist = list(profile.dtype.names[4:])
 
-  header_fmt = "{:>15s} " * len(soilfiles)
-  row_fmt = "{:>15.3f} " * len(soilfiles)
+  header_fmt = "{:>15s} " * len(varlist)
+  row_fmt = "{:>15.3f} " * len(varlist)
 
-  varlist = [get_var_name(f) for f in soilfiles]
   print("---- Soil Profile ----")
   print("  output directory: {}".format(outdir))
   print("  {} files stage: {} pixel(y,x): ({},{}) timestep: {}".format(timeres.upper(), stage.upper(), Y, X, timestep))
   print(header_fmt.format(*varlist))
 
-  # This is probably not very effecient.
-  for il in range(0, soillayerdimlengths.pop()):
-
-    data = []
-    for v, f in zip(varlist, soilfiles):
-      with nc.Dataset(f) as ds:
-        if type(ds.variables[v][timestep,il,Y,X]) == 'str':
-          data.append(np.nan)
-        if ds.variables[v][timestep,il,Y,X] is np.ma.masked: # works in recent numpy versions
-          data.append(np.nan)
-        if np.ma.is_masked(ds.variables[v][timestep, il, Y,X]): # works numpy 1.11.1
-          data.append(np.nan)
-        else:
-          data.append(ds.variables[v][timestep,il,Y,X])
-
-    print(row_fmt.format(*data))
+  for row in profile:
+    print(row_fmt.format(*[row[v] for v in varlist]))
 
 
 if __name__ == '__main__':
@@ -1083,6 +2687,51 @@ if __name__ == '__main__':
         '''))
 
 
+  # tc for 'transpose cache'
+  # E.G.: ./output_utils.py --timeres monthly transpose-cache /path/to/output/ --vars GPP VEGC
+  tc_parser = subparsers.add_parser('transpose-cache',
+      help=textwrap.dedent('''\
+        Build (or refresh) a pixel-major copy of output files so that reading
+        long time series for single pixels is fast. The cache is stored in a
+        hidden folder next to the outputs and is used automatically by the
+        functions in this module (and plot_output_var.py) when it is up to
+        date. Uses the --timeres argument; builds the cache for all stages
+        unless --stages is given.
+        '''))
+  tc_parser.add_argument('--vars', nargs='*', help="Variables to cache (default: all)")
+  tc_parser.add_argument('--stages', nargs='*', choices=STAGES, help="Stages to cache (default: all)")
+  tc_parser.add_argument('--force', action='store_true', help="Rebuild even if the cache is up to date.")
+  tc_parser.add_argument('outfolder', help="Path to a folder containing a set of dvmdostem outputs")
+
+  # pq for 'parquet'
+  # E.G.: ./output_utils.py --timeres monthly export-parquet /path/to/output/ /path/to/dest --vars GPP
+  pq_parser = subparsers.add_parser('export-parquet',
+      help=textwrap.dedent('''\
+        Export output files to a tidy (one value per row), partitioned Parquet
+        dataset that can be filtered by variable, stage, cmt, pixel and year
+        without reading the rest. Requires pyarrow. Uses the --timeres
+        argument.
+        '''))
+  pq_parser.add_argument('--vars', nargs='*', help="Variables to export (default: all)")
+  pq_parser.add_argument('--stages', nargs='*', choices=STAGES, help="Stages to export (default: all)")
+  pq_parser.add_argument('--ref-veg-map', help="Vegetation map used to fill the cmt column")
+  pq_parser.add_argument('outfolder', help="Path to a folder containing a set of dvmdostem outputs")
+  pq_parser.add_argument('dest', help="Folder to write the Parquet dataset to")
+
+  # rd for 'run digest'
+  # E.G.: ./output_utils.py run-digest /path/to/output/ --ref-veg-map /path/to/vegetation.nc
+  rd_parser = subparsers.add_parser('run-digest',
+      help=textwrap.dedent('''\
+        Summarize a set of outputs (yearly and monthly files) into a small
+        digest file that the spatial summary plots read instead of the raw
+        outputs. Run this once after a model run finishes.
+        '''))
+  rd_parser.add_argument('--vars', nargs='*', help="Variables to summarize (default: all)")
+  rd_parser.add_argument('--stages', nargs='*', choices=STAGES, help="Stages to summarize (default: all)")
+  rd_parser.add_argument('--ref-veg-map', help="Vegetation map for the per-CMT summaries")
+  rd_parser.add_argument('--ref-run-status', help="Run status map (default: run_status.nc in the output folder)")
+  rd_parser.add_argument('outfolder', help="Path to a folder containing a set of dvmdostem outputs")
+
   # ss for 'spatial summary'
   ss_parser = subparsers.add_parser('spatial-summaries',
       help=textwrap.dedent('''\
@@ -1096,6 +2745,15 @@ if __name__ == '__main__':
   if args.command == 'fronts':
     plot_fronts(args)
 
+  if args.command == 'transpose-cache':
+    build_transpose_cache(args.outfolder, variables=args.vars, timeres=args.timeres, stages=args.stages, force=args.force)
+
+  if args.command == 'export-parquet':
+    export_parquet(args.outfolder, args.dest, variables=args.vars, timeres=args.timeres, stages=args.stages, ref_veg_map=args.ref_veg_map)
+
+  if args.command == 'run-digest':
+    make_run_digest(args.outfolder, variables=args.vars, stages=args.stages, ref_veg_map=args.ref_veg_map, ref_run_status=args.ref_run_status)
+
   if args.command == 'soil-profiles':
     if args.print_full_table:
       print_soil_table(args.outfolder, args.stage, args.timeres, args.yx[0], args.yx[1], args.timestep)
@@ -7,6 +7,7 @@ import os
 import json
 import re
 import glob
+import bisect
 import sys
 import csv
 import itertools
@@ -287,27 +288,13 @@ def get_CMTs_in_file(aFile):
   -------
   A list of dicts with info about the CMTs found in a file.
   '''
-  data = read_paramfile(aFile)
-
-  cmt_list = []
-  for i, line in enumerate(data):
-    # Looks for CMT at the beginning of a comment line.
-    # Will match:
-    # "// CMT06 ....", or "  //   CMT06 ..."
-    # but not
-    # '// some other text CMT06 '
-    line = line.strip().lstrip('//').strip()
-    if line.find('CMT') == 0:
-      cmtkey, cmtname, cmtcomments = parse_header_line(line)
-      cmtnum = int(cmtkey[3:])
-      cmtdict = dict(cmtkey=cmtkey, cmtnum=cmtnum, cmtname=cmtname, cmtcomment=cmtcomments)
-      cmt_list.append(cmtdict)
-
-    elif line.find('CMT') > 0:
-      # Must be a comment line, and not the start of a valid CMT data block.
-      pass
-
-  return cmt_list
+  # Looks for CMT at the beginning of a comment line.
+  # Will match:
+  # "// CMT06 ....", or "  //   CMT06 ..."
+  # but not
+  # '// some other text CMT06 '
+  db, fname = _paramdb_for(aFile)
+  return db.cmts(fname)
 
 
 def find_cmt_start_idx(data, cmtkey):
@@ -431,8 +418,8 @@ def replace_CMT_data(origfile, newfile, cmtnum, overwrite=False):
   -------
   List of lines.
   '''
-  with open(origfile, 'r') as f:
-    data = f.readlines()
+  db, fname = _paramdb_for(origfile)
+  data = db.lines(fname)
 
   sidx = find_cmt_start_idx(data, 'CMT{:02d}'.format(cmtnum))
 
@@ -482,35 +469,10 @@ def get_CMT_datablock(afile, cmtnum):
     A list of strings, one item for each line in the CMT's datablock.
     Each string will have a newline charachter in it.
   '''
-  data = read_paramfile(afile)
-
-  data = [i for i in data if i != '\n']
-
-  if type(cmtnum) == int:
-    cmtkey = 'CMT%02i' % cmtnum
-  else:
-    cmtkey = cmtnum
-
-  startidx = find_cmt_start_idx(data, cmtkey)
-  if startidx is None:
-    raise RuntimeError("Can't find datablock for CMT: {} in {}".format(cmtkey, afile))
-
-  end = None
-
-  for i, line in enumerate(data[startidx:]):
-    if i == 0: # Header line, e.g.: "// CMT07 // Heath Tundra - (ma.....""
-      pass    
-    elif i == 1: # PFT name line, e,g.: "//Decid.     E.green      ...."
-      # Not sure how/why this is working on non-PFT data blocks
-      # but is seems to do the trick?
-      pass
-
-    if (i > 0) and "CMT" in line:
-      #print "end of datablock, i=", i
-      end = startidx + i
-      break
-
-  return data[startidx:end]
+  # The block runs from the header line, e.g.: "// CMT07 // Heath Tundra ..."
+  # up to the next line with 'CMT' in it, see ParamDB.
+  db, fname = _paramdb_for(afile)
+  return db.datablock(fname, cmtnum)
 
 def detect_block_with_pft_info(cmtdatablock):
   # Perhaps should look at all lines??
@@ -591,9 +553,7 @@ def get_pft_verbose_name(cmtkey=None, pftkey=None, cmtnum=None, pftnum=None, loo
   if pftnum: # convert to key
     pftkey = 'pft%i' % pftnum
 
-  data = get_CMT_datablock(os.path.join(path2params, 'cmt_calparbgc.txt'), cmtnum)
-  dd = cmtdatablock2dict(data)
-
+  dd = cached_cmtdatadict(os.path.join(path2params, 'cmt_calparbgc.txt'), cmtnum)
 
   return dd[pftkey.lower()]['name']
 
@@ -764,27 +724,12 @@ def generate_reference_order(aFile):
     A list of strings containing the variable names, parsed from the input file
     in the order they appear in the input file.
   '''
-
-  cmt_calparbgc = []
-  db = get_CMT_datablock(aFile, 0)
-
-  pftblock = detect_block_with_pft_info(db)
-
+  # Lines with data in CMT 0, the tag is the comment up to the first ':'
+  db, fname = _paramdb_for(aFile)
   ref_order = []
-
-  for line in db:
-    t = comment_splitter(line)
-    if t[0] == '':
-      pass # nothing before the comment, ignore this line - is has no data
-    else:
-      # looks like t0 has some data, so now we need the
-      # comment (t[1]) which we will further refine to get the
-      # tag, which we will append to the "reference order" list
-      tokens = t[1].strip().lstrip("//").strip().split(":")
-      tag = tokens[0]
-      desc = "".join(tokens[1:])
-      print("Found tag:", tag, " Desc: ", desc)
-      ref_order.append(tag)
+  for tag, desc in db.reference_order(fname):
+    print("Found tag:", tag, " Desc: ", desc)
+    ref_order.append(tag)
 
   return ref_order
 
@@ -877,6 +822,288 @@ def enforce_initvegc_split(aFile, cmtnum):
 
   return dd
 
+class ParamDB(object):
+  '''
+  In memory, indexed copy of the parameter files (cmt_*.txt) in a directory.
+
+  Each file is read and indexed once (file -> CMT -> variable -> PFT values)
+  the first time it is used and again whenever it is modified on disk, so
+  looking up a CMT datablock or a parameter doesn't re-read and scan the
+  whole file. The lines of the files are kept as they are, so the reference
+  order and all the comments are preserved when values are changed with
+  set(..) and written back with write(..).
+
+  Most of the functions in this module (get_CMT_datablock(..),
+  get_CMTs_in_file(..), cached_cmtdatadict(..) etc) work on top of a shared
+  ParamDB, see get_paramdb(..).
+
+  Example (on a copy of the parameters, so they aren't changed):
+
+    >>> import shutil, tempfile
+    >>> tmp = tempfile.mkdtemp()
+    >>> params = shutil.copytree('parameters', os.path.join(tmp, 'parameters'))
+    >>> db = ParamDB(params)
+    >>> db.get('cmt_calparbgc.txt', 5, 'cmax')
+    [130.0, 60.0, 200.0, 450.0, 33.0, 300.0, 185.0, 120.0, 0.0, 0.0]
+    >>> db.set('cmt_calparbgc.txt', 5, 'cmax', 410.0, pft=0)
+    >>> db.write()
+    >>> ParamDB(params).get('cmt_calparbgc.txt', 5, 'cmax', pft=0)
+    410.0
+    >>> shutil.rmtree(tmp)
+  '''
+  def __init__(self, param_dir):
+    self.param_dir = param_dir
+    self._files = {}
+
+  def files(self):
+    '''Returns a sorted list of the parameter files (cmt_*.txt) in the directory.'''
+    return sorted(glob.glob(os.path.join(self.param_dir, 'cmt_*.txt')))
+
+  def load(self):
+    '''Reads and indexes all the parameter files in the directory.'''
+    for f in self.files():
+      self._entry(f)
+    return self
+
+  def _path(self, fname):
+    return os.path.join(self.param_dir, fname)
+
+  def _entry(self, fname):
+    '''
+    Returns the parsed (and indexed) data for a file, re-reading it if it has
+    been modified since it was last read.
+    '''
+    path = self._path(fname)
+    key = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    entry = self._files.get(key)
+    if entry is not None and entry['stamp'] != stamp:
+      if entry['dirty']:
+        raise RuntimeError("{} has been modified on disk and has unsaved changes!".format(path))
+      entry = None
+    if entry is None:
+      entry = self._parse(path, stamp)
+      self._files[key] = entry
+    return entry
+
+  def _parse(self, path, stamp):
+    lines = read_paramfile(path)
+
+    # Same as get_CMT_datablock(..): blank lines are ignored, a block starts
+    # at the first line with the CMT key and runs up to the next line with
+    # 'CMT' in it.
+    nonblank = [i for i, line in enumerate(lines) if line != '\n']
+    starts = {}
+    breaks = []
+    for n, i in enumerate(nonblank):
+      if 'CMT' not in lines[i]:
+        continue
+      breaks.append(n)
+      for m in re.finditer(r'CMT\d+', lines[i]):
+        # find_cmt_start_idx(..) matches substrings, so index the shorter
+        # keys too ('CMT05' for 'CMT051').
+        for end in range(m.start() + 4, m.end() + 1):
+          starts.setdefault(m.group()[:end - m.start()], n)
+
+    return dict(path=path, stamp=stamp, lines=lines, nonblank=nonblank,
+                starts=starts, breaks=breaks, blocks={}, cmts=None,
+                ref_order=None, dirty=set())
+
+  def _span(self, entry, cmtkey):
+    '''Returns the [start, end) range of a CMT block in the non blank lines.'''
+    nonblank = entry['nonblank']
+    if re.match(r'^CMT\d+$', cmtkey):
+      start = entry['starts'].get(cmtkey)
+    else:
+      start = find_cmt_start_idx([entry['lines'][i] for i in nonblank], cmtkey)
+    if start is None:
+      raise RuntimeError("Can't find datablock for CMT: {} in {}".format(cmtkey, entry['path']))
+    nxt = bisect.bisect_right(entry['breaks'], start)
+    end = entry['breaks'][nxt] if nxt < len(entry['breaks']) else len(nonblank)
+    return start, end
+
+  def _block(self, fname, cmtnum):
+    entry = self._entry(fname)
+    cmtkey = _cmt_key(cmtnum)
+    if cmtkey not in entry['blocks']:
+      start, end = self._span(entry, cmtkey)
+      idxs = entry['nonblank'][start:end]
+      data = [entry['lines'][i] for i in idxs]
+
+      # Line of each parameter, parsed the same way as cmtdatablock2dict(..)
+      params = {}
+      for i, line in zip(idxs, data):
+        if line.strip()[0:2] == "//":
+          continue
+        dline = line.strip().split("//")
+        values = dline[0].split()
+        comment = dline[1].strip().strip("//").split(':')[0] if len(dline) > 1 else ''
+        params[comment] = (i, len(values) if len(values) >= 5 else None)
+
+      entry['blocks'][cmtkey] = dict(lines=idxs, dd=cmtdatablock2dict(data), params=params)
+    return entry, cmtkey, entry['blocks'][cmtkey]
+
+  def cmts(self, fname):
+    '''Same as get_CMTs_in_file(..).'''
+    entry = self._entry(fname)
+    if entry['cmts'] is None:
+      cmt_list = []
+      for i in entry['nonblank']:
+        line = entry['lines'][i].strip().lstrip('//').strip()
+        if line.find('CMT') == 0:
+          cmtkey, cmtname, cmtcomments = parse_header_line(line)
+          cmt_list.append(dict(cmtkey=cmtkey, cmtnum=int(cmtkey[3:]), cmtname=cmtname, cmtcomment=cmtcomments))
+      entry['cmts'] = cmt_list
+    return [dict(c) for c in entry['cmts']]
+
+  def datablock(self, fname, cmtnum):
+    '''Same as get_CMT_datablock(..).'''
+    entry, cmtkey, block = self._block(fname, cmtnum)
+    return [entry['lines'][i] for i in block['lines']]
+
+  def block(self, fname, cmtnum):
+    '''
+    Same as cmtdatablock2dict(get_CMT_datablock(..)). The dict is shared, so
+    don't modify it, use set(..) instead.
+    '''
+    return self._block(fname, cmtnum)[2]['dd']
+
+  def lines(self, fname):
+    '''Returns a copy of all the lines in a file (including any unsaved changes).'''
+    return list(self._entry(fname)['lines'])
+
+  def reference_order(self, fname):
+    '''
+    Returns a list of (name, description) for the parameters in CMT 0 of the
+    file, in the order they appear, see generate_reference_order(..).
+    '''
+    entry = self._entry(fname)
+    if entry['ref_order'] is None:
+      ref_order = []
+      for line in self.datablock(fname, 0):
+        t = comment_splitter(line)
+        if t[0] != '':
+          tokens = t[1].strip().lstrip("//").strip().split(":")
+          ref_order.append((tokens[0], "".join(tokens[1:])))
+      entry['ref_order'] = ref_order
+    return list(entry['ref_order'])
+
+  def get(self, fname, cmtnum, var, pft=None):
+    '''
+    Returns the value of a parameter. For PFT parameters returns a list with
+    the value for each PFT, or just the value for `pft` if it is given.
+    '''
+    entry, cmtkey, block = self._block(fname, cmtnum)
+    if var not in block['params']:
+      raise RuntimeError("Can't find parameter {} for {} in {}".format(var, cmtkey, entry['path']))
+    line, npfts = block['params'][var]
+    dd = block['dd']
+    if npfts is None:
+      return dd[var]
+    if pft is not None:
+      return dd['pft%i' % pft][var]
+    return [dd['pft%i' % i][var] for i in range(npfts)]
+
+  def set(self, fname, cmtnum, var, value, pft=None):
+    '''
+    Sets the value of a parameter. For PFT parameters `value` is a list with
+    a value for each PFT, or just the value for `pft` if it is given. Values
+    are rounded to the precision they will be written with.
+
+    The changes are kept in memory until write(..) is called.
+    '''
+    entry, cmtkey, block = self._block(fname, cmtnum)
+    if var not in block['params']:
+      raise RuntimeError("Can't find parameter {} for {} in {}".format(var, cmtkey, entry['path']))
+    line, npfts = block['params'][var]
+    dd = block['dd']
+
+    if npfts is None:
+      if pft is not None:
+        raise RuntimeError("{} is not a PFT parameter!".format(var))
+      dd[var] = float('{:.6f}'.format(value))
+      data = '{:<12.6f} '.format(dd[var])
+    else:
+      if pft is not None:
+        values = {pft: value}
+      elif len(value) == npfts:
+        values = dict(enumerate(value))
+      else:
+        raise RuntimeError("Expected {} values for {}, got {}".format(npfts, var, len(value)))
+      for i, v in values.items():
+        dd['pft%i' % i][var] = float('{:.6f}'.format(v))
+      data = ''.join(["{: >12.6f} ".format(dd['pft%i' % i][var]) for i in range(npfts)])
+
+    # Keep the comment and the line ending.
+    old = entry['lines'][line]
+    body = old.rstrip('\r\n')
+    entry['lines'][line] = data + comment_splitter(body)[1] + old[len(body):]
+    entry['dirty'].add(cmtkey)
+
+  def dirty(self):
+    '''Returns a dict of {file: [CMT keys]} with unsaved changes.'''
+    return {e['path']: sorted(e['dirty']) for e in self._files.values() if e['dirty']}
+
+  def write(self, fname=None):
+    '''
+    Writes the files with changed (dirty) blocks back to disk, or just
+    `fname`. Only the changed lines differ from the original file.
+    '''
+    if fname is None:
+      entries = [e for e in self._files.values() if e['dirty']]
+    else:
+      entries = [self._files.get(os.path.abspath(self._path(fname)))]
+    for entry in entries:
+      if entry is None or not entry['dirty']:
+        continue
+      st = os.stat(entry['path'])
+      if (st.st_mtime_ns, st.st_size) != entry['stamp']:
+        raise RuntimeError("{} has been modified on disk, not writing!".format(entry['path']))
+      with open(entry['path'], 'w') as f:
+        f.writelines(entry['lines'])
+      st = os.stat(entry['path'])
+      entry['stamp'] = (st.st_mtime_ns, st.st_size)
+      entry['dirty'] = set()
+
+# Shared ParamDBs, see get_paramdb(..)
+_paramdbs = {}
+
+def get_paramdb(param_dir):
+  '''Returns the shared ParamDB for a directory.'''
+  key = os.path.abspath(param_dir)
+  if key not in _paramdbs:
+    _paramdbs[key] = ParamDB(param_dir)
+  return _paramdbs[key]
+
+def _paramdb_for(afile):
+  '''Returns (ParamDB, file name) for a path to a parameter file.'''
+  return get_paramdb(os.path.dirname(afile)), os.path.basename(afile)
+
+def _cmt_key(cmtnum):
+  if type(cmtnum) == int:
+    return 'CMT%02i' % cmtnum
+  return cmtnum.upper()
+
+def cached_cmtdatadict(afile, cmtnum):
+  '''
+  Same as ``cmtdatablock2dict(get_CMT_datablock(afile, cmtnum))``, but each
+  CMT datablock is only read and parsed once (and again if the file is
+  modified), see ParamDB. The returned dict is shared between callers, so
+  don't modify it; use copy.deepcopy(..) first if you need to.
+  '''
+  db, fname = _paramdb_for(afile)
+  return db.block(fname, cmtnum)
+
+# Names used for undefined PFTs.
+UNDEFINED_PFT_NAMES = 'none,misc,misc.,pft0,pft1,pft2,pft3,pft4,pft5,pft6,pft7,pft8,pft9'.split(",")
+
+# Compartments and the matching initial vegetation carbon parameters.
+COMPARTMENT_INITVEGC = [('Leaf', 'initvegcl'), ('Stem', 'initvegcw'), ('Root', 'initvegcr')]
+
+def _cmt_number(cmtstr):
+  return int(cmtstr.upper().lstrip('CMT'))
+
 def get_ecosystem_total_C(cmtstr, ref_params_dir):
   
 
@@ -884,13 +1111,12 @@ def get_ecosystem_total_C(cmtstr, ref_params_dir):
   soil_param_file = os.path.join(os.path.abspath(ref_params_dir), 'cmt_bgcsoil.txt')
 
   # First start with the vegetation numbers
-  d = get_CMT_datablock(veg_param_file, int(cmtstr.upper().lstrip('CMT')))
-  dd = cmtdatablock2dict(d)
+  dd = cached_cmtdatadict(veg_param_file, _cmt_number(cmtstr))
 
   vegC = 0.0
   for pft in ['pft{}'.format(i) for i in range(0,10)]:
     
-    if dd[pft]['name'].lower() in 'none,misc,misc.,pft0,pft1,pft2,pft3,pft4,pft5,pft6,pft7,pft8,pft9'.split(","):
+    if dd[pft]['name'].lower() in UNDEFINED_PFT_NAMES:
       pass # This PFT is not defined for this community
       # This is probably unnecessary because generally un-defined PFTs have all 
       # zero values...
@@ -900,8 +1126,7 @@ def get_ecosystem_total_C(cmtstr, ref_params_dir):
       vegC += dd[pft]['initvegcr']
 
   # Now load up the soil numbers
-  d = get_CMT_datablock(soil_param_file, int(cmtstr.upper().lstrip('CMT')))
-  dd = cmtdatablock2dict(d)
+  dd = cached_cmtdatadict(soil_param_file, _cmt_number(cmtstr))
 
   soilC = 0.0
   soilC += dd['initshlwc']
@@ -911,12 +1136,61 @@ def get_ecosystem_total_C(cmtstr, ref_params_dir):
   return vegC + soilC
 
 
-def percent_ecosys_contribution(cmtstr, tname=None, pftnum=None, compartment=None, ref_params_dir=None):
+# Contribution tables, see ecosys_contribution_table(..)
+_contribution_cache = {}
+
+def ecosys_contribution_table(cmtstr, ref_params_dir):
+  '''
+  Works out, in one go, the ecosystem contribution weights and contributor
+  flags (see percent_ecosys_contribution(..) and is_ecosys_contributor(..))
+  for every PFT and every (compartment, PFT) of a CMT. Cached, so the
+  parameter files are only parsed once for each CMT.
+
+  The weights don't depend on the calibration target, other than through
+  its dimensions: targets that are not by PFT always have a weight of 1.0.
+
+  Returns
+  -------
+  d : dict
+    With keys:
+     - 'total_C': ecosystem total carbon, see get_ecosystem_total_C(..).
+     - 'pft_pec', 'pft_contrib': lists (one item per PFT) of the weight and
+       contributor flag for targets by PFT.
+     - 'cmprt_pec', 'cmprt_contrib': lists of lists ([compartment][pft], with
+       compartments in the order Leaf, Stem, Root) for targets by PFT and
+       compartment.
+  '''
+  veg_param_file = os.path.join(os.path.abspath(ref_params_dir), 'cmt_bgcvegetation.txt')
+  soil_param_file = os.path.join(os.path.abspath(ref_params_dir), 'cmt_bgcsoil.txt')
+  key = (os.path.abspath(ref_params_dir), cmtstr.upper())
+  mtimes = (os.path.getmtime(veg_param_file), os.path.getmtime(soil_param_file))
+  if key in _contribution_cache and _contribution_cache[key][0] == mtimes:
+    return _contribution_cache[key][1]
 
-  pec = 1.0 # Start by assuming everythign has a contribution of 1
   total_C = get_ecosystem_total_C(cmtstr, ref_params_dir)
+  dd = cached_cmtdatadict(veg_param_file, _cmt_number(cmtstr))
+  pfts = ['pft{}'.format(i) for i in range(0,10)]
+  defined = [dd[pft]['name'].lower() not in UNDEFINED_PFT_NAMES for pft in pfts]
+
+  table = dict(
+    total_C=total_C,
+    pft_pec=[sum(dd[pft][c] for n, c in COMPARTMENT_INITVEGC) / total_C for pft in pfts],
+    pft_contrib=defined,
+    cmprt_pec=[[dd[pft][c] / total_C for pft in pfts] for n, c in COMPARTMENT_INITVEGC],
+    cmprt_contrib=[[ok and dd[pft][c] > 0.0 for pft, ok in zip(pfts, defined)] for n, c in COMPARTMENT_INITVEGC],
+  )
+  _contribution_cache[key] = (mtimes, table)
+  return table
 
-  veg_param_ref_file = os.path.join(os.path.abspath(ref_params_dir), 'cmt_bgcvegetation.txt')
+def _compartment_index(compartment):
+  names = [n for n, c in COMPARTMENT_INITVEGC]
+  if compartment not in names:
+    raise RuntimeError("Invalid compartment specification: {}! Must be one of Leaf, Stem Root".format(compartment))
+  return names.index(compartment)
+
+def percent_ecosys_contribution(cmtstr, tname=None, pftnum=None, compartment=None, ref_params_dir=None):
+
+  pec = 1.0 # Start by assuming everythign has a contribution of 1
 
   if tname == 'OrganicNitrogenSum' or tname == 'AvailableNitrogenSum':
     # These parameters are in cmt_bgcsoil.txt as 'initsoln' and 'initavln'
@@ -927,62 +1201,24 @@ def percent_ecosys_contribution(cmtstr, tname=None, pftnum=None, compartment=Non
     pec = 1.0
 
   if pftnum is not None and compartment is None:
-
-    d = get_CMT_datablock(veg_param_ref_file, int(cmtstr.upper().lstrip('CMT')))
-    dd = cmtdatablock2dict(d)
-
-    pftstr = 'pft{}'.format(pftnum)
-    pft_total_init_c = dd[pftstr]['initvegcl'] + dd[pftstr]['initvegcw'] + dd[pftstr]['initvegcr']
-    pec = pft_total_init_c / total_C
+    pec = ecosys_contribution_table(cmtstr, ref_params_dir)['pft_pec'][pftnum]
 
   if pftnum is not None and compartment is not None:
-    total = get_ecosystem_total_C(cmtstr, ref_params_dir)
-
-    d = get_CMT_datablock(veg_param_ref_file, int(cmtstr.upper().lstrip('CMT')))
-    dd = cmtdatablock2dict(d)
-    pftstr = 'pft{}'.format(pftnum)
-
-    if compartment == 'Leaf':
-      c = 'initvegcl'
-    elif compartment == 'Stem':
-      c = 'initvegcw'
-    elif compartment == 'Root':
-      c = 'initvegcr'
-    else:
-      raise RuntimeError("Invalid compartment specification: {}! Must be one of Leaf, Stem Root".format(compartment)) 
-
-    pec = dd[pftstr][c] / total_C
+    pec = ecosys_contribution_table(cmtstr, ref_params_dir)['cmprt_pec'][_compartment_index(compartment)][pftnum]
 
   #print "cmtstr: {}  tname: {}  pftnum: {}  compartment: {}  PEC: {}".format(cmtstr, tname, pftnum, compartment, pec)
   return pec
 
 def is_ecosys_contributor(cmtstr, pftnum=None, compartment=None, ref_params_dir=None):
 
-  pftstr = 'pft{}'.format(pftnum)
-
-  d = get_CMT_datablock(os.path.join(os.path.abspath(ref_params_dir), 'cmt_bgcvegetation.txt'), int(cmtstr.upper().lstrip('CMT')))
-  dd = cmtdatablock2dict(d)
-
   is_contrib = True
 
   if pftnum is not None:
-
-    if dd[pftstr]['name'].lower() in 'none,misc,misc.,pft0,pft1,pft2,pft3,pft4,pft5,pft6,pft7,pft8,pft9'.split(","):
-      is_contrib = False
+    table = ecosys_contribution_table(cmtstr, ref_params_dir)
+    if compartment is not None:
+      is_contrib = table['cmprt_contrib'][_compartment_index(compartment)][pftnum]
     else:
-      
-      if compartment is not None:
-        if compartment == 'Leaf':
-          c = 'initvegcl'
-        elif compartment == 'Stem':
-          c = 'initvegcw'
-        elif compartment == 'Root':
-          c = 'initvegcr'
-        else:
-          raise RuntimeError("Invalid compartment specification: {}! Must be one of Leaf, Stem Root".format(compartment))    
-
-        if dd[pftstr][c] <= 0.0:
-          is_contrib = False
+      is_contrib = table['pft_contrib'][pftnum]
 
   return is_contrib
 
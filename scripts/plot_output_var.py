@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 
+import os
 import sys
 import netCDF4 as nc
 import numpy as np
@@ -12,6 +13,10 @@ import matplotlib.gridspec as gridspec
 import argparse
 import textwrap
 
+# Add dvm-dos-tem directory to path so that we can import output_utils.
+# Assumes that this script is living in the dvm-dos-tem/scripts/ directory.
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+import scripts.output_utils as ou
 
 
 
@@ -27,6 +32,10 @@ if __name__ == '__main__':
       panning and zooming.
 
       Determines variable name by any netCDF var that is not time.
+
+      Only the selected pixel is read. If a pixel-major cache has been built
+      for the file (see the transpose-cache command in output_utils.py) the
+      time series is read from the cache, which is much faster for long runs.
     ''')
   )
 
@@ -84,26 +93,26 @@ if __name__ == '__main__':
           plotting_var = var
           print("plotting var: " + plotting_var)
 
+      Y, X = args.yx
+
       if args.timesteps is not None:
         time_start = args.timesteps[0]
         time_end = args.timesteps[1]
-        nc_data = ncFile.variables[plotting_var][time_start:time_end,:]
+        nc_data = ou.read_pixel_series(args.file, plotting_var, Y, X, slice(time_start, time_end))
         time_range = np.arange(time_start,time_end)
       else:
-        nc_data = ncFile.variables[plotting_var][:,:]
+        nc_data = ou.read_pixel_series(args.file, plotting_var, Y, X)
         time_range = np.arange(0, nc_data.shape[0])
 
       layer_start, layer_end = args.layers
 
-      Y, X = args.yx
-
       dim_count = len(nc_dims)
 
       print("pixel(Y,X): ({},{})".format(Y, X))
       print("dim count: " + str(dim_count)) 
       print("dimensions: " + str(nc_dims))
       print("variables: " + str(nc_vars))
-      print("shape: " + str(nc_data.shape))
+      print("shape: " + str(ncFile.variables[plotting_var].shape))
       print("selected time range size: {} start: {} end: {}".format(
           len(time_range), time_range[0], time_range[-1]))
 
@@ -121,7 +130,7 @@ if __name__ == '__main__':
       # Variables by time only
       # time, y?, x?
       if(dim_count == 3):
-        data = nc_data[:,Y,X]
+        data = nc_data
         fig, axes = plt.subplots(1,1, sharex=args.sharex, sharey=args.sharey)
         axes.plot(time_range, data)
 
@@ -129,7 +138,7 @@ if __name__ == '__main__':
       # Variables by PFT, Compartment, or Layer
       # time, [section], y?, x?
       if(dim_count == 4):
-        data = nc_data[:,:,Y,X]
+        data = nc_data
 
         # By PFT only
         if 'pft' in nc_dims:
@@ -224,7 +233,7 @@ if __name__ == '__main__':
 
         print("Plotting PFT: " + str(pft_choice))
 
-        data = nc_data[:,:,pft_choice,Y,X]
+        data = nc_data[:,:,pft_choice]
 
         fig, axes = plt.subplots(3,1, sharex=args.sharex, sharey=args.sharey)
   
@@ -19,8 +19,10 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
 
 import scripts.output_utils as ou
 import scripts.param_util as pu
+import scripts.archive_util as au
+import scripts.calstore as cs
 
-from calibration.InputHelper import InputHelper
+from calibration.InputHelper import InputHelper, JsonSchema
 
 # Paste this into IPython to see log output
 # import logging
@@ -51,7 +53,25 @@ def qcal_rank2(truth, value):
   return (truth - value)**2
 
 
-def measure_calibration_quality_nc(output_directory_path, ref_param_dir, ref_targets={}):
+# Calibration target names and the matching dvmdostem output variables.
+CALTARGET_TO_NCNAME = [
+  ('GPPAllIgnoringNitrogen','INGPP'),
+  ('NPPAllIgnoringNitrogen','INNPP'),
+  ('NPPAll','NPP'),
+  #('Nuptake','NUPTAKE'), # ??? There are snuptake, lnuptake and innuptake... and TotNitrogentUptake is the sum of sn and ln...
+  ('VegCarbon','VEGC'),
+  ('VegStructuralNitrogen','VEGN'),
+  ('MossDeathC','MOSSDEATHC'),
+  ('CarbonShallow','SHLWC'),
+  ('CarbonDeep','DEEPC'),
+  ('CarbonMineralSum','MINEC'),
+  ('OrganicNitrogenSum','ORGN'),
+  ('AvailableNitrogenSum','AVLN'),
+]
+
+COMPARTMENTS = ['Leaf', 'Stem', 'Root']
+
+def measure_calibration_quality_nc(output_directory_path, ref_param_dir, ref_targets={}, y=0, x=0):
   '''
   Parameters
   ----------
@@ -64,6 +84,8 @@ def measure_calibration_quality_nc(output_directory_path, ref_param_dir, ref_tar
   ref_param_dir : str
     Path to a directory that must have a cmt_bgcvegetation.txt file in it
     to use for looking up the percent ecosystem contribution.
+  y, x : int
+    The pixel to measure.
   '''
 
   # There are two ways we could treat a netcdf dataset:
@@ -71,12 +93,13 @@ def measure_calibration_quality_nc(output_directory_path, ref_param_dir, ref_tar
   # 2) average over all the pixels of the same (specified) CMT in a dataset
   # For now starting with the simple case of just considering one pixel.
 
-  Y = 0
-  X = 0
+  Y = y
+  X = x
   last_N_yrs = 10
 
-  with nc.Dataset(os.path.join(output_directory_path, 'CMTNUM_yearly_eq.nc'), 'r') as ds:
-    data = ds.variables['CMTNUM'][-last_N_yrs:,Y,X]
+  outputs = ou.RunOutputs(output_directory_path)
+
+  data = outputs.get('CMTNUM', 'yearly', ['eq'])[-last_N_yrs:,Y,X]
 
   assert(data.min() == data.max()) # should be the same CMT for the whole time frame
   cmtkey = 'CMT{:02d}'.format(data[0])
@@ -86,34 +109,21 @@ def measure_calibration_quality_nc(output_directory_path, ref_param_dir, ref_tar
   w_qcr = 0.0
   w_qcr_2 = 0.0
 
-  caltarget_to_ncname_map = [
-    ('GPPAllIgnoringNitrogen','INGPP'),
-    ('NPPAllIgnoringNitrogen','INNPP'),
-    ('NPPAll','NPP'),
-    #('Nuptake','NUPTAKE'), # ??? There are snuptake, lnuptake and innuptake... and TotNitrogentUptake is the sum of sn and ln...
-    ('VegCarbon','VEGC'),
-    ('VegStructuralNitrogen','VEGN'),
-    ('MossDeathC','MOSSDEATHC'),
-    ('CarbonShallow','SHLWC'),
-    ('CarbonDeep','DEEPC'),
-    ('CarbonMineralSum','MINEC'),
-    ('OrganicNitrogenSum','ORGN'),
-    ('AvailableNitrogenSum','AVLN'),
-  ]
-
   final_data = []
   #print("variable value target rank(abs)")
-  for ctname, ncname in caltarget_to_ncname_map:
+  for ctname, ncname in CALTARGET_TO_NCNAME:
 
-    data, dims = ou.get_last_n_eq(ncname, 'yearly', output_directory_path, n=last_N_yrs)
-    dsizes, dnames = list(zip(*dims))
+    # Only read the last N years for the pixel being measured.
+    ncvar = outputs.get(ncname, 'yearly', ['eq'])
+    data = ncvar[-last_N_yrs:, ..., Y, X]
+    dnames = ncvar.dimensions
 
-    #print(ctname, output_directory_path, ncname, dims, dnames, dsizes)
+    #print(ctname, output_directory_path, ncname, dnames, data.shape)
 
     if dnames == ('time','y','x'):
       pec = pu.percent_ecosys_contribution(cmtkey, ctname, ref_params_dir=ref_param_dir)
       truth = ref_targets[cmtkey][ctname]
-      value = data[:,Y,X].mean()
+      value = data.mean()
       #print ctname, value, truth, np.abs(qcal_rank(truth, value))
 
       # Unweighted Rank
@@ -127,12 +137,12 @@ def measure_calibration_quality_nc(output_directory_path, ref_param_dir, ref_tar
       d = dict(cmt=cmtkey, ctname=ctname,value=value,truth=truth,qcr=np.abs(qcal_rank(truth, value)), qcr_w=np.abs(qcal_rank(truth, value)) * pec)
       final_data.append(d)
 
-    elif dnames == ('time','y','x','pft'):
+    elif dnames == ('time','pft','y','x'):
       for pft in range(0,10):
         if pu.is_ecosys_contributor(cmtkey, pft, ref_params_dir=ref_param_dir):
           pec = pu.percent_ecosys_contribution(cmtkey, ctname, pftnum=pft, ref_params_dir=ref_param_dir)
           truth = ref_targets[cmtkey][ctname][pft]
-          value = data[:,pft,Y,X].mean()
+          value = data[:,pft].mean()
 
           # Unweighted Rank
           qcr += np.abs(qcal_rank(truth, value))
@@ -149,7 +159,7 @@ def measure_calibration_quality_nc(output_directory_path, ref_param_dir, ref_tar
           pass
           #print "  -> Failed" # contributor test! Ignoring pft:{}, caltarget:{}, output:{}".format(pft, ctname, ncname)
 
-    elif dnames == ('time','y','x','pft','pftpart'):
+    elif dnames == ('time','pftpart','pft','y','x'):
       for pft in range(0,10):
         clu = {0:'Leaf', 1:'Stem', 2:'Root'}
         for cmprt in range(0,3):
@@ -157,7 +167,7 @@ def measure_calibration_quality_nc(output_directory_path, ref_param_dir, ref_tar
           if pu.is_ecosys_contributor(cmtkey, pft, clu[cmprt], ref_params_dir=ref_param_dir):
             pec = pu.percent_ecosys_contribution(cmtkey, ctname, pftnum=pft, compartment=clu[cmprt], ref_params_dir=ref_param_dir)
             truth = ref_targets[cmtkey][ctname][clu[cmprt]][pft]
-            value = data[:,cmprt,pft,Y,X].mean()
+            value = data[:,cmprt,pft].mean()
             # Unweighted Rank
             qcr += np.abs(qcal_rank(truth, value))
             qcr_2 += qcal_rank2(truth, value)
@@ -178,54 +188,222 @@ def measure_calibration_quality_nc(output_directory_path, ref_param_dir, ref_tar
 
   return final_data
 
-class QCal(object):
-  def __init__(self,jsondata_path="", ncdata_path="", ref_targets_dir="", ref_params_dir="", y=None, x=None):
-    # This is basically a complicated mechanism to make sure that importing 
-    # the targets file is possible, even in the case where the user is specifying
-    # that the reference targets file is in a directory that does not have
-    # an __init__.py. In the case that the calibration targets file is in a 
-    # different folder from this script and we are using python <3.3 I think, 
-    # then there must be an __init__.py file so that the containing folder is
-    # treated as a package and the calibration_targets.py module is importable.
-    # Basically if we can't find __init__.py, then we copy to /tmp where
-    # we can make the __init__.py file, then we import and clean up after ourselves.
-    # Hopefully this implentation will work on multiuser systems and allow for
-    # importing targets from another user's directory. This is probably some 
-    # awful gaping security hole, but we are going to ignore that for now...
-    if not os.path.isfile(os.path.join(ref_targets_dir,  'calibration_targets.py')):
-      print("ERROR: Can't find calibration_targets.py in {}".format(ref_targets_dir))
-      sys.exit(-1)
+def target_table(cmtkey, ctname, dnames, ref_targets, ref_param_dir):
+  '''
+  Builds arrays of the target values, ecosystem contribution weights and
+  contributor flags for one calibration target and CMT, shaped like the
+  non-time, non-spatial dimensions of the matching output variable: () for
+  (time,y,x), (pft,) for (time,pft,y,x) and (pftpart,pft) for
+  (time,pftpart,pft,y,x). Non contributors have a weight of zero.
+
+  Returns a tuple (truth, pec, contrib).
+  '''
+  if dnames == ('time','y','x'):
+    truth = np.array(ref_targets[cmtkey][ctname], dtype=float)
+    pec = np.array(pu.percent_ecosys_contribution(cmtkey, ctname, ref_params_dir=ref_param_dir))
+    return truth, pec, np.array(True)
+
+  table = pu.ecosys_contribution_table(cmtkey, ref_param_dir)
+
+  if dnames == ('time','pft','y','x'):
+    truth = np.array(ref_targets[cmtkey][ctname], dtype=float)
+    contrib = np.array(table['pft_contrib'])
+    return truth, np.where(contrib, table['pft_pec'], 0.0), contrib
+
+  elif dnames == ('time','pftpart','pft','y','x'):
+    truth = np.array([ref_targets[cmtkey][ctname][c] for c in COMPARTMENTS], dtype=float)
+    contrib = np.array(table['cmprt_contrib'])
+    return truth, np.where(contrib, table['cmprt_pec'], 0.0), contrib
+
+  else:
+    raise RuntimeError("Unexpected dimensions for {}: {}".format(ctname, dnames))
+
+
+def measure_calibration_quality_nc_map(output_directory_path, ref_param_dir, ref_targets={},
+    last_N_yrs=10, ref_run_status=None):
+  '''
+  Like measure_calibration_quality_nc(..), but for every active pixel in
+  the domain at once. Pixels are grouped by their CMT (from
+  CMTNUM_yearly_eq.nc) and the targets and ecosystem contribution weights
+  for each CMT are broadcast across the pixels of that CMT, so there are no
+  loops over pixels, PFTs or compartments.
+
+  Pixels that failed (run_status < 0, if `ref_run_status` is given), that
+  change CMT during the last N years or that have a CMT without targets are
+  left out (nan in the maps).
+
+  Returns a dict of (y, x) maps: 'cmt', 'qcr', 'qcr_2', 'w_qcr' and 'w_qcr_2'.
+  '''
+  outputs = ou.RunOutputs(output_directory_path)
+
+  cmtnum = outputs.get('CMTNUM', 'yearly', ['eq'])[-last_N_yrs:]
+  shape = cmtnum.shape[1:]
+  cmt = np.ma.filled(cmtnum[-1], -1).astype(int)
+
+  active = ~np.ma.getmaskarray(cmtnum).any(axis=0) & np.all(cmtnum == cmtnum[-1], axis=0).filled(False)
+  if np.any(~active & ~np.ma.getmaskarray(cmtnum[-1])):
+    print("WARNING! Ignoring {} pixels with a CMT that changes over the last {} years.".format(
+        np.sum(~active & ~np.ma.getmaskarray(cmtnum[-1])), last_N_yrs))
+  if ref_run_status is not None:
+    active &= ou.PixelIndex.load(ref_run_status=ref_run_status).active_mask()
+
+  for c in np.unique(cmt[active]):
+    if 'CMT{:02d}'.format(c) not in ref_targets:
+      print("WARNING! No calibration targets for CMT{:02d}, ignoring {} pixels.".format(c, np.sum(active & (cmt == c))))
+      active &= cmt != c
+
+  result = dict(cmt=np.ma.masked_where(~active, cmt))
+  if not np.any(active):
+    print("WARNING! No pixels left to measure.")
+    for k in ['qcr', 'qcr_2', 'w_qcr', 'w_qcr_2']:
+      result[k] = np.full(shape, np.nan)
+    return result
+
+  flat = np.nonzero(active.ravel())[0]
+  cmtkeys, which = np.unique(cmt.ravel()[flat], return_inverse=True)
+  cmtkeys = ['CMT{:02d}'.format(c) for c in cmtkeys]
+
+  maps = dict((k, np.zeros(len(flat))) for k in ['qcr', 'qcr_2', 'w_qcr', 'w_qcr_2'])
+
+  for ctname, ncname in CALTARGET_TO_NCNAME:
+    ncvar = outputs.get(ncname, 'yearly', ['eq'])
+
+    # Mean over the last N years (or all of them, for a shorter run), one
+    # year in memory at a time.
+    first = max(0, len(ncvar) - last_N_yrs)
+    value = np.zeros(ncvar.shape[1:-2] + (len(flat),))
+    for t in range(first, len(ncvar)):
+      value += np.ma.filled(ncvar[t], np.nan).reshape(ncvar.shape[1:-2] + (-1,))[..., flat]
+    value = np.moveaxis(value / (len(ncvar) - first), -1, 0)
+
+    # (CMT, ...) tables, expanded to (pixel, ...) by each pixel's CMT.
+    tables = [target_table(k, ctname, ncvar.dimensions, ref_targets, ref_param_dir) for k in cmtkeys]
+    truth, pec, contrib = [np.array([t[i] for t in tables])[which] for i in range(3)]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+      rank = np.where(contrib, np.abs(qcal_rank(truth, value)), 0.0)
+      rank2 = np.where(contrib, qcal_rank2(truth, value), 0.0)
+
+    extra = tuple(range(1, value.ndim))
+    maps['qcr'] += rank.sum(axis=extra)
+    maps['qcr_2'] += rank2.sum(axis=extra)
+    maps['w_qcr'] += (rank * pec).sum(axis=extra)
+    maps['w_qcr_2'] += (rank2 * pec).sum(axis=extra)
+
+  for k, v in maps.items():
+    m = np.full(int(np.prod(shape)), np.nan)
+    m[flat] = v
+    result[k] = m.reshape(shape)
+  return result
+
+
+def write_qcr_maps(maps, path):
+  '''Writes the maps from measure_calibration_quality_nc_map(..) to a netCDF file.'''
+  with nc.Dataset(path, 'w') as ds:
+    ds.createDimension('y', maps['cmt'].shape[0])
+    ds.createDimension('x', maps['cmt'].shape[1])
+    v = ds.createVariable('cmt', 'i4', ('y', 'x'), fill_value=-1)
+    v.long_name = "community type"
+    v[:] = maps['cmt']
+    for k, long_name in [('qcr', 'calibration quality rank, sum of |value/target - 1|'),
+                         ('qcr_2', 'calibration quality rank, sum of (target - value)^2'),
+                         ('w_qcr', 'qcr weighted by ecosystem contribution'),
+                         ('w_qcr_2', 'qcr_2 weighted by ecosystem contribution')]:
+      v = ds.createVariable(k, 'f8', ('y', 'x'), zlib=True, fill_value=np.nan)
+      v.long_name = long_name
+      v[:] = maps[k]
+
+
+def qcr_cmt_summary(maps):
+  '''
+  Summarizes the maps from measure_calibration_quality_nc_map(..) by CMT.
+  Returns a list of dicts (one per CMT) with the pixel count and the mean,
+  median, min and max of the unweighted and weighted QCR.
+  '''
+  cmt = maps['cmt'].compressed()
+  summary = []
+  for c in np.unique(cmt):
+    sel = (maps['cmt'] == c).filled(False)
+    d = dict(cmt='CMT{:02d}'.format(c), pixels=int(sel.sum()))
+    for k in ['qcr', 'w_qcr']:
+      d[k+'_mean'] = np.mean(maps[k][sel])
+      d[k+'_median'] = np.median(maps[k][sel])
+      d[k+'_min'] = np.min(maps[k][sel])
+      d[k+'_max'] = np.max(maps[k][sel])
+    summary.append(d)
+  return summary
+
+
+def format_qcr_summary(summary):
+  '''Formats the output of qcr_cmt_summary(..) as a text table.'''
+  cols = ['pixels'] + ['{}_{}'.format(k, s) for k in ['qcr', 'w_qcr'] for s in ['mean', 'median', 'min', 'max']]
+  lines = ["{:<6} ".format('cmt') + " ".join("{:>12}".format(c) for c in cols)]
+  for d in summary:
+    lines.append("{:<6} {:>12d} ".format(d['cmt'], d['pixels']) + " ".join("{:>12.4g}".format(d[c]) for c in cols[1:]))
+  return "\n".join(lines)
+
+
+def load_targets(ref_targets_dir):
+  '''
+  Imports the calibration_targets.py file from `ref_targets_dir` and returns
+  the targets as a dict keyed by CMT (e.g. 'CMT05').
+  '''
+  # This is basically a complicated mechanism to make sure that importing 
+  # the targets file is possible, even in the case where the user is specifying
+  # that the reference targets file is in a directory that does not have
+  # an __init__.py. In the case that the calibration targets file is in a 
+  # different folder from this script and we are using python <3.3 I think, 
+  # then there must be an __init__.py file so that the containing folder is
+  # treated as a package and the calibration_targets.py module is importable.
+  # Basically if we can't find __init__.py, then we copy to /tmp where
+  # we can make the __init__.py file, then we import and clean up after ourselves.
+  # Hopefully this implentation will work on multiuser systems and allow for
+  # importing targets from another user's directory. This is probably some 
+  # awful gaping security hole, but we are going to ignore that for now...
+  if not os.path.isfile(os.path.join(ref_targets_dir,  'calibration_targets.py')):
+    print("ERROR: Can't find calibration_targets.py in {}".format(ref_targets_dir))
+    sys.exit(-1)
+  else:
+    if not os.path.isfile(os.path.join(ref_targets_dir, '__init__.py')):
+      print("WARNING: No __init__.py python package file present. Copying targets to a temporary location for facilitate import")
+      mkdir_p(os.path.join('/tmp/', 'dvmdostem-user-{}-tmp-cal'.format(os.getuid())))
+      shutil.copy(os.path.join(ref_targets_dir, 'calibration_targets.py'), os.path.join('/tmp/', 'dvmdostem-user-{}-tmp-cal'.format(os.getuid())))
+      with open(os.path.join('/tmp/','dvmdostem-user-{}-tmp-cal'.format(os.getuid()),'__init__.py'), 'w') as f:
+        f.writelines(["# nothing to see here..."]) 
+
+      old_path = sys.path
+      sys.path = [os.path.join('/tmp/','dvmdostem-user-{}-tmp-cal'.format(os.getuid()))]
+      print("Loading calibration_targets from : {}".format(sys.path))
+      import calibration_targets as ct
+      caltargets = {'CMT{:02d}'.format(v['cmtnumber']):v for k, v in iter(ct.calibration_targets.items())}
+      del ct
+
+      print("Cleaning up temporary targets and __init__.py file used for import...")
+      shutil.rmtree(os.path.join('/tmp/','dvmdostem-user-{}-tmp-cal'.format(os.getuid())))
+      print("Resetting path...")
+      sys.path = old_path
+
     else:
-      if not os.path.isfile(os.path.join(ref_targets_dir, '__init__.py')):
-        print("WARNING: No __init__.py python package file present. Copying targets to a temporary location for facilitate import")
-        mkdir_p(os.path.join('/tmp/', 'dvmdostem-user-{}-tmp-cal'.format(os.getuid())))
-        shutil.copy(os.path.join(ref_targets_dir, 'calibration_targets.py'), os.path.join('/tmp/', 'dvmdostem-user-{}-tmp-cal'.format(os.getuid())))
-        with open(os.path.join('/tmp/','dvmdostem-user-{}-tmp-cal'.format(os.getuid()),'__init__.py'), 'w') as f:
-          f.writelines(["# nothing to see here..."]) 
-
-        old_path = sys.path
-        sys.path = [os.path.join('/tmp/','dvmdostem-user-{}-tmp-cal'.format(os.getuid()))]
-        print("Loading calibration_targets from : {}".format(sys.path))
-        import calibration_targets as ct
-        caltargets = {'CMT{:02d}'.format(v['cmtnumber']):v for k, v in iter(ct.calibration_targets.items())}
-        del ct
-
-        print("Cleaning up temporary targets and __init__.py file used for import...")
-        shutil.rmtree(os.path.join('/tmp/','dvmdostem-user-{}-tmp-cal'.format(os.getuid())))
-        print("Resetting path...")
-        sys.path = old_path
+      old_path = sys.path
+      sys.path = [os.path.join(ref_targets_dir, 'calibration')]
+      print("Loading calibration_targets from : {}".format(sys.path))
+      import calibration_targets as ct
+      caltargets = {'CMT{:02d}'.format(v['cmtnumber']):v for k, v in iter(ct.calibration_targets.items())}
+      del ct
+      print("Resetting path...")
+      sys.path = old_path
 
-      else:
-        old_path = sys.path
-        sys.path = [os.path.join(ref_targets_dir, 'calibration')]
-        print("Loading calibration_targets from : {}".format(sys.path))
-        import calibration_targets as ct
-        caltargets = {'CMT{:02d}'.format(v['cmtnumber']):v for k, v in iter(ct.calibration_targets.items())}
-        del ct
-        print("Resetting path...")
-        sys.path = old_path
-
-    self.targets = caltargets
+  return caltargets
+
+
+class QCal(object):
+  def __init__(self,jsondata_path="", ncdata_path="", ref_targets_dir="", ref_params_dir="", y=None, x=None, targets=None):
+    # Importing the targets is slow and messes with sys.path, so callers
+    # scoring many runs can load them once and pass them in.
+    if targets is None:
+      targets = load_targets(ref_targets_dir)
+
+    self.targets = targets
     self.targets_dir = ref_targets_dir
     self.params_dir = ref_params_dir
 
@@ -240,7 +418,8 @@ class QCal(object):
 
 
   def json_qcal(self):
-    ih = InputHelper(self.jsondata_path)
+    # The stage only matters if the data is in a calibration store.
+    ih = InputHelper(self.jsondata_path, stage='eq')
     assert(os.path.splitext(ih.files()[0])[1] == ".json")
     result_list = measure_calibration_quality_json(ih.files()[-10:], ref_targets=self.targets, ref_params_dir=self.params_dir)
     return result_list
@@ -248,10 +427,16 @@ class QCal(object):
 
   def nc_qcal(self):
     assert(os.path.splitext(os.listdir(self.ncdata_path)[0])[1] == ".nc")
-    result_list = measure_calibration_quality_nc(self.ncdata_path, ref_targets=self.targets, ref_param_dir=self.params_dir)
+    result_list = measure_calibration_quality_nc(self.ncdata_path, ref_targets=self.targets, ref_param_dir=self.params_dir, y=self.Y, x=self.X)
     return result_list
 
 
+  def nc_qcal_map(self, ref_run_status=None):
+    '''QCR maps for every pixel, see measure_calibration_quality_nc_map(..)'''
+    return measure_calibration_quality_nc_map(self.ncdata_path, ref_targets=self.targets,
+        ref_param_dir=self.params_dir, ref_run_status=ref_run_status)
+
+
   def report(self, which):
     if which == 'json':
       r = self.json_qcal()
@@ -289,11 +474,14 @@ def measure_calibration_quality_json(file_list, ref_params_dir=None, ref_targets
 
 
   #print "************* WORKING WITH JSON FILES ***********"
+  # Read all the files once, as rows of a structured array (see JsonSchema).
   # Figure out which community type was run by looking at the first json file
   # in the list. Assume that ALL json files have the same CMT!
-  with open(file_list[0]) as f1:
-    f1_data = json.load(f1)
-    cmtkey = f1_data['CMT']
+  f1_data = au.load_json(file_list[0])
+  cmtkey = f1_data['CMT']
+  records, ok = JsonSchema(f1_data).load(file_list)
+  if not ok.all():
+    raise RuntimeError("Unable to read json file(s): {}".format([f for f, good in zip(file_list, ok) if not good]))
 
   data = []
   #print "CMT: ", cmtkey
@@ -302,11 +490,7 @@ def measure_calibration_quality_json(file_list, ref_params_dir=None, ref_targets
   # First process all the non-PFT variables
   for v in 'MossDeathC,CarbonShallow,CarbonDeep,CarbonMineralSum,OrganicNitrogenSum,AvailableNitrogenSum'.split(','):
     pec = pu.percent_ecosys_contribution(cmtkey, v, ref_params_dir=ref_params_dir)
-    d = 0.0
-    for f in file_list:
-      with open(f) as fh:
-        jdata = json.load(fh)
-      d += jdata[v]/float(len(file_list))
+    d = records[v].mean()
 
     if np.isclose(ref_targets[cmtkey][v], 0.0):
       print("WARNING! Target value for {} is zero! Is this a problem???".format(v))
@@ -326,11 +510,7 @@ def measure_calibration_quality_json(file_list, ref_params_dir=None, ref_targets
     if pu.is_ecosys_contributor(cmtkey, ipft, ref_params_dir=ref_params_dir):
       for v in ['GPPAllIgnoringNitrogen','NPPAllIgnoringNitrogen','NPPAll']:
         pec = pu.percent_ecosys_contribution(cmtkey, v, pftnum=ipft, ref_params_dir=ref_params_dir)
-        d = 0.0
-        for f in file_list:
-          with open(f) as fh:
-            jdata = json.load(fh)
-          d += jdata[pft][v]/float(len(file_list))
+        d = records['{}.{}'.format(pft, v)].mean()
         qcr = np.abs(qcal_rank(ref_targets[cmtkey][v][ipft], d))
         qcr_w = qcr * pec
         qcr_t += qcr
@@ -345,11 +525,7 @@ def measure_calibration_quality_json(file_list, ref_params_dir=None, ref_targets
       if pu.is_ecosys_contributor(cmtkey, ipft, cmprt, ref_params_dir=ref_params_dir):
         for v in ['VegCarbon', 'VegStructuralNitrogen']:
           pec = pu.percent_ecosys_contribution(cmtkey, v, pftnum=ipft, compartment=cmprt, ref_params_dir=ref_params_dir)
-          d = 0.0
-          for f in file_list:
-            with open(f) as fh:
-              jdata = json.load(fh)
-            d += jdata[pft][v][cmprt]/float(len(file_list))
+          d = records['{}.{}.{}'.format(pft, v, cmprt)].mean()
           truth = ref_targets[cmtkey][v][cmprt][ipft],
           qcr = np.abs(qcal_rank(ref_targets[cmtkey][v][cmprt][ipft], d))
           qcr_t += qcr
@@ -367,6 +543,156 @@ def measure_calibration_quality_json(file_list, ref_params_dir=None, ref_targets
   return data
 
 
+def run_json_source(run_dir):
+  '''
+  The json data for a run: its calibration store or eq-data.tar.gz if there
+  is one, else the directory.
+  '''
+  for name in [cs.DEFAULT_NAME, 'eq-data.tar.gz']:
+    if os.path.isfile(os.path.join(run_dir, name)):
+      return os.path.join(run_dir, name)
+  return run_dir
+
+def run_signature(run_dir, which, ref_targets_dir, ref_params_dir):
+  '''
+  A fingerprint (name, size and modification time) of the files that the
+  score for `run_dir` depends on: the outputs being scored plus the targets
+  and parameter files. If it hasn't changed the run doesn't need scoring
+  again.
+  '''
+  if which == 'json':
+    src = run_json_source(run_dir)
+    files = [src] if os.path.isfile(src) else glob.glob(os.path.join(src, 'calibration', 'yearly', '*.json'))
+  else:
+    files = glob.glob(os.path.join(run_dir, '*.nc'))
+  files = sorted(files) + [os.path.join(ref_targets_dir, 'calibration_targets.py'),
+      os.path.join(ref_params_dir, 'cmt_bgcvegetation.txt'), os.path.join(ref_params_dir, 'cmt_bgcsoil.txt')]
+  sig = []
+  for f in files:
+    st = os.stat(f)
+    sig.append([os.path.abspath(f), st.st_size, st.st_mtime])
+  return sig
+
+def _to_builtin(v):
+  '''Converts numpy scalars so results can be saved as json.'''
+  if isinstance(v, np.generic):
+    return v.item()
+  return v
+
+def _score_run(task):
+  '''Worker for batch_qcal(..), scores one run directory.'''
+  run_dir, which, targets, ref_params_dir, y, x = task
+  try:
+    if which == 'json':
+      q = QCal(jsondata_path=run_json_source(run_dir), ref_params_dir=ref_params_dir, targets=targets)
+      rows = q.json_qcal()
+    else:
+      q = QCal(ncdata_path=run_dir, ref_params_dir=ref_params_dir, targets=targets, y=y, x=x)
+      rows = q.nc_qcal()
+  except Exception as e:
+    return run_dir, None, "{}: {}".format(type(e).__name__, e)
+  return run_dir, [dict((k, _to_builtin(v)) for k, v in r.items()) for r in rows], None
+
+def batch_qcal(run_dirs, which='json', ref_targets_dir='calibration/', ref_params_dir='parameters/',
+    y=0, x=0, state_file=None, workers=None):
+  '''
+  Scores many calibration runs (e.g. the members of an ensemble) with a
+  pool of `workers` processes and ranks them by weighted QCR. The targets
+  are imported once, up front.
+
+  If `state_file` is given the per-target results for each run are saved
+  there, along with a signature of the files they came from (see
+  run_signature(..)), and runs that haven't changed since the last time are
+  not scored again.
+
+  Returns a tuple (ranked, errors): `ranked` is a list of dicts, best run
+  first, with 'run', 'cmt', 'qcr', 'w_qcr' and 'rows' (the per-target
+  breakdown, see measure_calibration_quality_json(..)); `errors` maps run
+  directories that couldn't be scored to the error message.
+  '''
+  import multiprocessing
+
+  state = {}
+  if state_file is not None and os.path.isfile(state_file):
+    with open(state_file) as f:
+      state = json.load(f)
+    if state.get('which') != which or state.get('pixel') != [y, x]:
+      state = {}
+  runs = state.get('runs', {})
+
+  todo = []
+  signatures = {}
+  for d in run_dirs:
+    signatures[d] = run_signature(d, which, ref_targets_dir, ref_params_dir)
+    if d not in runs or runs[d]['signature'] != signatures[d]:
+      todo.append(d)
+  print("Scoring {} of {} runs ({} unchanged)...".format(len(todo), len(run_dirs), len(run_dirs) - len(todo)))
+
+  errors = {}
+  if len(todo) > 0:
+    targets = load_targets(ref_targets_dir)
+    tasks = [(d, which, targets, ref_params_dir, y, x) for d in todo]
+    pool = multiprocessing.Pool(workers)
+    try:
+      for i, (d, rows, err) in enumerate(pool.imap_unordered(_score_run, tasks), 1):
+        if err is not None:
+          print("[{}/{}] FAILED {} ({})".format(i, len(tasks), d, err))
+          errors[d] = err
+          runs.pop(d, None)
+        else:
+          print("[{}/{}] {}".format(i, len(tasks), d))
+          runs[d] = dict(signature=signatures[d], rows=rows)
+      pool.close()
+    except BaseException:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
+
+  if state_file is not None:
+    with open(state_file + '.tmp', 'w') as f:
+      json.dump(dict(which=which, pixel=[y, x], runs=runs), f)
+    os.rename(state_file + '.tmp', state_file)
+
+  ranked = []
+  for d in run_dirs:
+    if d in errors:
+      continue
+    rows = runs[d]['rows']
+    ranked.append(dict(run=d, cmt=",".join(sorted(set(r['cmt'] for r in rows))),
+        qcr=np.sum([r['qcr'] for r in rows]), w_qcr=np.sum([r['qcr_w'] for r in rows]), rows=rows))
+  ranked.sort(key=lambda r: (r['w_qcr'], r['qcr']))
+  return ranked, errors
+
+def target_label(row):
+  '''Label for one row of a QCal result, e.g. 'VegCarbon:pft3:Leaf'.'''
+  label = row['ctname']
+  if 'pft' in row:
+    label += ':pft{}'.format(row['pft'])
+  if 'compartment' in row:
+    label += ':{}'.format(row['compartment'])
+  return label
+
+def write_batch_table(ranked, path):
+  '''
+  Writes the ranked results from batch_qcal(..) to a csv file: one line per
+  run with the rank, run, CMT, QCR, weighted QCR and then the weighted QCR
+  for each target.
+  '''
+  import csv
+  labels = []
+  for r in ranked:
+    for row in r['rows']:
+      if target_label(row) not in labels:
+        labels.append(target_label(row))
+  with open(path, 'w') as f:
+    w = csv.writer(f)
+    w.writerow(['rank', 'run', 'cmt', 'qcr', 'w_qcr'] + ['w_qcr:' + l for l in labels])
+    for i, r in enumerate(ranked, 1):
+      by_label = dict((target_label(row), row['qcr_w']) for row in r['rows'])
+      w.writerow([i, r['run'], r['cmt'], r['qcr'], r['w_qcr']] + [by_label.get(l, '') for l in labels])
+
+
 def print_report(jdata, caltargets):
 
   cmtkey = jdata['CMT']
@@ -455,11 +781,67 @@ if __name__ == '__main__':
   parser.add_argument("--ref-runmask", type=ref_runmask_validator, default=os.path.join('.'),
       help=textwrap.dedent('''Path to a folder with a run-mask.nc file in it.'''))
 
-  parser.add_argument("calfolder", type=cal_folder_validator, 
-      help=textwrap.dedent('''The folder where the program should look for calibration outputs from dvm-dos-tem'''))
+  parser.add_argument("--qcr-map", metavar="OUTFILE",
+      help=textwrap.dedent('''Instead of the single pixel reports, compute the
+        QCR for every active pixel in the calfolder netcdf outputs and write the
+        maps to OUTFILE (netcdf). A per-CMT summary is printed and written to
+        OUTFILE with a .txt extension. Failed pixels are left out if there is a
+        run_status.nc in the calfolder.'''))
+
+  parser.add_argument("--batch", metavar="OUTFILE",
+      help=textwrap.dedent('''Score all the calfolders (e.g. the members of an
+        ensemble) in parallel and write a table (csv) of the runs, ranked by
+        weighted QCR, with the weighted QCR for each target, to OUTFILE. Results
+        are kept in OUTFILE.state.json and runs whose outputs haven't changed
+        since the last time are not scored again.'''))
+
+  parser.add_argument("--which", choices=['json', 'nc'], default='json',
+      help=textwrap.dedent('''With --batch, the outputs to score: the json files
+        (eq-data.tar.gz or calibration/yearly/ in each calfolder) or the netcdf
+        files (at pixel 0,0).'''))
+
+  parser.add_argument("--workers", type=int, default=None,
+      help=textwrap.dedent('''With --batch, number of processes to use. Defaults
+        to the number of cores.'''))
+
+  parser.add_argument("calfolder", type=cal_folder_validator, nargs='+',
+      help=textwrap.dedent('''The folder where the program should look for calibration
+        outputs from dvm-dos-tem. More than one folder can be given with --batch.'''))
 
   args = parser.parse_args()
-  
+
+  if args.batch:
+    ranked, errors = batch_qcal(args.calfolder, which=args.which,
+        ref_targets_dir=args.ref_targets, ref_params_dir=args.ref_params,
+        state_file=args.batch + '.state.json', workers=args.workers)
+    write_batch_table(ranked, args.batch)
+    print("{:>5} {:>12} {:>12}  {}".format('rank', 'QCR', 'Weighted QCR', 'run'))
+    for i, r in enumerate(ranked, 1):
+      print("{:>5} {:>12.4f} {:>12.4f}  {}".format(i, r['qcr'], r['w_qcr'], r['run']))
+    if len(errors) > 0:
+      print("Failed to score {} runs:".format(len(errors)))
+      for d, err in errors.items():
+        print("  {}: {}".format(d, err))
+    print("Wrote {}".format(args.batch))
+    sys.exit(0)
+
+  if len(args.calfolder) > 1:
+    parser.error("Only one calfolder can be given without --batch.")
+  args.calfolder = args.calfolder[0]
+
+
+  if args.qcr_map:
+    qcal = QCal(ncdata_path=args.calfolder, y=0, x=0,
+        ref_targets_dir=args.ref_targets, ref_params_dir=args.ref_params)
+    run_status = os.path.join(args.calfolder, 'run_status.nc')
+    maps = qcal.nc_qcal_map(ref_run_status=run_status if os.path.isfile(run_status) else None)
+    write_qcr_maps(maps, args.qcr_map)
+    table = format_qcr_summary(qcr_cmt_summary(maps))
+    with open(os.path.splitext(args.qcr_map)[0] + '.txt', 'w') as f:
+      f.write(table + "\n")
+    print(table)
+    print("Wrote {}".format(args.qcr_map))
+    sys.exit(0)
 
   # Setup the parameters
 
@@ -71,12 +71,13 @@ def list_available_variables():
 def get_data(variable="", stages=['eq','sp','tr','sc'], timeres='yearly', pixel=(0,0)):
   y, x = pixel
 
-  d, units = ou.stitch_stages(variable, timeres, stages, fileprefix=DATA_DIR)
-  if len(d.shape) == 5:
-    d = ou.sum_across_compartments(d)
+  # List the folder on each call so files written since the server started
+  # are found, then only read the requested pixel from each stage's file.
+  d = ou.RunOutputs(DATA_DIR).get(variable, timeres, stages)[..., y, x]
+  if len(d.shape) == 3: # (time, pftpart, pft)
+    d = d.sum(axis=1)
   else:
     pass
-  d = d[:,y,x]
 
   # with nc.Dataset(DATA_DIR + '/{}_{}_{}.nc'.format(variable, timeres, stage)) as ds:
   #   print ds